@@ -2,6 +2,8 @@
 # Read RPV variable and make distributions #
 ############################################
 # With options for background subtraction, normalization, etc.
+# note: the functions below are also used by mcvsdata_fillconfig.py,
+#       which fills the histograms for a whole variable configuration in one read of each file.
 
 
 # import external modules
@@ -16,17 +18,20 @@ import ROOT
 from array import array
 # import framework modules
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),'..')))
-from fitting.count_peak import count_peak_unbinned
+from fitting.count_peak import count_peak_binned
 from reweighting.pileup.pileupreweighter import PileupReweighter
+import tools.eventindextools as eit
+import tools.histfilltools as hft
+import tools.parquettools as pt
+import tools.virtualtools as vt
 
 
-if __name__=='__main__':
-
-    sys.stderr.write('###starting###\n')
-
-    # ------------------------------------------------------------------------
-    # Get arguments
-    # ------------------------------------------------------------------------
+# ------------------------------------------------------------------------
+# Get arguments
+# ------------------------------------------------------------------------
+def get_parser():
+    ### get the command line argument parser
+    # note: also used by mcvsdata_fillconfig.py to parse the arguments of each set of histograms
     parser = argparse.ArgumentParser( description = 'Fill histograms' )
     # general arguments
     parser.add_argument('-i',   '--inputconfig',    required=True,  type=os.path.abspath)
@@ -35,7 +40,7 @@ if __name__=='__main__':
     parser.add_argument('-o',   '--outputfile',     required=True)
     parser.add_argument('-n',   '--nprocess',                       type=int,               default=-1)
     # arguments for background subtraction
-    parser.add_argument(        '--bkgmode',                                                default=None, 
+    parser.add_argument(        '--bkgmode',                                                default=None,
                                 choices=[None, 'sideband'])
     parser.add_argument(        '--sidevariable',                   type=os.path.abspath,   default=None)
     parser.add_argument(        '--sideplotdir',                                            default=None)
@@ -45,12 +50,19 @@ if __name__=='__main__':
     parser.add_argument(        '--normvariable',                   type=os.path.abspath,   default=None)
     parser.add_argument(        '--eventtreename',                                          default=None)
     # arguments for secondary binning
-    parser.add_argument(        '--yvariable',                      type=os.path.abspath,   default=None) 
-    args = parser.parse_args()
+    parser.add_argument(        '--yvariable',                      type=os.path.abspath,   default=None)
+    # arguments for memory usage
+    parser.add_argument(        '--chunksize',                      type=int,               default=-1,
+                                help='Number of entries to read at once (default: all entries)')
+    return parser
 
-    # ------------------------------------------------------------------------
-    # load input configuration
-    # ------------------------------------------------------------------------
+
+# ------------------------------------------------------------------------
+# load input configuration
+# ------------------------------------------------------------------------
+def load_inputconfig(args):
+    ### load the data and simulation samples
+    # returns a tuple of the form (datain, simin, totallumi)
     with open(args.inputconfig) as f:
         temp        = json.load(f)
     datain        = temp['datain']
@@ -70,8 +82,11 @@ if __name__=='__main__':
             print('    {}: {}'.format(key, val))
 
     # check if all input files exist
+    # (for merged files that are defined as virtual datasets, see tools/virtualtools.py,
+    #  the manifest is read instead)
     missing = []
     for sample in simin + datain:
+        sample['file'] = vt.get_datasetfile(sample['file'])
         if not os.path.exists(sample['file']):
             missing.append(sample['file'])
     if len(missing)>0:
@@ -87,9 +102,22 @@ if __name__=='__main__':
         print(' (luminosity values for data are only used for plot labels;')
         print(' the values for simulations are used in event weighting and to calculate the sum)')
 
-    # ------------------------------------------------------------------------
-    # load variable
-    # ------------------------------------------------------------------------
+    # set luminosity and xsection for simulation to 1 if no lumi scaling is requested
+    if args.normmode is None:
+        for simdict in simin:
+            simdict['luminosity'] = 1
+            simdict['xsection']   = 1
+
+    return (datain, simin, totallumi)
+
+
+# ------------------------------------------------------------------------
+# load variable
+# ------------------------------------------------------------------------
+def load_variables(args):
+    ### load the main, sideband, normalization and secondary variable
+    # returns a tuple of the form (variable, sidevariable, normvariable, yvariable),
+    # where the latter three are None if not requested
     # load main variable
     with open(args.variable) as f:
         variable = json.load(f)
@@ -135,296 +163,633 @@ if __name__=='__main__':
         print('Found following secondary variable:')
         for key,val in yvariable.items(): print('  {}: {}'.format(key,val))
 
-    # set luminosity and xsection for simulation to 1 if no lumi scaling is requested
-    if args.normmode is None:
-        for simdict in simin:
-            simdict['luminosity'] = 1
-            simdict['xsection']   = 1
+    return (variable, sidevariable, normvariable, yvariable)
 
 
-    # ------------------------------------------------------------------------
-    # define help function to process a single file:
-    #
-    #     input:  - single input file (+ tree name within that file)
-    #             - variable (name in the tree + binning)
-    #     output: - histogram in the form of two numpy arrays
-    #               holding the counts and corresponding errors 
-    #               of variable values in chosen binning,
-    #               potentially after background subtraction if requested;
-    #             - the resulting arrays are two-dimensional 
-    #               if a secondary variable is provided.
-    #     note:   - the counts are normalized to the provided xsection and lumi
-    #               (if isdata is False, else each value simply gets weight 1)
-    #     note:   - if variable is None, return sum of weights and corresponding error
-    # ------------------------------------------------------------------------
-    def get_histogram(inputfile, 
-                    treename, 
-                    variable        = None, 
-                    isdata          = False,
-                    yvariable       = None,
-                    xsection        = 1, 
-                    lumi            = 1, 
-                    weightvarname   = '_weight',
-                    splitparity     = None,
-                    splitbranch     = '_event',
-                    hcountername    = 'hCounter',
-                    sidevariable    = None,
-                    label           = None,
-                    nentries        = None,
-                    year            = None,          # for reweighter
-                    campaign        = None           # for reweighter 
-        ):
-        # open the file and read hcounter
-        print('Now running on file {}...'.format(inputfile))
-        with uproot.open(inputfile) as f:
-            sumweights            = 1             # default case for data, overwritten for simulation below
-            prescale              = None          # to implement later
-            if not isdata:
-                try: 
-                    sumweights     = f[hcountername].values()[0]
-                except:
-                    msg               = 'WARNING: isdata was set to False, but no valid hCounter found in file'
-                    msg               += ' (for provided key {}),'.format(hcountername)
-                    msg               += ' will use sum of weights = 1 for this sample.'
-                    msg               += ' Valid keys are {}'.format(f.keys())
-                    print(            msg)
-          
-            # get main tree and manage number of entries
-            tree                  = f[treename]
-            nentries_reweight     = 1.
-          
-            if( nentries is not None and nentries>0 and nentries<tree.num_entries ):
-                nentries_reweight   = tree.num_entries / nentries
-            else: nentries        = tree.num_entries
-            msg   =   'Tree {} was found to have {} entries,'.format(                     treename, tree.num_entries)
-            msg   +=  ' of which {} will be read (using reweighting factor {}).'.format(  nentries, nentries_reweight)
-            print(msg)
+# ------------------------------------------------------------------------
+# define help functions to process a single file:
+#
+#     input:  - single input file (+ tree name within that file)
+#             - variable (name in the tree + binning)
+#     output: - histogram in the form of two numpy arrays
+#               holding the counts and corresponding errors
+#               of variable values in chosen binning,
+#               potentially after background subtraction if requested;
+#             - the resulting arrays are two-dimensional
+#               if a secondary variable is provided.
+#     note:   - the counts are normalized to the provided xsection and lumi
+#               (if isdata is False, else each value simply gets weight 1)
+#     note:   - if variable is None, return sum of weights and corresponding error
+#     note:   - the reading of the file (weights and branches, see read_chunk)
+#               is separated from the filling of each histogram (see HistogramFiller),
+#               so that several histograms can be filled from one read (see get_histograms)
+#     note:   - the tree can be read in chunks of entries (see init_sample),
+#               in which case the sums of weights and squared weights
+#               (and the sideband histograms in each bin) are accumulated chunk by chunk,
+#               so that the memory use does not depend on the size of the file
+# ------------------------------------------------------------------------
+def get_parquetfilters(variable, yvariable=None, isdata=False, splitparity=None, nentries=None):
+    ### get the filters for reading a parquet dataset (see v0building/v0parquet.py)
+    # only read the entries in the range of the variables (using the row group statistics),
+    # if this does not affect the normalization (i.e. no MC split and no limited number of entries)
+    filters                   = []
+    if( variable is not None
+        and (nentries is None or nentries<=0)
+        and (isdata or splitparity not in ['even', 'odd']) ):
+        filters.append( (variable['variable'], '>', variable['bins'][0]) )
+        filters.append( (variable['variable'], '<', variable['bins'][-1]) )
+        if yvariable is not None:
+            filters.append( (yvariable['variable'], '>=', yvariable['bins'][0]) )
+            filters.append( (yvariable['variable'], '<=', yvariable['bins'][-1]) )
+    return filters
 
-            # Optional MC split: select only even/odd event numbers.
-            splitmask = None
-            if (not isdata) and (splitparity in ['even', 'odd']):
-                branch_to_use = splitbranch
-                if branch_to_use not in tree.keys() and splitbranch == '_event' and 'event' in tree.keys():
-                    branch_to_use = 'event'
-                if branch_to_use not in tree.keys():
-                    msg = 'ERROR: requested MC split on branch {}, but it is not in tree {}. Available branches include: {}'.format(
-                        splitbranch, treename, list(tree.keys())[:20])
-                    raise Exception(msg)
-                eventvalues = tree[branch_to_use].array(library='np', entry_stop=nentries)
-                paritymod = np.mod(eventvalues.astype(np.int64), 2)
-                if splitparity == 'even':
-                    splitmask = (paritymod == 0)
-                else:
-                    splitmask = (paritymod == 1)
-                nsel = int(np.count_nonzero(splitmask))
-                print('Applying MC split {} on branch {}: selected {}/{} entries.'.format(
-                    splitparity, branch_to_use, nsel, nentries))
-                if nsel == 0:
-                    msg = 'ERROR: MC split {} on branch {} selected 0 events.'.format(splitparity, branch_to_use)
-                    raise Exception(msg)
-
-            # get weights
-            if isdata: weights    = np.ones(nentries)
-            else:
-                rawweights          = tree[weightvarname].array(library='np', entry_stop=nentries)
-                if splitmask is not None:
-                    rawweights      = rawweights[splitmask]
-                    # Keep MC normalization correct for the selected split subset.
-                    sumweights      = np.sum(rawweights)
-                weights             = rawweights / sumweights * xsection * lumi
-            weights               = weights * nentries_reweight
-
-            # do reweighting
-            if not isdata:
-                print('Doing pileup reweighting...')
-               
-                #in case of per-era processing (need more elegant solution, but should work)
-                if year in ['2022postEEE', '2022postEEF', '2022postEEG']:
-                    year_pu         = '2022postEE'
-                elif '2022' in year:
-                    year_pu             = year.rstrip('BCD') # Watch out, does noy work for anything but 2022preEE
-                else:
-                    year_pu             = year.rstrip('BCDEFGHI') # Watch out, does noy work for anything but 2022preEE
-
-                pileupreweighter    = PileupReweighter(campaign, year_pu)
-                pileupreweighter.initsample(inputfile)
-                ntrueint            = tree['_nTrueInt'].array(library='np', entry_stop=nentries)
-                pileupreweight      = pileupreweighter.getreweight(ntrueint)
-                weights             = np.multiply(weights, pileupreweight)
-
-            # if no variable was specified, return sum of weights
-            if variable is None:
-                sumweights          = np.sum(weights)
-                error               = np.sqrt(np.sum(np.power(weights, 2)))
-            
-                return (sumweights, error, 0, 0)
-
-            # get the variable and some masks
-            varvalues             = tree[variable['variable']].array(library='np', entry_stop=nentries)
-            if splitmask is not None:
-                varvalues         = varvalues[splitmask]
-            nanmask               = np.isnan(varvalues)
-            rangemask             = ((varvalues > variable['bins'][0]) & (varvalues < variable['bins'][-1]))
-            totalmask             = ((~nanmask) & rangemask)
-
-            # initialize a dummy secondary variable if it was not provided
-            # (easier than if else statements below)
-            dim = 1
-            if yvariable is not None: dim = 2
+def get_opener(inputfile, filters=None):
+    ### get the function to open an input file (analogous to uproot.open)
+    # in case of a parquet dataset (see v0building/v0parquet.py),
+    # only read the entries passing the filters (see get_parquetfilters)
+    if pt.isparquet(inputfile):
+        filters               = [] if filters is None else filters
+        print('Reading parquet dataset with filters {}'.format(filters))
+        return lambda path: pt.open(path, filters=filters)
+    # in case of a virtual dataset (see tools/virtualtools.py),
+    # the constituent files are read as one chained file
+    elif vt.isvirtual(inputfile):
+        print('Reading virtual dataset')
+        return vt.open
+    return uproot.open
+
+def init_sample(f,
+                inputfile,
+                treename,
+                isdata          = False,
+                weightvarname   = '_weight',
+                splitparity     = None,
+                splitbranch     = '_event',
+                hcountername    = 'hCounter',
+                nentries        = None,
+                year            = None,          # for reweighter
+                campaign        = None,          # for reweighter
+                chunksize       = None
+    ):
+    ### initialize the reading of a tree
+    # input arguments:
+    # - f: opened input file (see get_opener)
+    # - inputfile: name of the input file (for the pileup reweighting)
+    # - chunksize: number of entries to read at once (default: all entries in one chunk)
+    # returns a dict with the sample settings and normalization, to be passed to read_chunk
+    sumweights            = 1             # default case for data, overwritten for simulation below
+    prescale              = None          # to implement later
+    if not isdata:
+        try:
+            sumweights     = f[hcountername].values()[0]
+        except:
+            msg               = 'WARNING: isdata was set to False, but no valid hCounter found in file'
+            msg               += ' (for provided key {}),'.format(hcountername)
+            msg               += ' will use sum of weights = 1 for this sample.'
+            msg               += ' Valid keys are {}'.format(f.keys())
+            print(            msg)
+
+    # get main tree and manage number of entries
+    tree                  = f[treename]
+    nentries_reweight     = 1.
+
+    if( nentries is not None and nentries>0 and nentries<tree.num_entries ):
+        nentries_reweight   = tree.num_entries / nentries
+    else: nentries        = tree.num_entries
+    msg   =   'Tree {} was found to have {} entries,'.format(                     treename, tree.num_entries)
+    msg   +=  ' of which {} will be read (using reweighting factor {}).'.format(  nentries, nentries_reweight)
+    print(msg)
+
+    # define the chunks of entries
+    if( chunksize is None or chunksize<=0 ): chunksize = max(nentries, 1)
+    chunks                = [(start, min(start+chunksize, nentries))
+                             for start in range(0, max(nentries, 1), chunksize)]
+    if len(chunks)>1: print('Reading tree {} in {} chunks of {} entries.'.format(treename, len(chunks), chunksize))
+
+    # in case of a normalized input file, per-event branches (e.g. weights and pileup)
+    # are not stored in the tree itself, but read from the per-event tree through the event index
+    eventoffsets          = None
+    eventbranchnames      = []
+    if eit.isnormalized(f, treename):
+        print('Tree {} is stored in normalized form, reading per-event branches through event index.'.format(treename))
+        eventoffsets      = eit.read_eventoffsets(f, treename)
+        eventbranchnames  = f[eit.eventtreename].keys()
+
+    sample                = ({
+        'treename':             treename,
+        'isdata':               isdata,
+        'weightvarname':        weightvarname,
+        'nentries':             nentries,
+        'nentries_reweight':    nentries_reweight,
+        'sumweights':           sumweights,
+        'chunks':               chunks,
+        'eventoffsets':         eventoffsets,
+        'splitparity':          None,
+        'splitbranch':          None,
+        'pileupreweighter':     None
+    })
+
+    # Optional MC split: select only even/odd event numbers.
+    if (not isdata) and (splitparity in ['even', 'odd']):
+        branch_to_use = splitbranch
+        if branch_to_use not in tree.keys() and branch_to_use not in eventbranchnames and splitbranch == '_event' and 'event' in tree.keys():
+            branch_to_use = 'event'
+        if branch_to_use not in tree.keys() and branch_to_use not in eventbranchnames:
+            msg = 'ERROR: requested MC split on branch {}, but it is not in tree {}. Available branches include: {}'.format(
+                splitbranch, treename, list(tree.keys())[:20])
+            raise Exception(msg)
+        sample['splitparity'] = splitparity
+        sample['splitbranch'] = branch_to_use
+        # Keep MC normalization correct for the selected split subset
+        # (this requires a first pass over the weights of the selected entries).
+        nsel = 0
+        splitsumweights = []
+        for (entry_start, entry_stop) in chunks:
+            eventindex = get_eventindex(sample, entry_start, entry_stop)
+            splitmask = read_splitmask(f, sample, eventindex, entry_start, entry_stop)
+            nsel += int(np.count_nonzero(splitmask))
+            rawweights = eit.read_eventbranches(f, treename, [weightvarname], eventindex=eventindex,
+                            entry_start=entry_start, entry_stop=entry_stop)[weightvarname]
+            splitsumweights.append(np.sum(rawweights[splitmask]))
+        print('Applying MC split {} on branch {}: selected {}/{} entries.'.format(
+            splitparity, branch_to_use, nsel, nentries))
+        if nsel == 0:
+            msg = 'ERROR: MC split {} on branch {} selected 0 events.'.format(splitparity, branch_to_use)
+            raise Exception(msg)
+        sample['sumweights'] = np.sum(splitsumweights) if len(splitsumweights)>1 else splitsumweights[0]
+
+    # initialize reweighting
+    if not isdata:
+        print('Doing pileup reweighting...')
+
+        #in case of per-era processing (need more elegant solution, but should work)
+        if year in ['2022postEEE', '2022postEEF', '2022postEEG']:
+            year_pu         = '2022postEE'
+        elif '2022' in year:
+            year_pu             = year.rstrip('BCD') # Watch out, does noy work for anything but 2022preEE
+        else:
+            year_pu             = year.rstrip('BCDEFGHI') # Watch out, does noy work for anything but 2022preEE
+
+        pileupreweighter    = PileupReweighter(campaign, year_pu)
+        sourcefile          = pt.get_sourcefile(inputfile)
+        # (for a virtual dataset, use the profile summed over all constituent files)
+        if vt.isvirtual(sourcefile):
+            pileupreweighter.initprofilevalues(*vt.get_histogramvalues(sourcefile, 'nTrueInteractions'))
+        else: pileupreweighter.initsample(sourcefile)
+        sample['pileupreweighter'] = pileupreweighter
+
+    return sample
+
+def get_eventindex(sample, entry_start, entry_stop):
+    ### get the event index for a chunk of entries (None for non-normalized trees)
+    if sample['eventoffsets'] is None: return None
+    return eit.get_chunkeventindex(sample['eventoffsets'], entry_start, entry_stop)
+
+def read_splitmask(f, sample, eventindex, entry_start, entry_stop):
+    ### get the mask for the optional MC split for a chunk of entries (None if no split)
+    if sample['splitparity'] is None: return None
+    tree = f[sample['treename']]
+    branch_to_use = sample['splitbranch']
+    if branch_to_use in tree.keys():
+        eventvalues = tree[branch_to_use].array(library='np', entry_start=entry_start, entry_stop=entry_stop)
+    else:
+        eventvalues = eit.read_eventbranches(f, sample['treename'], [branch_to_use],
+                        eventindex=eventindex, entry_start=entry_start, entry_stop=entry_stop)[branch_to_use]
+    paritymod = np.mod(eventvalues.astype(np.int64), 2)
+    if sample['splitparity'] == 'even':
+        return (paritymod == 0)
+    return (paritymod == 1)
+
+def read_chunk(f, sample, branchnames, entry_start, entry_stop, withweights=True):
+    ### read the weights and the requested branches for a chunk of entries
+    # input arguments:
+    # - f: opened input file (see get_opener)
+    # - sample: sample settings (see init_sample)
+    # - branchnames: list of branches to read (each branch is read only once)
+    # - entry_start and entry_stop: range of entries
+    # - withweights: whether to read the weights (see get_weights)
+    # returns a dict with the branch values (after the optional MC split)
+    # and the ingredients of the weights (see get_weights)
+    tree                  = f[sample['treename']]
+    eventindex            = get_eventindex(sample, entry_start, entry_stop)
+    splitmask             = read_splitmask(f, sample, eventindex, entry_start, entry_stop)
+
+    # get weights and reweighting
+    rawweights            = None
+    pileupreweight        = None
+    if( withweights and not sample['isdata'] ):
+        weightvarname       = sample['weightvarname']
+        rawweights          = eit.read_eventbranches(f, sample['treename'], [weightvarname], eventindex=eventindex,
+                                entry_start=entry_start, entry_stop=entry_stop)[weightvarname]
+        ntrueint            = eit.read_eventbranches(f, sample['treename'], ['_nTrueInt'], eventindex=eventindex,
+                                entry_start=entry_start, entry_stop=entry_stop)['_nTrueInt']
+        if splitmask is not None:
+            rawweights      = rawweights[splitmask]
+            ntrueint        = ntrueint[splitmask]
+        pileupreweight      = sample['pileupreweighter'].getreweight(ntrueint)
+
+    # get the requested branches
+    values                = {}
+    for branchname in branchnames:
+        if branchname in values: continue
+        values[branchname]  = tree[branchname].array(library='np', entry_start=entry_start, entry_stop=entry_stop)
+        if splitmask is not None:
+            values[branchname] = values[branchname][splitmask]
+
+    return ({
+        'isdata':               sample['isdata'],
+        'nentries':             entry_stop-entry_start,
+        'nentries_reweight':    sample['nentries_reweight'],
+        'sumweights':           sample['sumweights'],
+        'rawweights':           rawweights,
+        'pileupreweight':       pileupreweight,
+        'values':               values
+    })
+
+def get_weights(chunk, xsection=1, lumi=1):
+    ### get the weights for a chunk read with read_chunk,
+    # normalized to the provided xsection and lumi (for simulation)
+    if chunk['isdata']: weights = np.ones(chunk['nentries'])
+    else: weights         = chunk['rawweights'] / chunk['sumweights'] * xsection * lumi
+    weights               = weights * chunk['nentries_reweight']
+    if not chunk['isdata']:
+        weights             = np.multiply(weights, chunk['pileupreweight'])
+    return weights
+
+
+class HistogramFiller(object):
+    ### accumulate a histogram over chunks of entries
+    # note: the histograms are filled with tools/histfilltools.py,
+    #       which sorts the values into the bins only once for the weights and squared weights.
+
+    def __init__(self, variable, yvariable=None, sidevariable=None):
+        ### initializer
+        # input arguments:
+        # - variable, yvariable and sidevariable: main, secondary and sideband variable
+        self.variable         = variable
+        self.yvariable        = yvariable
+        self.dim              = 1 if yvariable is None else 2
+        self.sidevariable     = sidevariable
+        # (one-dimensional histograms are stored with a single secondary bin,
+        #  but filled without reading any secondary variable)
+        shape                 = (len(variable['bins'])-1, 1)
+        if self.dim==2: shape = (len(variable['bins'])-1, len(yvariable['bins'])-1)
+        if sidevariable is None:
+            self.sumweights   = np.zeros(shape)
+            self.sumweights2  = np.zeros(shape)
+        else:
+            # (histograms of the sideband variable in each bin)
+            shape             = shape + (len(sidevariable['bins'])-1,)
+            self.sidesumweights   = np.zeros(shape)
+            self.sidesumweights2  = np.zeros(shape)
+
+    def fill(self, values, weights):
+        ### fill the histogram with a chunk of entries
+        # input arguments:
+        # - values: dict of branch values (see read_chunk)
+        # - weights: weights (see get_weights)
+        variable              = self.variable
+        yvariable             = self.yvariable
+
+        # get the variable and some masks
+        varvalues             = values[variable['variable']]
+        nanmask               = np.isnan(varvalues)
+        rangemask             = ((varvalues > variable['bins'][0]) & (varvalues < variable['bins'][-1]))
+        totalmask             = ((~nanmask) & rangemask)
+
+        # get the secondary variable
+        if self.dim==2:
+            yvarvalues        = values[yvariable['variable']]
+            ynanmask          = np.isnan(yvarvalues)
+            yrangemask        = ((yvarvalues >= yvariable['bins'][0]) & (yvarvalues <= yvariable['bins'][-1]))
+            totalmask         = (totalmask & (~ynanmask) & yrangemask)
+
+        # case of no background subtraction
+        if self.sidevariable is None:
+            weights           = weights[totalmask]
+            if self.dim==1:
+                (sumweights, sumweights2) = hft.histogram(varvalues[totalmask],
+                                                variable['bins'], weights=weights)
             else:
-                dummyvar            = tree.keys()[0]
-                dummyvalues         = tree[dummyvar].array(library='np', entry_stop=nentries)
-                if splitmask is not None:
-                    dummyvalues     = dummyvalues[splitmask]
-                dummymin            = np.min(dummyvalues)
-                dummymax            = np.max(dummyvalues)
-                yvariable           = {'variable': dummyvar, 'bins': [dummymin/2., dummymax*2]}
-
-            # get the secondary variable
-            yvarvalues            = tree[yvariable['variable']].array(library='np', entry_stop=nentries)
-            if splitmask is not None:
-                yvarvalues         = yvarvalues[splitmask]
-            ynanmask              = np.isnan(yvarvalues)
-            yrangemask            = ((yvarvalues >= yvariable['bins'][0]) & (yvarvalues <= yvariable['bins'][-1]))
-            totalmask             = (totalmask & (~ynanmask) & yrangemask)
-
-            # case of no background subtraction
-            if sidevariable is None:
-                varvalues           = varvalues[totalmask]
-                yvarvalues          = yvarvalues[totalmask]
-                weights             = weights[totalmask]
-                counts              = np.histogram2d(
-                                        varvalues, 
-                                        yvarvalues,
-                                        bins    = (variable['bins'], yvariable['bins']),
-                                        weights = weights
-                                    )[0]
-                errors              = np.sqrt(np.histogram2d(
-                                            varvalues, 
-                                            yvarvalues,
-                                            bins    = (variable['bins'], yvariable['bins']), 
-                                            weights = np.power(weights,2))[0]
-                                    )
-           
-            # do background subtraction
-            if sidevariable is not None:
-                # get values of sideband variable
-                sidebandvalues          = tree[sidevariable['variable']].array(library='np', entry_stop=nentries)
-                if splitmask is not None:
-                    sidebandvalues      = sidebandvalues[splitmask]
-            
-                # initialize final histograms
-                counts                  = np.zeros((len(variable['bins'])-1, len(yvariable['bins'])-1))
-                errors                  = np.zeros((len(variable['bins'])-1, len(yvariable['bins'])-1))
-                confidence              = np.zeros((len(variable['bins'])-1, len(yvariable['bins'])-1))
-                confidence_error        = np.zeros((len(variable['bins'])-1, len(yvariable['bins'])-1))
-            
-                # loop over main variable bins and secondary variable bins
-                for i, (low, high) in enumerate(zip(variable['bins'][:-1], variable['bins'][1:])):
-                    for j, (ylow, yhigh) in enumerate(zip(yvariable['bins'][:-1], yvariable['bins'][1:])):
-                        # subselect sideband variable values in this main variable bin
-                        mask                = ((varvalues > low) & (varvalues < high)
-                                               & (yvarvalues > ylow) & (yvarvalues < yhigh))
-                        thissidebandvalues  = sidebandvalues[mask]
-                        thisweights         = weights[mask]
-                
-                        # make extra info
-                        extrainfo           = '{0:.2f} < '.format(low)
-                        extrainfo           += variable['label']
-                        extrainfo           += ' < {0:.2f}'.format(high)
-                        if dim==2:
-                            extrainfo         += '<< {0:.2f} < '.format(ylow)
-                            extrainfo         += yvariable['label']
-                            extrainfo         += ' < {0:.2f}'.format(yhigh)
-                
-                        # fit background and count what is left in peak
-                        histlabel = 'Data' if isdata else 'Simulation'
-                        histname                = '{}_bin{}'.format(label, i)
-                        if dim==2: histname     += '_ybin{}'.format(j)
-                
-                        (npeak, nerror, conf, conf_error)   = count_peak_unbinned(
-                        #(npeak, nerror)   = count_peak_unbinned(
-                                            thissidebandvalues,
-                                            thisweights,
-                                            sidevariable,
-                                            mode            = 'hybrid',
-                                            label           = histlabel,
-                                            lumi            = lumi,
-                                            extrainfo       = extrainfo,
-                                            histname        = histname,
-                                            plotdir         = args.sideplotdir
-                                          )
-                
-                        counts[i,j]             = npeak
-                        errors[i,j]             = nerror
-                        confidence[i,j]         = conf
-                        confidence_error[i,j]   = conf_error
-            
-                # Calculate the error on the confidence method
-                #conf_error      = np.zeros((len(variable['bins'])-1, len(yvariable['bins'])-1))
-                #for i, (low, high) in enumerate(zip(variable['bins'][:-1], variable['bins'][1:])):
-                #   for j, (ylow, yhigh) in enumerate(zip(yvariable['bins'][:-1], yvariable['bins'][1:])):
-                #       conf_error[i,j] = np.sqrt(np.power(confidence[i,j] - np.average(confidence), 2))
-
-           
+                (sumweights, sumweights2) = hft.histogram([varvalues[totalmask], yvarvalues[totalmask]],
+                                                [variable['bins'], yvariable['bins']], weights=weights)
+            self.sumweights   += sumweights.reshape(self.sumweights.shape)
+            self.sumweights2  += sumweights2.reshape(self.sumweights2.shape)
+            return
+
+        # fill the sideband variable histograms in all bins at once
+        # (values on the edges of the main and secondary variable bins are not used)
+        sidebandvalues        = values[self.sidevariable['variable']]
+        if self.dim==1:
+            histvalues        = [varvalues, sidebandvalues]
+            histbins          = [variable['bins'], self.sidevariable['bins']]
+        else:
+            histvalues        = [varvalues, yvarvalues, sidebandvalues]
+            histbins          = [variable['bins'], yvariable['bins'], self.sidevariable['bins']]
+        indices               = [hft.get_binindex(thisvalues, thisbins, open=True)
+                                 for thisvalues, thisbins in zip(histvalues[:-1], histbins[:-1])]
+        indices.append(hft.get_binindex(sidebandvalues, self.sidevariable['bins']))
+        nbins                 = [len(thisbins)-1 for thisbins in histbins]
+        (sumweights, sumweights2) = hft.fill_bincount(hft.get_flatindex(indices, nbins),
+                                        int(np.prod(nbins)), weights=weights)
+        self.sidesumweights   += sumweights.reshape(self.sidesumweights.shape)
+        self.sidesumweights2  += sumweights2.reshape(self.sidesumweights2.shape)
+
+    def get_result(self, isdata=False, lumi=1, label=None, sideplotdir=None):
+        ### get the final histogram, after background subtraction if requested
+        # input arguments:
+        # - isdata, lumi and label: only for the sideband fit plots
+        # - sideplotdir: directory for the plots of the sideband fits
+        # returns a tuple of the form (counts, errors, confidence, confidence errors)
+        variable              = self.variable
+        yvariable             = self.yvariable
+        dim                   = self.dim
+
+        # case of no background subtraction
+        if self.sidevariable is None:
+            counts            = self.sumweights
+            errors            = np.sqrt(self.sumweights2)
+
+        # do background subtraction
+        else:
+            # initialize final histograms
+            shape                   = self.sidesumweights.shape[:2]
+            counts                  = np.zeros(shape)
+            errors                  = np.zeros(shape)
+            confidence              = np.zeros(shape)
+            confidence_error        = np.zeros(shape)
+
+            # loop over main variable bins and secondary variable bins
+            # (a single secondary bin for one-dimensional histograms)
+            ybins                   = yvariable['bins'] if dim==2 else [None, None]
+            for i, (low, high) in enumerate(zip(variable['bins'][:-1], variable['bins'][1:])):
+                for j, (ylow, yhigh) in enumerate(zip(ybins[:-1], ybins[1:])):
+
+                    # make extra info
+                    extrainfo           = '{0:.2f} < '.format(low)
+                    extrainfo           += variable['label']
+                    extrainfo           += ' < {0:.2f}'.format(high)
+                    if dim==2:
+                        extrainfo         += '<< {0:.2f} < '.format(ylow)
+                        extrainfo         += yvariable['label']
+                        extrainfo         += ' < {0:.2f}'.format(yhigh)
+
+                    # fit background and count what is left in peak
+                    histlabel = 'Data' if isdata else 'Simulation'
+                    histname                = '{}_bin{}'.format(label, i)
+                    if dim==2: histname     += '_ybin{}'.format(j)
+
+                    (npeak, nerror, conf, conf_error)   = count_peak_binned(
+                                        self.sidesumweights[i,j],
+                                        np.sqrt(self.sidesumweights2[i,j]),
+                                        self.sidevariable,
+                                        mode            = 'hybrid',
+                                        label           = histlabel,
+                                        lumi            = lumi,
+                                        extrainfo       = extrainfo,
+                                        histname        = histname,
+                                        plotdir         = sideplotdir
+                                      )
+
+                    counts[i,j]             = npeak
+                    errors[i,j]             = nerror
+                    confidence[i,j]         = conf
+                    confidence_error[i,j]   = conf_error
+
         # remove superfluous dimension for one-dimensional arrays
         if dim==1:
             counts = counts[:,0]
             errors = errors[:,0]
 
         # return hist gram with counts and corresponding errors
-        if sidevariable is None:
+        if self.sidevariable is None:
             return (counts, errors, 0, 0)
         return (counts, errors, confidence, confidence_error)
- 
-    # ------------------------------------------------------------------------
-    # loop over input files and fill histograms
-    # ------------------------------------------------------------------------
+
+
+def get_histograms(inputfile, treename, histograms, filters=None, chunksize=None, **kwargs):
+    ### fill several histograms from one read of a tree
+    # input arguments:
+    # - inputfile and treename: input file and tree
+    # - histograms: list of dicts with the variable, yvariable and sidevariable (see HistogramFiller),
+    #   the xsection and lumi for the weights (see get_weights),
+    #   and the label and sideplotdir for the sideband fits;
+    #   if the variable is None, the sum of weights and its error are returned instead
+    # - filters: filters for reading a parquet dataset (see get_parquetfilters)
+    # - chunksize: number of entries to read at once (default: all entries in one chunk)
+    # - kwargs: keyword arguments for init_sample (e.g. isdata, nentries, year and campaign)
+    # returns a list of tuples of the form (counts, errors, confidence, confidence errors),
+    # one for each histogram
+    # note: the union of the branches needed for all histograms is read only once.
+    print('Now running on file {}...'.format(inputfile))
+    with get_opener(inputfile, filters=filters)(inputfile) as f:
+        sample                = init_sample(f, inputfile, treename, chunksize=chunksize, **kwargs)
+        chunks                = sample['chunks']
+
+        # find the branches to read
+        branchnames           = []
+        for hist in histograms:
+            if hist.get('variable', None) is None: continue
+            branchnames.append(hist['variable']['variable'])
+            if hist.get('yvariable', None) is not None: branchnames.append(hist['yvariable']['variable'])
+            if hist.get('sidevariable', None) is not None: branchnames.append(hist['sidevariable']['variable'])
+
+        # fill the histograms chunk by chunk
+        fillers               = []
+        for hist in histograms:
+            if hist.get('variable', None) is None:
+                fillers.append({'sumweights': [], 'sumweights2': []})
+            else:
+                fillers.append(HistogramFiller(hist['variable'], yvariable=hist.get('yvariable', None),
+                                sidevariable=hist.get('sidevariable', None)))
+        for (entry_start, entry_stop) in chunks:
+            chunk             = read_chunk(f, sample, branchnames, entry_start, entry_stop)
+            for hist, filler in zip(histograms, fillers):
+                weights       = get_weights(chunk, xsection=hist.get('xsection', 1), lumi=hist.get('lumi', 1))
+                # if no variable was specified, sum the weights
+                if hist.get('variable', None) is None:
+                    filler['sumweights'].append(np.sum(weights))
+                    filler['sumweights2'].append(np.sum(np.power(weights, 2)))
+                else: filler.fill(chunk['values'], weights)
+
+    # get the final histograms
+    results                   = []
+    for hist, filler in zip(histograms, fillers):
+        if hist.get('variable', None) is None:
+            sumweights        = np.sum(filler['sumweights'])
+            error             = np.sqrt(np.sum(filler['sumweights2']))
+            results.append((sumweights, error, 0, 0))
+            continue
+        results.append(filler.get_result(isdata=sample['isdata'], lumi=hist.get('lumi', 1),
+                            label=hist.get('label', None), sideplotdir=hist.get('sideplotdir', None)))
+    return results
+
+def get_histogram(inputfile,
+                treename,
+                variable        = None,
+                isdata          = False,
+                yvariable       = None,
+                xsection        = 1,
+                lumi            = 1,
+                weightvarname   = '_weight',
+                splitparity     = None,
+                splitbranch     = '_event',
+                hcountername    = 'hCounter',
+                sidevariable    = None,
+                label           = None,
+                nentries        = None,
+                year            = None,          # for reweighter
+                campaign        = None,          # for reweighter
+                sideplotdir     = None,
+                chunksize       = None
+    ):
+    ### fill a single histogram (see get_histograms)
+    filters                   = None
+    if pt.isparquet(inputfile):
+        filters               = get_parquetfilters(variable, yvariable=yvariable, isdata=isdata,
+                                    splitparity=splitparity, nentries=nentries)
+    hist                      = ({
+                                    'variable':     variable,
+                                    'yvariable':    yvariable,
+                                    'sidevariable': sidevariable,
+                                    'xsection':     xsection,
+                                    'lumi':         lumi,
+                                    'label':        label,
+                                    'sideplotdir':  sideplotdir
+                                })
+    return get_histograms(inputfile, treename, [hist], filters=filters, chunksize=chunksize,
+                isdata          = isdata,
+                weightvarname   = weightvarname,
+                splitparity     = splitparity,
+                splitbranch     = splitbranch,
+                hcountername    = hcountername,
+                nentries        = nentries,
+                year            = year,
+                campaign        = campaign)[0]
+
+# ------------------------------------------------------------------------
+# define the histograms to fill for a set of arguments
+# ------------------------------------------------------------------------
+def get_requests(args, datain, simin, variable, yvariable=None, sidevariable=None, normvariable=None):
+    ### get the histograms to fill
+    # returns a list of tuples of the form (key, keyword arguments for get_histogram),
+    # where the key identifies the use of the histogram (see finalize)
+    requests = []
     # Data files
-    for datadict in datain:
-        print('Now running on data file {}...'.format(datadict['file']))
-        lumi                        = datadict['luminosity']
-        counts, errors, confidences, conf_errors = get_histogram(
-                                                datadict['file'], 
-                                                args.treename,
-                                                variable        = variable,
-                                                yvariable       = yvariable,
-                                                isdata          = True, 
-                                                lumi            = lumi,
-                                                sidevariable    = sidevariable,
-                                      splitparity     = simdict.get('splitparity', None),
-                                      splitbranch     = simdict.get('splitbranch', '_event'),
-                                                label           = datadict['label'].strip(' .'),
-                                                nentries        = args.nprocess
-                                    )
+    for i, datadict in enumerate(datain):
+        requests.append( (('main', 'data', i), {
+                                'inputfile':    datadict['file'],
+                                'treename':     args.treename,
+                                'variable':     variable,
+                                'yvariable':    yvariable,
+                                'isdata':       True,
+                                'lumi':         datadict['luminosity'],
+                                'sidevariable': sidevariable,
+                                'label':        datadict['label'].strip(' .'),
+                                'nentries':     args.nprocess,
+                                'chunksize':    args.chunksize,
+                                'sideplotdir':  args.sideplotdir
+                            }) )
+    # Simulation files
+    for i, simdict in enumerate(simin):
+        requests.append( (('main', 'sim', i), {
+                                'inputfile':    simdict['file'],
+                                'treename':     args.treename,
+                                'variable':     variable,
+                                'yvariable':    yvariable,
+                                'isdata':       False,
+                                'xsection':     simdict['xsection'],
+                                'lumi':         simdict['luminosity'],
+                                'sidevariable': sidevariable,
+                                'label':        simdict['label'].strip(' .'),
+                                'nentries':     args.nprocess,
+                                'chunksize':    args.chunksize,
+                                'year':         simdict['year'],
+                                'campaign':     simdict['campaign'],
+                                'sideplotdir':  args.sideplotdir
+                            }) )
+    # for normmode 'range', sum of data and simulation in a given range
+    if args.normmode=='range':
+        for i, datadict in enumerate(datain):
+            requests.append( (('norm', 'data', i), {
+                                'inputfile':    datadict['file'],
+                                'treename':     args.treename,
+                                'variable':     normvariable,
+                                'isdata':       True,
+                                'label':        datadict['label'].strip(' .')+'_normrange',
+                                'sidevariable': sidevariable,
+                                'nentries':     args.nprocess,
+                                'chunksize':    args.chunksize,
+                                'sideplotdir':  args.sideplotdir
+                            }) )
+        for i, simdict in enumerate(simin):
+            requests.append( (('norm', 'sim', i), {
+                                'inputfile':    simdict['file'],
+                                'treename':     args.treename,
+                                'variable':     normvariable,
+                                'isdata':       False,
+                                'xsection':     simdict['xsection'],
+                                'lumi':         simdict['luminosity'],
+                                'splitparity':  simdict.get('splitparity', None),
+                                'splitbranch':  simdict.get('splitbranch', '_event'),
+                                'label':        simdict['label'].strip(' .')+'_normrange',
+                                'sidevariable': sidevariable,
+                                'nentries':     args.nprocess,
+                                'chunksize':    args.chunksize,
+                                'year':         simdict['year'],
+                                'campaign':     simdict['campaign'],
+                                'sideplotdir':  args.sideplotdir
+                            }) )
+    # for normmode 'eventyield', sum of event weights
+    if args.normmode=='eventyield':
+        if args.eventtreename is None:
+            msg = 'ERROR: requested normalization by event yield, but event tree name was not specified.'
+            raise Exception(msg)
+        for i, datadict in enumerate(datain):
+            requests.append( (('norm', 'data', i), {
+                                'inputfile':    datadict['file'],
+                                'treename':     args.eventtreename,
+                                'isdata':       True,
+                                'nentries':     args.nprocess,
+                                'chunksize':    args.chunksize
+                            }) )
+        for i, simdict in enumerate(simin):
+            requests.append( (('norm', 'sim', i), {
+                                'inputfile':    simdict['file'],
+                                'treename':     args.eventtreename,
+                                'isdata':       False,
+                                'xsection':     simdict['xsection'],
+                                'lumi':         simdict['luminosity'],
+                                'splitparity':  simdict.get('splitparity', None),
+                                'splitbranch':  simdict.get('splitbranch', '_event'),
+                                'nentries':     args.nprocess,
+                                'chunksize':    args.chunksize,
+                                'year':         simdict['year'],
+                                'campaign':     simdict['campaign']
+                            }) )
+    return requests
+
+
+# ------------------------------------------------------------------------
+# normalize the histograms and write them to a file
+# ------------------------------------------------------------------------
+def finalize(args, datain, simin, results, variable, totallumi,
+        yvariable=None, sidevariable=None, normvariable=None):
+    ### normalize the histograms and write them to the output file
+    # input arguments:
+    # - results: dict matching the keys of get_requests to the filled histograms
+    for i, datadict in enumerate(datain):
+        counts, errors, confidences, conf_errors = results[('main', 'data', i)]
         datadict['counts']      = counts
         datadict['errors']      = errors
         datadict['confidences'] = confidences
-        datadict['conf_errors'] = conf_errors    
-    # Simulation files
-    for simdict in simin:
-        print('Now running on simulation file {}...'.format(simdict['file']))
-        xsection                = simdict['xsection']
-        lumi                    = simdict['luminosity']
-        counts, errors, confidences, conf_errors = get_histogram(
-        #counts, errors              = get_histogram(
-                                      simdict['file'], 
-                                      args.treename,
-                                      variable        = variable,
-                                      yvariable       = yvariable,
-                                      isdata          = False, 
-                                      xsection        = xsection, 
-                                      lumi            = lumi,
-                                      sidevariable    = sidevariable,
-                                      label           = simdict['label'].strip(' .'),
-                                      nentries        = args.nprocess,
-                                      year            = simdict['year'], 
-                                      campaign        = simdict['campaign']
-                                  )
+        datadict['conf_errors'] = conf_errors
+    for i, simdict in enumerate(simin):
+        counts, errors, confidences, conf_errors = results[('main', 'sim', i)]
         simdict['counts']       = counts
         simdict['errors']       = errors
         simdict['confidences']  = confidences
-        simdict['conf_errors']  = conf_errors    
+        simdict['conf_errors']  = conf_errors
 
     # clip histograms to minimum zero
     for datadict in datain:
@@ -447,18 +812,18 @@ if __name__=='__main__':
     # for normmode 'yield', normalize sum of simulation to sum of data
     if args.normmode=='yield':
         print('Normalizing simulation yield to data yield...')
-    
+
         # Get Simulation count
         simsum                          = 0
         for simdict in simin: simsum    += np.sum(simdict['counts'])
-    
+
         # Get Data count
         datasum                         = 0
         for datadict in datain: datasum += np.sum(datadict['counts'])
-    
+
         # Compare data vs. sim
         scale                           = datasum / simsum
-    
+
         # Scale simulation to sum of data
         for simdict in simin:
             simdict['counts']     = simdict['counts']*scale
@@ -471,56 +836,30 @@ if __name__=='__main__':
     # but the sum is calculated only for a given variable in given range
     if args.normmode=='range':
         print('Normalizing simulation yield to data yield in range...')
-    
+
         # Get Data count
         datasum     = 0
-        for datadict in datain:
-            counts, _, confs, c_ = get_histogram(
-            #counts, _   = get_histogram(
-                               datadict['file'], 
-                           args.treename,
-                           variable    =normvariable,
-                           isdata      =True,
-                           label       =datadict['label'].strip(' .')+'_normrange',
-                           sidevariable=sidevariable,
-                           nentries    =args.nprocess
-                        )
+        for i, datadict in enumerate(datain):
+            counts, _, confs, c_ = results[('norm', 'data', i)]
             if len(counts)!=1:
                 msg = 'ERROR: counts has unexpected length, check the binning of normvariable.'
                 raise Exception(msg)
-      
+
             datasum  += counts[0]
-    
+
         # Get Simulation count
         simsum      = 0
-        for simdict in simin:
-            xsection     = simdict['xsection']
-            lumi         = simdict['luminosity']
-            counts, _, confs, c_ = get_histogram(
-            #counts, _   = get_histogram(
-                            simdict['file'], 
-                            args.treename,
-                            variable    =normvariable,
-                            isdata      =False, 
-                            xsection    =xsection, 
-                            lumi        =lumi,
-                            splitparity =simdict.get('splitparity', None),
-                            splitbranch =simdict.get('splitbranch', '_event'),
-                            label       =simdict['label'].strip(' .')+'_normrange',
-                            sidevariable=sidevariable,
-                            nentries    =args.nprocess,
-                            year        =simdict['year'], 
-                            campaign    =simdict['campaign']
-                        )
+        for i, simdict in enumerate(simin):
+            counts, _, confs, c_ = results[('norm', 'sim', i)]
             if len(counts)!=1:
                 msg = 'ERROR: counts has unexpected length, check the binning of normvariable.'
                 raise Exception(msg)
-      
+
             simsum  += counts[0]
-    
+
         # Compare data vs. sim
         scale   = datasum / simsum
-    
+
         # Scale simulation to sum of data
         for simdict in simin:
             simdict['counts']             = simdict['counts']*scale
@@ -532,47 +871,24 @@ if __name__=='__main__':
     # for normmode 'eventyield', scale using event weights
     if args.normmode=='eventyield':
         print('Normalizing simulation event yield to data event yield...')
-        if args.eventtreename is None:
-            msg = 'ERROR: requested normalization by event yield, but event tree name was not specified.'
-            raise Exception(msg)
-    
+
         # Get Data count
         datasum     = 0
-        for datadict in datain:
-            sumweights, _, confs, c_ = get_histogram(
-            #sumweights, _   = get_histogram(
-                                datadict['file'], 
-                                args.eventtreename, 
-                                isdata    =True, 
-                                nentries  =args.nprocess
-                            )
-       
+        for i, datadict in enumerate(datain):
+            sumweights, _, confs, c_ = results[('norm', 'data', i)]
+
             datasum  += sumweights
-    
+
         # Get Simulation count
         simsum      = 0
-        for simdict in simin:
-            xsection      = simdict['xsection']
-            lumi          = simdict['luminosity']
-            sumweights, _, confs, c_ = get_histogram(
-            #sumweights, _ = get_histogram(
-                                simdict['file'], 
-                                args.eventtreename,
-                                isdata      =False, 
-                                xsection    =xsection, 
-                                lumi        =lumi,
-                                splitparity =simdict.get('splitparity', None),
-                                splitbranch =simdict.get('splitbranch', '_event'),
-                                nentries    =args.nprocess,
-                                year        =simdict['year'], 
-                                campaign    =simdict['campaign']
-                            )
-      
+        for i, simdict in enumerate(simin):
+            sumweights, _, confs, c_ = results[('norm', 'sim', i)]
+
             simsum  += sumweights
-    
+
         # Compare data vs. sim
         scale = datasum / simsum
-    
+
         # Scale simulation to sum of data
         for simdict in simin:
             simdict['counts']             = simdict['counts']*scale
@@ -592,52 +908,52 @@ if __name__=='__main__':
     for ddict in simin + datain:
         counts      = ddict['counts']
         errors      = ddict['errors']
-    
+
         # conversion to ROOT.TH1
         if(len(counts.shape)==1):
             hist = ROOT.TH1F(
-                    ddict['label'], 
-                    ddict['label'], 
+                    ddict['label'],
+                    ddict['label'],
                     len(variable['bins'])-1,
                     array('f', variable['bins'])
                 )
             for i, (count, error) in enumerate(zip(counts, errors)):
                 hist.SetBinContent( i+1, count)
                 hist.SetBinError(   i+1, error)
-    
+
         # converstion to ROOT.TH2
         elif(len(counts.shape)==2):
             hist = ROOT.TH2F(
-                    ddict['label'], 
                     ddict['label'],
-                    len(variable['bins'])-1, 
+                    ddict['label'],
+                    len(variable['bins'])-1,
                     array('f', variable['bins']),
-                    len(yvariable['bins'])-1, 
+                    len(yvariable['bins'])-1,
                     array('f', yvariable['bins'])
                 )
             for i in range(counts.shape[0]):
                 for j in range(counts.shape[1]):
                     hist.SetBinContent(   i+1, j+1, counts[i,j])
                     hist.SetBinError(     i+1, j+1, errors[i,j])
-          
+
         else:
             msg = 'ERROR: shape of counts array could not be converted to TH1 or TH2.'
             raise Exception(msg)
         hist.Write(hist.GetName())
-  
+
     # write variable
     varname_st        = ROOT.TNamed('variable', variable['name'])
     varname_st.Write()
-  
+
     # write secondary variable
     if yvariable is not None:
         yvarname_st     = ROOT.TNamed('yvariable', yvariable['name'])
         yvarname_st.Write()
-  
+
     # write normalization
     normalization_st  = ROOT.TNamed('normalization', str(args.normmode))
     normalization_st.Write()
-  
+
     # write norm range
     if args.normmode in ['range']:
         normrange_st    = ROOT.TVectorD(2)
@@ -646,16 +962,16 @@ if __name__=='__main__':
         normrange_st.Write("normrange")
         normvariable_st = ROOT.TNamed('normvariable', normvariable['name'])
         normvariable_st.Write()
-  
+
     # write luminosity
     lumi_st           = ROOT.TVectorD(1)
     lumi_st[0]        = totallumi
     lumi_st.Write("lumi")
-  
+
     # write background mode
     bkgmode_st        = ROOT.TNamed('bkgmode', str(args.bkgmode))
     bkgmode_st.Write()
-  
+
     # write tree name
     treename_st       = ROOT.TNamed('treename', str(args.treename))
     treename_st.Write()
@@ -670,53 +986,53 @@ if __name__=='__main__':
         for ddict in simin + datain:
             confidences = ddict['confidences']
             errors      = ddict['conf_errors']
-        
+
             # conversion to ROOT.TH1
             if(len(confidences.shape)==1):
                 hist2 = ROOT.TH1F(
-                        ddict['label'] + " confidence", 
-                        ddict['label'] + " confidence", 
+                        ddict['label'] + " confidence",
+                        ddict['label'] + " confidence",
                         len(variable['bins'])-1,
                         array('f', variable['bins'])
                     )
-          
+
                 for i, (confidence, error) in enumerate(zip(confidences, errors)):
                     hist2.SetBinContent( i+1, confidence)
                     hist2.SetBinError(   i+1, error)
-        
+
             # converstion to ROOT.TH2
             elif(len(confidences.shape)==2):
                 hist2 = ROOT.TH2F(
-                        ddict['label'], 
-                        ddict['label'], 
-                        len(variable['bins'])-1, 
+                        ddict['label'],
+                        ddict['label'],
+                        len(variable['bins'])-1,
                         array('f', variable['bins']),
-                        len(yvariable['bins'])-1, 
+                        len(yvariable['bins'])-1,
                         array('f', yvariable['bins'])
                     )
                 for i in range(confidences.shape[0]):
                     for j in range(confidences.shape[1]):
                         hist2.SetBinContent(   i+1, j+1, confidences[i,j])
                         hist2.SetBinError(     i+1, j+1, errors[i,j])
-              
+
             else:
                 msg = 'ERROR: shape of counts array could not be converted to TH1 or TH2.'
                 raise Exception(msg)
                 hist2.Write(hist2.GetName())
-      
+
         # write variable
         varname_st        = ROOT.TNamed('variable', variable['name'])
         varname_st.Write()
-      
+
         # write secondary variable
         if yvariable is not None:
             yvarname_st     = ROOT.TNamed('yvariable', yvariable['name'])
             yvarname_st.Write()
-      
+
         # write normalization
         normalization_st  = ROOT.TNamed('normalization', str(args.normmode))
         normalization_st.Write()
-      
+
         # write norm range
         if args.normmode in ['range']:
             normrange_st    = ROOT.TVectorD(2)
@@ -725,19 +1041,39 @@ if __name__=='__main__':
             normrange_st.Write("normrange")
             normvariable_st = ROOT.TNamed('normvariable', normvariable['name'])
             normvariable_st.Write()
-      
+
         # write luminosity
         lumi_st           = ROOT.TVectorD(1)
         lumi_st[0]        = totallumi
         lumi_st.Write("lumi")
-      
+
         # write background mode
         bkgmode_st        = ROOT.TNamed('bkgmode', str(args.bkgmode))
         bkgmode_st.Write()
-      
+
         # write tree name
         treename_st       = ROOT.TNamed('treename', str(args.treename))
         treename_st.Write()
         f2.Close()
-        
+
+
+if __name__=='__main__':
+
+    sys.stderr.write('###starting###\n')
+
+    # get arguments, input configuration and variables
+    args = get_parser().parse_args()
+    (datain, simin, totallumi) = load_inputconfig(args)
+    (variable, sidevariable, normvariable, yvariable) = load_variables(args)
+
+    # loop over input files and fill histograms
+    requests = get_requests(args, datain, simin, variable, yvariable=yvariable,
+                    sidevariable=sidevariable, normvariable=normvariable)
+    results = {}
+    for key, kwargs in requests: results[key] = get_histogram(**kwargs)
+
+    # normalize and write histograms
+    finalize(args, datain, simin, results, variable, totallumi,
+        yvariable=yvariable, sidevariable=sidevariable, normvariable=normvariable)
+
     sys.stderr.write('###done###\n')
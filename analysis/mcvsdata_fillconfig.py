@@ -0,0 +1,106 @@
+##########################################################
+# Fill the histograms for a whole variable configuration #
+##########################################################
+# Equivalent to running mcvsdata_fill.py for each set of histograms
+# (i.e. each combination of variable, background mode, normalization and binning
+#  in a configuration such as config_ksvars.py, see mcvsdata_submit.py --onepass),
+# but each tree in each input file is read only once:
+# the union of the branches needed for all histograms is read,
+# the weights (including the pileup reweighting) are calculated once,
+# and all histograms are filled from these shared arrays.
+# The output files are the same as the ones of the separate mcvsdata_fill.py runs.
+
+# usage example:
+# python3 mcvsdata_fillconfig.py -j <jobs json>
+# where the json file contains a list of argument lists for mcvsdata_fill.py, e.g.
+# [["-i", "config.json", "-t", "laurelin", "-v", "variable.json", "-o", "histograms.root"], ...]
+
+
+# import external modules
+import os
+import sys
+import json
+import argparse
+# import framework modules
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+import mcvsdata_fill as mf
+
+# keyword arguments of mcvsdata_fill.get_histogram defining how a sample is read
+# (with their default values), all other arguments define a single histogram
+sampleargs = ({
+    'isdata':           False,
+    'weightvarname':    '_weight',
+    'splitparity':      None,
+    'splitbranch':      '_event',
+    'hcountername':     'hCounter',
+    'nentries':         None,
+    'year':             None,
+    'campaign':         None,
+    'chunksize':        None
+})
+
+
+def get_samplekey(kwargs):
+    ### get a key identifying the input file, tree and sample settings of a histogram request
+    # (requests with the same key can be filled from one read, see mcvsdata_fill.get_histograms)
+    return ( (kwargs['inputfile'], kwargs['treename'])
+             + tuple(kwargs.get(key, default) for key, default in sampleargs.items()) )
+
+def fill_jobs(jobargs):
+    ### fill the histograms for a list of mcvsdata_fill.py argument lists
+    parser = mf.get_parser()
+    jobs = []
+    for thisjobargs in jobargs:
+        args = parser.parse_args(thisjobargs)
+        (datain, simin, totallumi) = mf.load_inputconfig(args)
+        (variable, sidevariable, normvariable, yvariable) = mf.load_variables(args)
+        requests = mf.get_requests(args, datain, simin, variable, yvariable=yvariable,
+                        sidevariable=sidevariable, normvariable=normvariable)
+        jobs.append({'args': args, 'datain': datain, 'simin': simin, 'totallumi': totallumi,
+                     'variable': variable, 'yvariable': yvariable,
+                     'sidevariable': sidevariable, 'normvariable': normvariable,
+                     'requests': requests, 'results': {}})
+
+    # group the histogram requests of all jobs per input file, tree and sample settings
+    groups = {}
+    for job in jobs:
+        for key, kwargs in job['requests']:
+            groups.setdefault(get_samplekey(kwargs), []).append( (job, key, kwargs) )
+    nrequests = sum([len(group) for group in groups.values()])
+    msg = 'Filling {} histograms for {} sets of arguments'.format(nrequests, len(jobs))
+    msg += ' from {} reads of input trees.'.format(len(groups))
+    print(msg)
+
+    # read each input tree once and fill all histograms
+    for samplekey, group in groups.items():
+        (inputfile, treename) = samplekey[:2]
+        samplekwargs = dict(zip(sampleargs.keys(), samplekey[2:]))
+        histograms = []
+        for (_, _, kwargs) in group:
+            histograms.append(dict((key, val) for key, val in kwargs.items()
+                                   if key not in ['inputfile', 'treename'] and key not in sampleargs))
+        results = mf.get_histograms(inputfile, treename, histograms, **samplekwargs)
+        for (job, key, _), result in zip(group, results): job['results'][key] = result
+
+    # normalize and write the histograms of each job
+    for job in jobs:
+        mf.finalize(job['args'], job['datain'], job['simin'], job['results'], job['variable'],
+            job['totallumi'], yvariable=job['yvariable'], sidevariable=job['sidevariable'],
+            normvariable=job['normvariable'])
+
+
+if __name__=='__main__':
+
+    sys.stderr.write('###starting###\n')
+
+    # read command line arguments
+    parser = argparse.ArgumentParser( description = 'Fill histograms for a variable configuration' )
+    parser.add_argument('-j', '--jobs', required=True, type=os.path.abspath,
+                        help='Json file with a list of argument lists for mcvsdata_fill.py')
+    args = parser.parse_args()
+
+    # fill the histograms
+    with open(args.jobs) as f: jobargs = json.load(f)
+    fill_jobs(jobargs)
+
+    sys.stderr.write('###done###\n')
@@ -8,6 +8,7 @@ import sys
 import numpy as np
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),'..')))
 import tools.lumitools as lt
+import tools.virtualtools as vt
 
 def getfiles( filedir, includelist, version, check_exist=False, **kwargs ):
     if      version=='run2preul':   eralist = getfiles_run2preul(   filedir, includelist, **kwargs )
@@ -15,6 +16,12 @@ def getfiles( filedir, includelist, version, check_exist=False, **kwargs ):
     elif    version=='run3':        eralist = getfiles_run3(        filedir, includelist, **kwargs )
     else:   raise Exception('ERROR: version {} not recognized'.format(version))
 
+    # use virtual datasets (see tools/virtualtools.py) in place of merged files that do not exist
+    # (e.g. the per-year files made with v0building/mergeeras.py --virtual)
+    for era in eralist:
+      for sample in era['mcin'] + era['datain']:
+        sample['file']          = vt.get_datasetfile(sample['file'])
+
     if check_exist:
       # check if all files exist
       allexist                  = True
@@ -5,6 +5,7 @@
 import os
 import sys
 import json
+import shlex
 import argparse
 import importlib
 import numpy as np
@@ -25,11 +26,25 @@ if __name__=='__main__':
     parser.add_argument('-o', '--outputdir',  required=True)
     parser.add_argument('-e', '--eras',       default=['default'],  nargs='+')
     parser.add_argument('-n', '--nprocess',   default=-1,           type=int)
+    parser.add_argument(      '--chunksize',  default=-1,           type=int,
+                              help='Number of entries to read at once in mcvsdata_fill.py')
     parser.add_argument(      '--dodetector', default=False,        action='store_true')
     parser.add_argument(      '--runmode',    default='local',      choices=['local', 'condor'])
     parser.add_argument(      '--outrootfile',default=None)
+    parser.add_argument(      '--onepass',    default=False,        action='store_true',
+                              help='Fill all histograms of an era in one read of each file'
+                                  +' (see mcvsdata_fillconfig.py)')
     args = parser.parse_args()
 
+    def run_commands(cmds):
+        ### run or submit a list of commands
+        scriptname = 'cjob_mcvsdata_submit.sh'
+        if args.runmode=='local':
+            for cmd in cmds: os.system(cmd)
+        else:
+            store_dir = CMSSW + '/src/K0sAnalysis/log_automatic_jobs/'
+            ct.submitCommandsAsCondorJob(store_dir + scriptname, cmds, cmssw_version=CMSSW)
+
     # manage input arguments to get files
     includelist           = args.eras
     if 'default' in includelist:
@@ -182,6 +197,10 @@ if __name__=='__main__':
         configjson              = os.path.join(thiseradir, 'config.json')
         with open(configjson, 'w') as f:
             json.dump(era, f)
+
+        # in one-pass mode, collect the filling arguments and plotting commands of all variables
+        filljobs                = []
+        plotcmds                = []
     
         # loop over variables and corresponding settings
         for varname in varnames:
@@ -260,6 +279,7 @@ if __name__=='__main__':
                         cmd += ' -v {}'.format(varjson)
                         cmd += ' -o {}'.format(histfile)
                         if args.nprocess>0:                     cmd += ' -n {}'.format(args.nprocess)
+                        if args.chunksize>0:                    cmd += ' --chunksize {}'.format(args.chunksize)
                         # add args for normalization
                         if norm['type'] is not None:            cmd += ' --normmode {}'.format(norm['type'])
                         if norm['type']=='range':               cmd += ' --normvariable {}'.format(normvarjson)
@@ -429,9 +449,15 @@ if __name__=='__main__':
                         # run or submit commands
                         # ------------------------------------------------------------------------------------------
                         #print(cmds)
-                        scriptname = 'cjob_mcvsdata_submit.sh'
-                        if args.runmode=='local':
-                            for cmd in cmds: os.system(cmd)
-                        else:
-                            store_dir = CMSSW + '/src/K0sAnalysis/log_automatic_jobs/'
-                            ct.submitCommandsAsCondorJob(store_dir + scriptname, cmds, cmssw_version=CMSSW)
+                        if args.onepass:
+                            filljobs.append(shlex.split(cmds[0])[2:])
+                            plotcmds += cmds[1:]
+                        else: run_commands(cmds)
+
+        # in one-pass mode, fill all histograms of this era at once, then make all plots
+        if args.onepass:
+            filljobsjson            = os.path.join(thiseradir, 'filljobs.json')
+            with open(filljobsjson, 'w') as f:
+                json.dump(filljobs, f)
+            cmd = 'python3 mcvsdata_fillconfig.py -j {}'.format(filljobsjson)
+            run_commands([cmd] + plotcmds)
@@ -11,6 +11,7 @@ import numpy as np
 from array import array
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),'..')))
 import tools.fittools as ft
+import tools.histfilltools as hft
 import plotting.plotfit as pft
 
 import ROOT
@@ -263,18 +264,17 @@ def count_peak(hist, label, extrainfo, gargs, mode='subtract'):
 # -------------------------------------------------------------------------------------
 # Wrap around fit function:
 #   wrapper around fitting function using more modern paradigm for input parameters
-#   Input:  - values: np array of sideband values
-#           - weights: np array of weights corresponding to values
+#   Input:  - counts: np array of (weighted) counts of the sideband variable in its bins
+#           - errors: np array of errors corresponding to counts
 #           - variable: dict with all information about the sideband variable
 #           - mode: passed down to called function
+#   Note:   - the histogram can be accumulated over chunks of entries
+#             (see analysis/mcvsdata_fill.py)
 # -------------------------------------------------------------------------------------
-def count_peak_unbinned(values, weights, variable, mode='subtract',
+def count_peak_binned(counts, errors, variable, mode='subtract',
                         label=None, lumi=None, extrainfo=None,
                         histname='sideband', plotdir=None):
-    # make a ROOT histogram with the values and weights
-    counts  = np.histogram(values, variable['bins'], weights=weights)[0]
-    errors  = np.sqrt(np.histogram(values, variable['bins'], weights=np.power(weights,2))[0])
-    
+    # make a ROOT histogram with the counts and errors
     hist    = ROOT.TH1F(histname, histname, len(variable['bins'])-1, array('f', variable['bins']))
     hist.SetDirectory(0)
     for i, (count, error) in enumerate(zip(counts, errors)):
@@ -294,3 +294,23 @@ def count_peak_unbinned(values, weights, variable, mode='subtract',
     
     # call underlying function
     return count_peak(hist, label, extrainfo, fitinfo, mode=mode)
+
+# -------------------------------------------------------------------------------------
+# Wrap around fit function:
+#   same as count_peak_binned, but with the values of the sideband variable as input
+#   Input:  - values: np array of sideband values
+#           - weights: np array of weights corresponding to values
+#           - variable: dict with all information about the sideband variable
+#           - mode: passed down to called function
+# -------------------------------------------------------------------------------------
+def count_peak_unbinned(values, weights, variable, mode='subtract',
+                        label=None, lumi=None, extrainfo=None,
+                        histname='sideband', plotdir=None):
+    # make a histogram with the values and weights
+    (counts, sumweights2) = hft.histogram(values, variable['bins'], weights=weights)
+    errors  = np.sqrt(sumweights2)
+    
+    # call binned function
+    return count_peak_binned(counts, errors, variable, mode=mode,
+                        label=label, lumi=lumi, extrainfo=extrainfo,
+                        histname=histname, plotdir=plotdir)
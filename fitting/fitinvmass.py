@@ -12,6 +12,7 @@ import ROOT
 from array import array
 sys.path.append('../tools')
 import fittools as ft
+import histfilltools as hft
 sys.path.append('../plotting')
 import plotfit as pf
 
@@ -104,33 +105,31 @@ if __name__=='__main__':
       rangemask = ((varvalues > variable['bins'][0]) & (varvalues < variable['bins'][-1]))
       totalmask = ((~nanmask) & rangemask)
 
-      # initialize a dummy secondary variable if it was not provided
-      # (easier than if else statements below)
+      # use a single secondary bin if no secondary variable was provided
+      # (easier than if else statements below, but no secondary variable is read)
       dim = 1
       if args.yvariable is not None: dim = 2
-      else:
-        dummyvar = tree.keys()[0]
-        dummyvalues = tree[dummyvar].array(library='np', entry_stop=nentries)
-        dummymin = np.min(dummyvalues)
-        dummymax = np.max(dummyvalues)
-        yvariable = {'variable': dummyvar, 'bins': [dummymin/2., dummymax*2]}
+      else: yvariable = {'variable': None, 'bins': [None, None]}
 
       # get the secondary variable
-      yvarvalues = tree[yvariable['variable']].array(library='np', entry_stop=nentries)
-      ynanmask = np.isnan(yvarvalues)
-      yrangemask = ((yvarvalues >= yvariable['bins'][0]) & (yvarvalues <= yvariable['bins'][-1]))
-      totalmask = (totalmask & (~ynanmask) & yrangemask)
+      if dim==2:
+        yvarvalues = tree[yvariable['variable']].array(library='np', entry_stop=nentries)
+        ynanmask = np.isnan(yvarvalues)
+        yrangemask = ((yvarvalues >= yvariable['bins'][0]) & (yvarvalues <= yvariable['bins'][-1]))
+        totalmask = (totalmask & (~ynanmask) & yrangemask)
 
       # calculate the counts
       varvalues = varvalues[totalmask]
-      yvarvalues = yvarvalues[totalmask]
       weights = weights[totalmask]
-      counts = np.histogram2d(varvalues, yvarvalues,
-                   bins=(variable['bins'], yvariable['bins']),
-                   weights=weights)[0]
-      errors = np.sqrt(np.histogram2d(varvalues, yvarvalues,
-                   bins=(variable['bins'], yvariable['bins']),
-                   weights=np.power(weights,2))[0])
+      if dim==1:
+        (counts, sumweights2) = hft.histogram(varvalues, variable['bins'], weights=weights)
+        counts = counts[:,np.newaxis]
+        sumweights2 = sumweights2[:,np.newaxis]
+      else:
+        yvarvalues = yvarvalues[totalmask]
+        (counts, sumweights2) = hft.histogram([varvalues, yvarvalues],
+                     [variable['bins'], yvariable['bins']], weights=weights)
+      errors = np.sqrt(sumweights2)
 
   # write histograms to output file
   hists = []
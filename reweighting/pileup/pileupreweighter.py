@@ -6,6 +6,7 @@ import os
 import sys
 import numpy as np
 import ROOT
+from array import array
 #sys.path.append('/user/jbierken/CMSSW_12_4_12/src/K0sAnalysis/tools')
 #import pileuptools as pu
 
@@ -116,10 +117,31 @@ class PileupReweighter(object):
             raise Exception(msg)
 
         inthist.SetDirectory(ROOT.gROOT)
-        inthist.Scale(1./inthist.GetSumOfWeights())
         f.Close()
+        self.initprofile(inthist)
+
+    def initprofilevalues(self, values, edges):
+        ### initialize the reweighter for a given sample from its true interaction profile as arrays
+        # (e.g. the profile summed over the files of a virtual dataset, see tools/virtualtools.py)
+        # input arguments:
+        # - values: bin contents including under- and overflow (None if not available)
+        # - edges: bin edges
 
-        # determine reweighting factors
+        # skip in case of UL sample, no initialization needed
+        if self.campaign=='run2ul' or self.campaign=='run3':   return
+
+        if values is None:
+            msg                 = 'ERROR: interactions profile in simulation could not be loaded.'
+            raise Exception(msg)
+        inthist                 = ROOT.TH1D('nTrueInteractions_sample', 'nTrueInteractions_sample',
+                                    len(edges)-1, array('d', edges))
+        inthist.SetDirectory(ROOT.gROOT)
+        for i, value in enumerate(values): inthist.SetBinContent(i, value)
+        self.initprofile(inthist)
+
+    def initprofile(self, inthist):
+        ### determine reweighting factors from the true interaction profile of a sample
+        inthist.Scale(1./inthist.GetSumOfWeights())
         self.scalehist          = self.puhist.Clone()
         self.scalehist.Scale(1./self.puhist.GetSumOfWeights())
         self.scalehist.Divide(inthist)
@@ -0,0 +1,187 @@
+#############################################################
+# tools for merging V0 files while removing duplicate events #
+#############################################################
+# When a job partially succeeded in both an original and a recovery task,
+# the same events are present in both outputs, and a plain merge would count them twice.
+# The merger below removes such duplicates, based on the event key (run, lumi, event):
+# the files are processed in the given order (e.g. original files first),
+# and each event is only kept the first time its key is encountered.
+# The event keys that were already seen are kept as a sorted array across files,
+# so that each file only needs a vectorized sort-unique and binary search over its keys,
+# and the tree contents are copied chunk by chunk (streaming, with bounded memory usage).
+# Entries in the per-lepton and per-V0 trees are kept or removed together with their event,
+# using the event index (for normalized files, see eventindextools.py)
+# or the event key branches in the tree itself.
+# Histograms are summed over all input files (see mergetools.py).
+# note: the events removed from the trees are not subtracted from hCounter,
+#       since the duplicated events that did not pass the skim are unknown;
+#       a warning is printed if duplicates are found in simulation.
+
+# usage example:
+# python3 dedupmerge.py -i <original files> <recovery files> -o <merged file> --duplicates <txt file>
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+import eventindextools as eit
+import mergetools as mt
+from eventkeyindex import make_keys, keybranchnames
+
+
+def read_keys(tree, entry_start=None, entry_stop=None):
+    ### read the event keys (see eventkeyindex.make_keys) of the entries in a tree
+    return make_keys(*[tree[b].array(library='np', entry_start=entry_start, entry_stop=entry_stop)
+                       for b in keybranchnames])
+
+def get_eventmask(keys, seen):
+    ### get the mask of events to keep in a file
+    # input arguments:
+    # - keys: event keys of the events in this file (in file order)
+    # - seen: sorted array of event keys kept in the previous files
+    # returns a boolean array that is True for the first occurrence of each key
+    # that is not in seen
+    mask = np.zeros(len(keys), dtype=bool)
+    if len(keys)==0: return mask
+    (_, first) = np.unique(keys, return_index=True)
+    mask[first] = True
+    if len(seen)>0:
+        pos = np.searchsorted(seen, keys, side='left')
+        inrange = (pos<len(seen))
+        found = np.zeros(len(keys), dtype=bool)
+        found[inrange] = (seen[pos[inrange]]==keys[inrange])
+        mask &= ~found
+    return mask
+
+def get_entrymask(f, treename, eventmask, keptkeys):
+    ### get the mask of entries to keep in a per-lepton or per-V0 tree
+    # input arguments:
+    # - f: opened (uproot) V0 file
+    # - treename: name of the tree
+    # - eventmask: mask of events to keep in the per-event tree (see get_eventmask)
+    # - keptkeys: sorted array of the keys of the kept events
+    # note: in normalized files, the entries are matched to their event through the event index;
+    #       else, the entries of an event are consecutive and carry the event key,
+    #       and only the first block of consecutive entries with a kept key is kept
+    #       (since a later block with the same key belongs to a duplicate event in the same file).
+    if treename==eit.eventtreename: return eventmask
+    if eit.isnormalized(f, treename): return eventmask[eit.read_eventindex(f, treename)]
+    tree = f[treename]
+    if not all(b in tree.keys() for b in keybranchnames):
+        msg = 'ERROR: tree {} has no event key branches and no event index,'.format(treename)
+        msg += ' cannot remove duplicate events.'
+        raise Exception(msg)
+    keys = read_keys(tree)
+    if len(keys)==0: return np.zeros(0, dtype=bool)
+    blockstarts = np.concatenate(([0], np.flatnonzero(keys[1:]!=keys[:-1])+1))
+    blockids = np.repeat(np.arange(len(blockstarts)), np.diff(np.append(blockstarts, len(keys))))
+    blockkeys = keys[blockstarts]
+    (_, firstblocks) = np.unique(blockkeys, return_index=True)
+    keepblock = np.zeros(len(blockstarts), dtype=bool)
+    keepblock[firstblocks] = True
+    pos = np.minimum(np.searchsorted(keptkeys, blockkeys, side='left'), max(len(keptkeys)-1, 0))
+    if len(keptkeys)>0: keepblock &= (keptkeys[pos]==blockkeys)
+    else: keepblock[:] = False
+    return keepblock[blockids]
+
+def dedupmerge(inputfiles, outputfile, chunksize=500000, compression=None, duplicatesfile=None):
+    ### merge V0 files, removing duplicate events
+    # input arguments:
+    # - inputfiles: list of input files, in order of precedence
+    #   (of duplicate events, the one in the first file is kept)
+    # - outputfile: output file to (re)create
+    # - chunksize: number of tree entries to copy at once
+    # - compression: compression of the output file (see mergetools.get_compression)
+    # - duplicatesfile: text file to write the removed events to (run:lumi:event and input file)
+    # returns a dict matching tree names to the number of removed entries
+    import uproot
+    starttime = time.time()
+    fins = [uproot.open(f) for f in inputfiles]
+    removed = {}
+    duplicates = []
+    try:
+        objects = mt.get_mergeobjects(fins[0])
+        for f, fin in zip(inputfiles[1:], fins[1:]):
+            if mt.get_mergeobjects(fin)!=objects:
+                msg = 'ERROR: file {} does not contain the same objects'.format(f)
+                msg += ' as {}.'.format(inputfiles[0])
+                raise Exception(msg)
+        if eit.eventtreename not in objects.keys():
+            raise Exception('ERROR: no per-event tree {} found.'.format(eit.eventtreename))
+        treenames = [name for name, objtype in objects.items() if objtype=='tree']
+        kwargs = {}
+        if compression is not None: kwargs['compression'] = mt.get_compression(compression)
+        with uproot.recreate(outputfile, **kwargs) as fout:
+            outtrees = {}
+            seen = make_keys([], [], [])
+            for inputfile, fin in zip(inputfiles, fins):
+                # find the events to keep
+                keys = read_keys(fin[eit.eventtreename])
+                eventmask = get_eventmask(keys, seen)
+                keptkeys = np.sort(keys[eventmask])
+                # (merge the sorted arrays; mergesort is fast on concatenated sorted runs)
+                seen = np.sort(np.concatenate((seen, keptkeys)), kind='mergesort')
+                nduplicates = int(np.sum(~eventmask))
+                duplicates += [(key, inputfile) for key in keys[~eventmask]]
+                print('File {}: {} out of {} events are duplicates'.format(
+                      inputfile, nduplicates, len(keys)))
+                # copy the entries to keep
+                for treename in treenames:
+                    tree = fin[treename]
+                    entrymask = get_entrymask(fin, treename, eventmask, keptkeys)
+                    removed[treename] = removed.get(treename, 0) + int(np.sum(~entrymask))
+                    for entry_start in range(0, max(tree.num_entries, 1), chunksize):
+                        entry_stop = min(entry_start+chunksize, tree.num_entries)
+                        chunkmask = entrymask[entry_start:entry_stop]
+                        if( treename in outtrees and not np.any(chunkmask) ): continue
+                        arrays = tree.arrays(entry_start=entry_start, entry_stop=entry_stop,
+                                             library='np')
+                        if treename not in outtrees:
+                            outtrees[treename] = fout.mktree(treename, mt.get_branchtypes(arrays))
+                        if np.any(chunkmask):
+                            outtrees[treename].extend({name: values[chunkmask]
+                                                       for name, values in arrays.items()})
+            # sum the histograms and copy the strings
+            for name, objtype in objects.items():
+                if objtype=='histogram':
+                    fout[name] = mt.merge_histograms([fin[name] for fin in fins])
+                elif objtype=='string': fout[name] = str(fins[0][name])
+    finally:
+        for fin in fins: fin.close()
+
+    # report the duplicates
+    ndup = len(duplicates)
+    print('Merged {} files into {} in {:.1f} s,'.format(len(inputfiles), outputfile, time.time()-starttime)
+          +' removing {} duplicate events:'.format(ndup))
+    for treename, nremoved in removed.items():
+        print('  - {}: {} entries removed'.format(treename, nremoved))
+    if( ndup>0 and 'hCounter' in objects.keys() ):
+        msg = 'WARNING: duplicate events were found in simulation;'
+        msg += ' note that hCounter is summed over all input files including the duplicates.'
+        print(msg)
+    if duplicatesfile is not None:
+        with open(duplicatesfile, 'w') as f:
+            for (key, inputfile) in duplicates:
+                f.write('{}:{}:{} {}\n'.format(key['run'], key['lumi'], key['event'], inputfile))
+        print('List of removed duplicate events written to {}'.format(duplicatesfile))
+    return removed
+
+
+if __name__=='__main__':
+
+    # read command line arguments
+    parser = argparse.ArgumentParser( description = 'Merge V0 files, removing duplicate events' )
+    parser.add_argument('-i', '--inputfiles', required=True, nargs='+', type=os.path.abspath,
+                        help='Input files, in order of precedence')
+    parser.add_argument('-o', '--outputfile', required=True, type=os.path.abspath)
+    parser.add_argument('--duplicates', default=None, type=os.path.abspath,
+                        help='Text file to write the removed duplicate events to')
+    parser.add_argument('--compression', default=None,
+                        help='Compression of the merged file, e.g. LZ4:4 (default: ZLIB:1)')
+    parser.add_argument('--chunksize', default=500000, type=int)
+    args = parser.parse_args()
+
+    dedupmerge(args.inputfiles, args.outputfile, chunksize=args.chunksize,
+               compression=args.compression, duplicatesfile=args.duplicates)
@@ -0,0 +1,99 @@
+###############################################################
+# tools for reading V0 files with a normalized event schema #
+###############################################################
+# In normalized V0 files (see v0building/v0builder.py --normalized),
+# the per-lepton and per-V0 trees (celeborn, laurelin, telperion) do not contain
+# copies of the per-event variables (run/lumi/event number, weight and pileup).
+# Instead, the per-event tree (nimloth) holds the number of entries in each of these trees
+# for every event, from which the index of the parent event of each entry can be reconstructed.
+# note: the counts (rather than the event indices themselves) are stored,
+#       since they remain valid when files are merged (e.g. with hadd).
+
+import numpy as np
+
+# name of the per-event tree
+eventtreename = 'nimloth'
+
+# names of the branches in the per-event tree holding the number of entries per event
+countbranchnames = {
+    'celeborn':     '_nCeleborn',
+    'laurelin':     '_nLaurelin',
+    'telperion':    '_nTelperion',
+}
+
+def get_countbranchname(treename):
+    ### get the name of the branch in the per-event tree holding the number of entries in a tree
+    # note: per-V0 trees for a specific selection (e.g. laurelin_<selection>, see v0builder.py)
+    #       have a count branch with the same suffix (e.g. _nLaurelin_<selection>).
+    # returns None for trees without count branch
+    basename = treename.split('_')[0]
+    if basename not in countbranchnames.keys(): return None
+    return countbranchnames[basename] + treename[len(basename):]
+
+def iscountbranch(branchname):
+    ### check whether a branch in the per-event tree is a count branch
+    for countbranchname in countbranchnames.values():
+        if( branchname==countbranchname or branchname.startswith(countbranchname+'_') ): return True
+    return False
+
+def isnormalized(f, treename):
+    ### check whether a tree in an opened (uproot) file is stored in normalized form
+    countbranchname = get_countbranchname(treename)
+    if countbranchname is None: return False
+    if eventtreename not in f: return False
+    return (countbranchname in f[eventtreename].keys())
+
+def get_eventindex(counts):
+    ### convert an array of per-event counts into the index of the parent event of each entry
+    return np.repeat(np.arange(len(counts)), counts)
+
+def read_eventindex(f, treename, entry_start=None, entry_stop=None):
+    ### read the index (in the per-event tree) of the parent event of each entry in a tree
+    counts = f[eventtreename][get_countbranchname(treename)].array(library='np')
+    return get_eventindex(counts)[entry_start:entry_stop]
+
+def read_eventoffsets(f, treename):
+    ### read the cumulative number of entries in a tree per event in the per-event tree
+    # (to get the event index for chunks of entries, see get_chunkeventindex)
+    counts = f[eventtreename][get_countbranchname(treename)].array(library='np')
+    return np.cumsum(counts)
+
+def get_chunkeventindex(eventoffsets, entry_start, entry_stop):
+    ### get the index of the parent event for a range of entries in a tree
+    # (the parent event of entry j is the first event with cumulative count > j)
+    # note: equivalent to read_eventindex for the same range of entries,
+    #       but without constructing the event index for the full tree.
+    return np.searchsorted(eventoffsets, np.arange(entry_start, entry_stop), side='right')
+
+def read_eventbranches(f, treename, branchnames,
+        eventindex=None, entry_start=None, entry_stop=None):
+    ### read per-event branches for each entry in a tree
+    # input arguments:
+    # - f: opened (uproot) file
+    # - treename: name of the tree for which to read the per-event branches
+    # - branchnames: list of names of per-event branches to read
+    # - eventindex: event index for the requested entries (see read_eventindex),
+    #   can be provided to avoid reading it again for each call
+    # - entry_start and entry_stop: range of entries in the tree
+    # returns a dict matching branch names to numpy arrays with one value per entry
+    # note: works for both normalized and non-normalized files;
+    #       in the latter case, the branches are read directly from the tree.
+    if not isnormalized(f, treename):
+        tree = f[treename]
+        return {b: tree[b].array(library='np', entry_start=entry_start, entry_stop=entry_stop)
+                for b in branchnames}
+    if eventindex is None:
+        eventindex = read_eventindex(f, treename, entry_start=entry_start, entry_stop=entry_stop)
+    # only read the range of events that is needed
+    # (the event index is sorted since entries are written in event order)
+    eventstart = 0
+    eventstop = 0
+    if len(eventindex)>0:
+        eventstart = eventindex[0]
+        eventstop = eventindex[-1]+1
+    eventtree = f[eventtreename]
+    res = {}
+    for b in branchnames:
+        values = eventtree[b].array(library='np', entry_start=eventstart, entry_stop=eventstop)
+        res[b] = values[eventindex-eventstart]
+    return res
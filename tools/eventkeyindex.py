@@ -0,0 +1,258 @@
+###########################################################################
+# Sorted (run, lumi, event) index for fast event lookup in built V0 files #
+###########################################################################
+# The index maps the event key (run number, lumi block, event number) of each event
+# to the range of entries belonging to that event in each of the output trees
+# (nimloth, celeborn, laurelin, telperion) of a file produced by v0building/v0builder.py.
+# It is stored next to the V0 file (as <name>_eventindex.npz)
+# and lookups are done with a binary search on the sorted event keys.
+# note: for the per-lepton and per-V0 trees, only events with at least one entry
+#       in the respective tree are part of the index.
+# note: build the index after merging files, since entry ranges change when merging.
+
+# usage examples:
+# - build (or rebuild) the index for one or more files:
+#   python3 eventkeyindex.py -i <file(s)>
+# - look up the entries for a given event (the index is built first if needed):
+#   python3 eventkeyindex.py -i <file> --lookup <run>:<lumi>:<event> [-t laurelin]
+# - list events that occur more than once:
+#   python3 eventkeyindex.py -i <file> --duplicates [-t nimloth]
+
+import sys
+import os
+import argparse
+import numpy as np
+import uproot
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+import eventindextools as eit
+
+# names of the branches holding the event key
+keybranchnames = ['_runNb', '_lumiBlock', '_eventNb']
+
+# data type of the sorted event keys
+# (numpy compares structured arrays field by field, which allows a binary search on all three)
+keydtype = np.dtype([('run', np.uint64), ('lumi', np.uint64), ('event', np.uint64)])
+
+# default trees to index
+defaulttreenames = ['nimloth', 'celeborn', 'laurelin', 'telperion']
+
+
+def get_indexfile(filename):
+    ### get the name of the index file belonging to a V0 file
+    return os.path.splitext(filename)[0]+'_eventindex.npz'
+
+def make_keys(runs, lumis, events):
+    ### convert arrays of run, lumi and event numbers into an array of event keys
+    keys = np.empty(len(runs), dtype=keydtype)
+    keys['run'] = runs
+    keys['lumi'] = lumis
+    keys['event'] = events
+    return keys
+
+
+class TreeEventIndex(object):
+    ### sorted event index for a single tree
+
+    def __init__(self, keys, starts, stops, issorted=False):
+        ### initializer
+        # input arguments:
+        # - keys: array of event keys (see make_keys), one per event
+        # - starts and stops: arrays with the first and last+1 entry of each event in the tree
+        # - issorted: whether the arrays are already sorted by event key (e.g. when loading)
+        if not issorted:
+            order = np.lexsort((keys['event'], keys['lumi'], keys['run']))
+            keys = keys[order]
+            starts = starts[order]
+            stops = stops[order]
+        self.keys = keys
+        self.starts = starts
+        self.stops = stops
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, run, lumi, event):
+        ### get the entry ranges of a given event
+        # returns a list of tuples of the form (start, stop),
+        # usually of length 1 (or 0 if the event is not found),
+        # but longer if the same event occurs more than once.
+        key = make_keys([run], [lumi], [event])
+        first = np.searchsorted(self.keys, key, side='left')[0]
+        last = np.searchsorted(self.keys, key, side='right')[0]
+        return list(zip(self.starts[first:last].tolist(), self.stops[first:last].tolist()))
+
+    def contains(self, runs, lumis, events):
+        ### check for an array of events whether they are in the index
+        keys = make_keys(runs, lumis, events)
+        pos = np.searchsorted(self.keys, keys, side='left')
+        found = np.zeros(len(keys), dtype=bool)
+        inrange = (pos < len(self.keys))
+        found[inrange] = (self.keys[pos[inrange]]==keys[inrange])
+        return found
+
+    def duplicates(self):
+        ### get the event keys that occur more than once
+        if len(self.keys)<2: return self.keys[:0]
+        same = (self.keys[1:]==self.keys[:-1])
+        return np.unique(self.keys[1:][same])
+
+
+class EventIndex(object):
+    ### sorted event index for all trees in a V0 file
+
+    def __init__(self, treeindices):
+        ### initializer from a dict matching tree names to TreeEventIndex objects
+        self.treeindices = treeindices
+
+    def __getitem__(self, treename):
+        return self.treeindices[treename]
+
+    def treenames(self):
+        return list(self.treeindices.keys())
+
+    def lookup(self, run, lumi, event, treename='laurelin'):
+        ### get the entry ranges of a given event in a given tree
+        return self.treeindices[treename].lookup(run, lumi, event)
+
+    @staticmethod
+    def build(filename, treenames=None):
+        ### build the index from a V0 file
+        if treenames is None: treenames = defaulttreenames
+        treeindices = {}
+        with uproot.open(filename) as f:
+            for treename in treenames:
+                if treename not in f: continue
+                treeindices[treename] = build_treeindex(f, treename)
+        return EventIndex(treeindices)
+
+    def save(self, indexfile, filename=None):
+        ### write the index to a npz file
+        # if the V0 file is provided, its size and modification time are stored as well,
+        # so that outdated indices can be recognized.
+        arrays = {}
+        for treename, treeindex in self.treeindices.items():
+            arrays[treename+'_keys'] = treeindex.keys
+            arrays[treename+'_starts'] = treeindex.starts
+            arrays[treename+'_stops'] = treeindex.stops
+        if filename is not None: arrays['source'] = np.array(get_sourceinfo(filename))
+        np.savez(indexfile, **arrays)
+
+    @staticmethod
+    def load(indexfile):
+        ### read the index from a npz file
+        treeindices = {}
+        with np.load(indexfile) as arrays:
+            for name in arrays.files:
+                if not name.endswith('_keys'): continue
+                treename = name[:-len('_keys')]
+                treeindices[treename] = TreeEventIndex(arrays[treename+'_keys'],
+                                            arrays[treename+'_starts'],
+                                            arrays[treename+'_stops'],
+                                            issorted=True)
+        return EventIndex(treeindices)
+
+
+def get_sourceinfo(filename):
+    ### get the size and modification time of a file (to check if an index is up to date)
+    stat = os.stat(filename)
+    return [stat.st_size, int(stat.st_mtime)]
+
+def isuptodate(filename, indexfile=None):
+    ### check if the index of a V0 file exists and is up to date
+    if indexfile is None: indexfile = get_indexfile(filename)
+    if not os.path.exists(indexfile): return False
+    with np.load(indexfile) as arrays:
+        if 'source' not in arrays.files: return False
+        return (arrays['source'].tolist()==get_sourceinfo(filename))
+
+def build_treeindex(f, treename):
+    ### build the index for a single tree in an opened (uproot) V0 file
+    eventtree = f[eit.eventtreename]
+    # case of per-event tree: each event corresponds to exactly one entry
+    if treename==eit.eventtreename:
+        keys = make_keys(*[eventtree[b].array(library='np') for b in keybranchnames])
+        starts = np.arange(len(keys))
+        return TreeEventIndex(keys, starts, starts+1)
+    # case of normalized file: use the number of entries per event
+    if eit.isnormalized(f, treename):
+        counts = eventtree[eit.get_countbranchname(treename)].array(library='np')
+        stops = np.cumsum(counts)
+        starts = stops - counts
+        mask = (counts>0)
+        keys = make_keys(*[eventtree[b].array(library='np')[mask] for b in keybranchnames])
+        return TreeEventIndex(keys, starts[mask], stops[mask])
+    # case of regular file: entries of the same event are consecutive,
+    # so find the positions where the event key changes
+    tree = f[treename]
+    runs, lumis, events = [tree[b].array(library='np') for b in keybranchnames]
+    if len(runs)==0:
+        return TreeEventIndex(make_keys(runs, lumis, events), np.zeros(0, dtype=int), np.zeros(0, dtype=int))
+    change = ((runs[1:]!=runs[:-1]) | (lumis[1:]!=lumis[:-1]) | (events[1:]!=events[:-1]))
+    starts = np.concatenate(([0], np.flatnonzero(change)+1))
+    stops = np.concatenate((starts[1:], [len(runs)]))
+    keys = make_keys(runs[starts], lumis[starts], events[starts])
+    return TreeEventIndex(keys, starts, stops)
+
+def get_eventindex(filename, treenames=None, rebuild=False):
+    ### get the index for a V0 file, building and writing it if needed
+    indexfile = get_indexfile(filename)
+    if( not rebuild and isuptodate(filename, indexfile=indexfile) ):
+        eventindex = EventIndex.load(indexfile)
+        if( treenames is None or all(t in eventindex.treenames() for t in treenames) ):
+            return eventindex
+    eventindex = EventIndex.build(filename, treenames=treenames)
+    eventindex.save(indexfile, filename=filename)
+    return eventindex
+
+
+if __name__=='__main__':
+
+    # read command line arguments
+    parser = argparse.ArgumentParser( description = 'Build or query event index for V0 files' )
+    parser.add_argument('-i', '--inputfiles', required=True, type=os.path.abspath, nargs='+')
+    parser.add_argument('-t', '--treenames', default=None, nargs='+')
+    parser.add_argument('--lookup', default=None, nargs='+',
+                        help='Event(s) to look up, in the format run:lumi:event')
+    parser.add_argument('--duplicates', default=False, action='store_true',
+                        help='Print events that occur more than once')
+    args = parser.parse_args()
+
+    # build the index if no query is requested
+    if( args.lookup is None and not args.duplicates ):
+        for inputfile in args.inputfiles:
+            print('Building event index for {}...'.format(inputfile))
+            eventindex = EventIndex.build(inputfile, treenames=args.treenames)
+            eventindex.save(get_indexfile(inputfile), filename=inputfile)
+            for treename in eventindex.treenames():
+                print('  - {}: {} events'.format(treename, len(eventindex[treename])))
+        sys.exit()
+
+    # parse the events to look up
+    lookups = []
+    if args.lookup is not None:
+        for lookup in args.lookup:
+            try: (run, lumi, event) = [int(el) for el in lookup.split(':')]
+            except ValueError:
+                msg = 'ERROR: could not parse event {};'.format(lookup)
+                msg += ' expected format is run:lumi:event.'
+                raise Exception(msg)
+            lookups.append((run, lumi, event))
+
+    # do the queries
+    for inputfile in args.inputfiles:
+        eventindex = get_eventindex(inputfile, treenames=args.treenames)
+        treenames = args.treenames if args.treenames is not None else eventindex.treenames()
+        print('File {}:'.format(inputfile))
+        for (run, lumi, event) in lookups:
+            print('  Event {}:{}:{}'.format(run, lumi, event))
+            for treename in treenames:
+                ranges = eventindex.lookup(run, lumi, event, treename=treename)
+                if len(ranges)==0: print('    - {}: not found'.format(treename))
+                for (start, stop) in ranges:
+                    print('    - {}: entries {} to {}'.format(treename, start, stop))
+        if args.duplicates:
+            for treename in treenames:
+                duplicates = eventindex[treename].duplicates()
+                print('  Found {} duplicate events in {}'.format(len(duplicates), treename))
+                for key in duplicates:
+                    print('    - {}:{}:{}'.format(key['run'], key['lumi'], key['event']))
@@ -0,0 +1,88 @@
+##############################################################
+# tools for filling histograms from numpy arrays of values #
+##############################################################
+# The bin index of each value is computed once (with searchsorted on the bin edges),
+# after which the sum of weights and the sum of squared weights in each bin
+# are each filled with a single bincount.
+# This avoids sorting the same values into the bins twice
+# (as with one np.histogram call for the weights and one for the squared weights),
+# and multi-dimensional histograms (e.g. a sideband variable histogram in each bin of a main variable)
+# are filled in one go by combining the bin indices along each axis into one flat index.
+# One-dimensional histograms are filled directly, without a dummy secondary axis.
+# note: the bins follow the convention of np.histogram (each bin includes its lower edge,
+#       the last bin also its upper edge), and the results for multi-dimensional histograms
+#       are identical to the ones of np.histogramdd (or np.histogram2d).
+# note: only numpy is needed (no ROOT), see histtools.py for tools for ROOT histograms.
+
+import numpy as np
+
+
+def get_binindex(values, bins, open=False):
+    ### get the index of the bin containing each value
+    # input arguments:
+    # - values: array of values
+    # - bins: bin edges (increasing)
+    # - open: if True, values on any bin edge are considered outside the bins
+    #   (i.e. each bin is the open interval between its edges)
+    # returns an array of bin indices, with -1 for values outside the bins (or NaN)
+    values = np.asarray(values)
+    bins = np.asarray(bins)
+    nbins = len(bins)-1
+    index = np.searchsorted(bins, values, side='right')-1
+    if open:
+        inside = ( (index>=0) & (index<nbins) )
+        inside[inside] = (values[inside]!=bins[index[inside]])
+    else:
+        # (values on the upper edge of the last bin belong to the last bin)
+        index[values==bins[-1]] = nbins-1
+        inside = ( (index>=0) & (index<nbins) )
+    index[~inside] = -1
+    return index
+
+def get_flatindex(indices, nbins):
+    ### combine the bin indices along several axes into one flat index (in row-major order)
+    # input arguments:
+    # - indices: list of arrays of bin indices (see get_binindex), one per axis
+    # - nbins: list of number of bins, one per axis
+    # returns an array of flat indices, with -1 for values outside the bins along any axis
+    flatindex = np.zeros(len(indices[0]), dtype=np.int64)
+    inside = np.ones(len(indices[0]), dtype=bool)
+    for index, n in zip(indices, nbins):
+        flatindex = flatindex*n + index
+        inside = (inside & (index>=0))
+    flatindex[~inside] = -1
+    return flatindex
+
+def fill_bincount(index, nbins, weights=None):
+    ### fill the sum of weights and the sum of squared weights in each bin
+    # input arguments:
+    # - index: array of (flat) bin indices (see get_binindex and get_flatindex)
+    # - nbins: total number of bins
+    # - weights: array of weights (default: unit weights)
+    # returns a tuple (sum of weights, sum of squared weights), each of shape (nbins,)
+    mask = (index>=0)
+    index = index[mask]
+    if weights is None:
+        counts = np.bincount(index, minlength=nbins)
+        return (counts, counts.copy())
+    weights = np.asarray(weights)[mask]
+    sumweights = np.bincount(index, weights=weights, minlength=nbins)
+    sumweights2 = np.bincount(index, weights=np.power(weights,2), minlength=nbins)
+    return (sumweights, sumweights2)
+
+def histogram(values, bins, weights=None, open=False):
+    ### fill a one- or multi-dimensional histogram
+    # input arguments:
+    # - values: array of values (one-dimensional) or list of arrays of values (one per axis)
+    # - bins: bin edges (one-dimensional) or list of bin edges (one per axis)
+    # - weights: array of weights (default: unit weights)
+    # - open: see get_binindex (for all axes)
+    # returns a tuple (sum of weights, sum of squared weights),
+    # each of shape (nbins,) (one-dimensional) or (nbins x, nbins y, ...)
+    if np.ndim(bins[0])==0:
+        index = get_binindex(values, bins, open=open)
+        return fill_bincount(index, len(bins)-1, weights=weights)
+    nbins = [len(axisbins)-1 for axisbins in bins]
+    indices = [get_binindex(axisvalues, axisbins, open=open) for axisvalues, axisbins in zip(values, bins)]
+    (sumweights, sumweights2) = fill_bincount(get_flatindex(indices, nbins), int(np.prod(nbins)), weights=weights)
+    return (sumweights.reshape(nbins), sumweights2.reshape(nbins))
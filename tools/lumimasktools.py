@@ -0,0 +1,144 @@
+#################################################################
+# tools for applying a lumi mask (e.g. a golden json) to events #
+#################################################################
+# A lumi mask is a json file of the form {"<run>": [[<first ls>, <last ls>], ...], ...}
+# (the format of the CMS certification files and of the processed lumi lists written by crab).
+# The mask is compiled into a sorted array of non-overlapping lumi section intervals,
+# with run and lumi section combined into a single integer key,
+# so that a full array of events can be checked with one vectorized searchsorted.
+# The run and lumi sections of the events passing the mask can be written to a json file
+# in the same format (see write_lumilist), e.g. as input for pileupCalc.py
+# or for the luminosity bookkeeping.
+
+# usage example (merging the lumi lists of several files):
+# python3 lumimasktools.py -i <lumi list(s)> -o <merged lumi list>
+
+import os
+import json
+import argparse
+import numpy as np
+
+
+def get_lumikeys(runs, lumis):
+    ### combine arrays of run numbers and lumi sections into single integer keys
+    runs = np.asarray(runs).astype(np.int64)
+    lumis = np.asarray(lumis).astype(np.int64)
+    return (runs << 32) | lumis
+
+def split_lumikeys(keys):
+    ### inverse of get_lumikeys
+    keys = np.asarray(keys).astype(np.int64)
+    return (keys >> 32, keys & 0xffffffff)
+
+def read_lumilist(filename):
+    ### read a lumi mask or lumi list json file
+    # returns a dict matching run numbers (int) to lists of [first, last] lumi section ranges
+    if not os.path.exists(filename):
+        raise Exception('ERROR: lumi mask {} does not exist.'.format(filename))
+    with open(filename, 'r') as f: content = json.load(f)
+    return {int(run): [[int(first), int(last)] for (first, last) in ranges]
+            for run, ranges in content.items()}
+
+def compact_lumilist(keys):
+    ### convert an array of (unique) lumi keys into a dict of lumi section ranges per run
+    # (consecutive lumi sections in the same run are combined into one range)
+    keys = np.unique(keys)
+    lumilist = {}
+    if len(keys)==0: return lumilist
+    (runs, lumis) = split_lumikeys(keys)
+    # a new range starts at every key that does not directly follow the previous one
+    starts = np.nonzero(np.diff(keys, prepend=keys[0]-2)!=1)[0]
+    stops = np.append(starts[1:], len(keys))-1
+    for start, stop in zip(starts, stops):
+        lumilist.setdefault(int(runs[start]), []).append([int(lumis[start]), int(lumis[stop])])
+    return lumilist
+
+def write_lumilist(lumilist, filename):
+    ### write a dict of lumi section ranges per run to a json file (in the format of the lumi masks)
+    content = {str(run): lumilist[run] for run in sorted(lumilist.keys())}
+    with open(filename, 'w') as f: json.dump(content, f, sort_keys=False)
+
+def merge_lumilists(lumilists):
+    ### merge several dicts of lumi section ranges per run into one
+    keys = [LumiMask(lumilist).get_keys() for lumilist in lumilists]
+    if len(keys)==0: return {}
+    return compact_lumilist(np.concatenate(keys))
+
+def count_lumis(lumilist):
+    ### count the number of lumi sections in a dict of lumi section ranges per run
+    return sum(last-first+1 for ranges in lumilist.values() for (first, last) in ranges)
+
+
+class LumiMask(object):
+    ### compiled lumi mask
+
+    def __init__(self, lumimask):
+        ### initializer
+        # input arguments:
+        # - lumimask: json file name or dict of lumi section ranges per run
+        self.filename = None
+        if isinstance(lumimask, str):
+            self.filename = lumimask
+            lumimask = read_lumilist(lumimask)
+        # sort the intervals and merge overlapping ones,
+        # so that each key falls in at most one interval
+        intervals = sorted([(run, first, last) for run, ranges in lumimask.items()
+                            for (first, last) in ranges if last>=first])
+        starts = []
+        stops = []
+        for (run, first, last) in intervals:
+            start = (run << 32) | first
+            stop = (run << 32) | last
+            if( len(stops)>0 and start<=stops[-1]+1 ): stops[-1] = max(stops[-1], stop)
+            else:
+                starts.append(start)
+                stops.append(stop)
+        self.starts = np.array(starts, dtype=np.int64)
+        self.stops = np.array(stops, dtype=np.int64)
+
+    def __len__(self):
+        ### number of lumi sections in the mask
+        return int(np.sum(self.stops-self.starts+1))
+
+    def get_keys(self):
+        ### get the keys of all lumi sections in the mask (see get_lumikeys)
+        if len(self.starts)==0: return np.zeros(0, dtype=np.int64)
+        lengths = self.stops-self.starts+1
+        offsets = np.arange(np.sum(lengths)) - np.repeat(np.cumsum(lengths)-lengths, lengths)
+        return np.repeat(self.starts, lengths) + offsets
+
+    def contains_keys(self, keys):
+        ### check for an array of lumi keys whether they are in the mask
+        # (a key is in the mask if it is not beyond the end
+        #  of the last interval starting before or at the key)
+        keys = np.asarray(keys)
+        if len(self.starts)==0: return np.zeros(len(keys), dtype=bool)
+        idx = np.searchsorted(self.starts, keys, side='right')-1
+        return ( (idx>=0) & (keys<=self.stops[np.maximum(idx, 0)]) )
+
+    def mask(self, runs, lumis):
+        ### get a boolean mask for arrays of run numbers and lumi sections
+        return self.contains_keys(get_lumikeys(runs, lumis))
+
+
+if __name__=='__main__':
+
+    # read command line arguments
+    parser = argparse.ArgumentParser( description = 'Merge lumi lists' )
+    parser.add_argument('-i', '--inputfiles', required=True, nargs='+',
+                        help='Lumi list json files to merge')
+    parser.add_argument('-o', '--outputfile', required=True,
+                        help='Output json file')
+    parser.add_argument('--lumimask', default=None,
+                        help='Only keep the lumi sections in this lumi mask')
+    args = parser.parse_args()
+
+    # merge the lumi lists
+    lumilist = merge_lumilists([read_lumilist(f) for f in args.inputfiles])
+    if args.lumimask is not None:
+        keys = LumiMask(lumilist).get_keys()
+        lumilist = compact_lumilist(keys[LumiMask(args.lumimask).contains_keys(keys)])
+    write_lumilist(lumilist, args.outputfile)
+    msg = 'Written {} lumi sections in {} runs'.format(count_lumis(lumilist), len(lumilist))
+    msg += ' to {}'.format(args.outputfile)
+    print(msg)
@@ -0,0 +1,128 @@
+##############################################################
+# tools for keeping track of processed files with a manifest #
+##############################################################
+# Each output directory can hold a manifest (a json file named v0manifest.json)
+# with one record per output file, describing how that output was made:
+# the input file (path, size, modification time and optionally a content checksum),
+# the processing settings (e.g. selection name) and the version of the processing code.
+# Before resubmitting, outputs whose record still matches the current input file,
+# settings and code version can be skipped; only missing or stale outputs need to be remade.
+# Stale outputs (and outputs without input) should be removed together with their record
+# before remaking them (see remove_outputs), so that a failed job does not leave them in place.
+# note: several jobs (e.g. on condor) can write to the same manifest,
+#       so updates are done under a file lock and the manifest is replaced atomically.
+
+import os
+import json
+import zlib
+import fcntl
+import transfertools as tt
+
+# name of the manifest file in each output directory
+manifestname = 'v0manifest.json'
+
+
+def get_manifestfile(outputdir):
+    ### get the name of the manifest file for an output directory
+    return os.path.join(outputdir, manifestname)
+
+def get_fileinfo(filename, checksum=False):
+    ### get the size, modification time and (optionally) checksum of a file
+    stat = os.stat(filename)
+    info = {'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+    if checksum: info['checksum'] = tt.get_checksum(filename)
+    return info
+
+def get_version(sourcefiles):
+    ### get a version tag for a piece of code, as a checksum of its source files
+    version = 1
+    for sourcefile in sourcefiles:
+        with open(sourcefile, 'rb') as f: version = zlib.adler32(f.read(), version)
+    return '{:08x}'.format(version)
+
+def make_record(inputfile, outputfile, settings, version, checksum=False):
+    ### make the manifest record for an output file
+    # input arguments:
+    # - inputfile: input file the output was made from
+    # - outputfile: output file (must exist)
+    # - settings: dict with the processing settings (must be json serializable)
+    # - version: version tag of the processing code (see get_version)
+    # - checksum: also store a checksum of the input file
+    #   (more robust than size and modification time, but requires reading the file)
+    record = {
+        'input': os.path.abspath(inputfile),
+        'inputinfo': get_fileinfo(inputfile, checksum=checksum),
+        'outputinfo': get_fileinfo(outputfile),
+        'settings': settings,
+        'version': version
+    }
+    return record
+
+def read_manifest(outputdir):
+    ### read the manifest of an output directory
+    # returns a dict matching output file names (relative to the directory) to records
+    manifestfile = get_manifestfile(outputdir)
+    if not os.path.exists(manifestfile): return {}
+    with open(manifestfile, 'r') as f: return json.load(f)
+
+def update_manifest(outputdir, records, remove=None):
+    ### add or replace records in the manifest of an output directory
+    # input arguments:
+    # - outputdir: output directory
+    # - records: dict matching output file names (relative to the directory) to records
+    # - remove: list of output file names (relative to the directory) whose records are removed
+    manifestfile = get_manifestfile(outputdir)
+    with open(manifestfile+'.lock', 'w') as lockfile:
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+        try:
+            manifest = read_manifest(outputdir)
+            for outputname in (remove if remove is not None else []): manifest.pop(outputname, None)
+            manifest.update(records)
+            tmpfile = manifestfile+'.tmp{}'.format(os.getpid())
+            with open(tmpfile, 'w') as f: json.dump(manifest, f, indent=2, sort_keys=True)
+            os.replace(tmpfile, manifestfile)
+        finally: fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+def add_record(inputfile, outputfile, settings, version, checksum=False):
+    ### add the record for a single output file to the manifest of its directory
+    (outputdir, outputname) = os.path.split(os.path.abspath(outputfile))
+    record = make_record(inputfile, outputfile, settings, version, checksum=checksum)
+    update_manifest(outputdir, {outputname: record})
+
+def remove_outputs(outputdir, outputnames, extensions=[]):
+    ### remove output files and their records from the manifest of an output directory
+    # input arguments:
+    # - outputdir: output directory
+    # - outputnames: list of output file names (relative to the directory)
+    # - extensions: list of suffixes of auxiliary files belonging to each output
+    #   (e.g. '_lumis.json' for <output name>_lumis.json), removed as well if they exist
+    # note: the records are removed first, so that an output is never left
+    #       with a record while being (re)made.
+    if len(outputnames)==0: return
+    update_manifest(outputdir, {}, remove=outputnames)
+    for outputname in outputnames:
+        outputfile = os.path.join(outputdir, outputname)
+        auxfiles = [os.path.splitext(outputfile)[0]+extension for extension in extensions]
+        for filename in [outputfile] + auxfiles:
+            if os.path.exists(filename): os.remove(filename)
+
+def get_staleness(record, inputfile, outputfile, settings, version):
+    ### check whether an output file is up to date with respect to its manifest record
+    # returns None if the output is up to date, else a short description of the reason
+    if record is None: return 'no manifest record'
+    if not os.path.exists(outputfile): return 'output missing'
+    if record['outputinfo']!=get_fileinfo(outputfile): return 'output modified'
+    if record['input']!=os.path.abspath(inputfile): return 'different input file'
+    if not os.path.exists(inputfile): return 'input missing'
+    if record['settings']!=settings: return 'different settings'
+    if record['version']!=version: return 'different code version'
+    # compare input file size and modification time;
+    # if the record has a checksum, a different modification time alone
+    # (e.g. after copying) does not make the output stale.
+    recordinfo = record['inputinfo']
+    inputinfo = get_fileinfo(inputfile)
+    if recordinfo['size']!=inputinfo['size']: return 'input modified'
+    if recordinfo['mtime']!=inputinfo['mtime']:
+        if 'checksum' not in recordinfo: return 'input modified'
+        if tt.get_checksum(inputfile)!=recordinfo['checksum']: return 'input modified'
+    return None
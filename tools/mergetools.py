@@ -1,21 +1,53 @@
-######################################
-# tools for merging files using hadd #
-######################################
+################################################
+# tools for merging files using hadd or uproot #
+################################################
+# note: besides hadd, a python merger is available (see treemerge)
+#       that merges in a parallel tree reduction over a pool of worker processes;
+#       it handles trees with flat branches (e.g. the V0 files) and 1D histograms
+#       (e.g. hCounter and nTrueInteractions), but not trees with variable-size branches
+#       (e.g. the skimmed ntuples), for which hadd should be used.
 import os
 import sys
+import time
+import shutil
+import tempfile
+import multiprocessing
+import numpy as np
 import jobsubmission as jobsub
+import mergeverify as mv
 
 def mergefiles(input_file_list, output_file_name,
-    removeinput=False, runjob=False):
+    removeinput=False, runjob=False, nworkers=None, fanin=8, compression=None, verify=False):
     ### merge files in inputfilelist into outputfile
     # all files in inputfilelist are assumed to be root files
+    # if nworkers is specified, the python merger (see treemerge) is used
+    # with this number of worker processes, fan-in and compression, instead of hadd.
+    # if verify is True, the merged file is checked against the input files
+    # (see mergeverify.py; not for jobs), and the input files are only removed if it passes.
 
     # if less than 2 input files: return without merging
     if len(input_file_list)<=1: return
     # set output directory
-    output_directory = output_file_name.rsplit('/',1)[0]
+    output_directory = os.path.dirname(os.path.abspath(output_file_name))
     if not os.path.exists(output_directory):
         os.makedirs(output_directory)
+    # run python merger or hadd locally if requested
+    if( (nworkers is not None or verify) and not runjob ):
+        if nworkers is not None:
+            treemerge(input_file_list, output_file_name, nworkers=nworkers, fanin=fanin,
+                      compression=compression)
+        else:
+            status = os.system('hadd '+output_file_name+' '+' '.join(input_file_list))
+            if status!=0:
+                msg = 'ERROR: hadd failed (exit status {})'.format(status)
+                msg += ' while merging into {}.'.format(output_file_name)
+                raise Exception(msg)
+        if verify:
+            mv.check_merge(input_file_list, output_file_name,
+                           nworkers=(nworkers if nworkers is not None else 1))
+        if removeinput:
+            for f in input_file_list: os.remove(f)
+        return
     cmds = []
     # make hadd command
     cmd = 'hadd '+output_file_name
@@ -35,8 +67,12 @@ def mergefiles(input_file_list, output_file_name,
             script.write('1>&2 echo "###done###"\n')
         jobsub.submitQsubJob(scriptname)
     # run locally
+    # (stop if hadd fails, so that the input files are not removed)
     else:
-        for cmd in cmds: os.system(cmd)
+        for cmd in cmds:
+            status = os.system(cmd)
+            if status!=0:
+                raise Exception('ERROR: command {} failed (exit status {}).'.format(cmd, status))
 
 def mergeallfiles(input_directory, output_file_name,
     removeinput=False, runjob=False):
@@ -70,3 +106,178 @@ def mergeallfiles(input_directory, output_file_name,
     # run locally
     else:
         for cmd in cmds: os.system(cmd)
+
+
+def get_mergeobjects(f):
+    ### get the objects to merge in an opened (uproot) file
+    # returns a dict matching object names (including directories) to their type,
+    # which is one of 'tree', 'histogram' or 'string'
+    objects = {}
+    for name, classname in f.classnames(recursive=True, cycle=False).items():
+        if classname=='TDirectory': continue
+        elif classname in ['TTree', 'ROOT::RNTuple']: objects[name] = 'tree'
+        elif( classname.startswith('TH1') and classname[-1] in 'DFIS' ): objects[name] = 'histogram'
+        elif classname=='TObjString': objects[name] = 'string'
+        else:
+            msg = 'ERROR: object {} of type {} cannot be merged.'.format(name, classname)
+            raise Exception(msg)
+    return objects
+
+def get_branchtypes(arrays):
+    ### get the branch types (for uproot mktree) from a dict of numpy arrays
+    types = {}
+    for name, values in arrays.items():
+        if values.dtype==object:
+            msg = 'ERROR: branch {} has a variable size,'.format(name)
+            msg += ' which is not supported by the python merger; use hadd instead.'
+            raise Exception(msg)
+        if values.ndim==1: types[name] = values.dtype
+        else: types[name] = (values.dtype, values.shape[1:])
+    return types
+
+def merge_histograms(histograms):
+    ### sum a list of 1D histograms (uproot objects) into a writable histogram
+    # the bin contents (including under- and overflow), sums of squared weights
+    # and statistics are summed; the binning must be the same for all histograms.
+    import uproot
+    first = histograms[0]
+    edges = first.axis().edges()
+    values = np.zeros(len(first.values(flow=True)), dtype=np.asarray(first.values(flow=True)).dtype)
+    sumw2 = np.zeros(len(values))
+    stats = dict((key, 0.) for key in ['fEntries', 'fTsumw', 'fTsumw2', 'fTsumwx', 'fTsumwx2'])
+    for hist in histograms:
+        if not np.array_equal(hist.axis().edges(), edges):
+            msg = 'ERROR: histograms {} have different binning.'.format(first.member('fName'))
+            raise Exception(msg)
+        values += hist.values(flow=True)
+        thissumw2 = np.asarray(hist.member('fSumw2'))
+        # (histograms without stored sum of squared weights have unit weights)
+        sumw2 += thissumw2 if len(thissumw2)==len(values) else hist.values(flow=True)
+        for key in stats.keys(): stats[key] += hist.member(key)
+    axis = first.member('fXaxis')
+    xbins = np.asarray(axis.member('fXbins'))
+    xaxis = uproot.writing.identify.to_TAxis('xaxis', axis.member('fTitle'),
+              axis.member('fNbins'), axis.member('fXmin'), axis.member('fXmax'),
+              fXbins=(xbins if len(xbins)>0 else None))
+    return uproot.writing.identify.to_TH1x(first.member('fName'), first.member('fTitle'),
+              values, stats['fEntries'], stats['fTsumw'], stats['fTsumw2'],
+              stats['fTsumwx'], stats['fTsumwx2'], sumw2, xaxis)
+
+def get_compression(compression):
+    ### get an uproot compression object from a string of the form <algorithm>[:<level>]
+    # (e.g. LZ4:4; algorithm is one of ZLIB, LZ4, ZSTD and LZMA)
+    import uproot
+    if compression is None: return None
+    if not isinstance(compression, str): return compression
+    parts = compression.split(':')
+    if parts[0] not in ['ZLIB', 'LZ4', 'ZSTD', 'LZMA']:
+        raise Exception('ERROR: compression algorithm {} not recognized.'.format(parts[0]))
+    if len(parts)==1: return getattr(uproot, parts[0])(1)
+    return getattr(uproot, parts[0])(int(parts[1]))
+
+def merge_rootfiles(inputfiles, outputfile, chunksize=500000, compression=None):
+    ### merge root files into one in a single process (using uproot)
+    # trees are concatenated (in the order of the input files) chunk by chunk,
+    # histograms are summed (see merge_histograms),
+    # and strings are copied (they must be the same in all input files).
+    # note: the output trees are always written as TTrees,
+    #       with the given compression (see get_compression, default: uproot default).
+    import uproot
+    fins = [uproot.open(f) for f in inputfiles]
+    try:
+        objects = get_mergeobjects(fins[0])
+        for f, fin in zip(inputfiles[1:], fins[1:]):
+            if get_mergeobjects(fin)!=objects:
+                msg = 'ERROR: file {} does not contain the same objects'.format(f)
+                msg += ' as {}.'.format(inputfiles[0])
+                raise Exception(msg)
+        kwargs = {}
+        if compression is not None: kwargs['compression'] = get_compression(compression)
+        with uproot.recreate(outputfile, **kwargs) as fout:
+            for name, objtype in objects.items():
+                if objtype=='histogram':
+                    fout[name] = merge_histograms([fin[name] for fin in fins])
+                elif objtype=='string':
+                    values = set([str(fin[name]) for fin in fins])
+                    if len(values)>1:
+                        raise Exception('ERROR: string {} differs between input files.'.format(name))
+                    fout[name] = values.pop()
+                else:
+                    outtree = None
+                    for fin in fins:
+                        tree = fin[name]
+                        for entry_start in range(0, max(tree.num_entries, 1), chunksize):
+                            entry_stop = min(entry_start+chunksize, tree.num_entries)
+                            arrays = tree.arrays(entry_start=entry_start, entry_stop=entry_stop,
+                                                 library='np')
+                            if outtree is None:
+                                outtree = fout.mktree(name, get_branchtypes(arrays))
+                            if len(list(arrays.values())[0])>0: outtree.extend(arrays)
+    finally:
+        for fin in fins: fin.close()
+
+def merge_rootfiles_job(job):
+    ### wrapper around merge_rootfiles for use in a worker pool
+    # input arguments:
+    # - job: tuple of the form (list of input files, output file, chunksize, compression)
+    (inputfiles, outputfile, chunksize, compression) = job
+    merge_rootfiles(inputfiles, outputfile, chunksize=chunksize, compression=compression)
+    return outputfile
+
+def treemerge(inputfiles, outputfile, nworkers=1, fanin=8, chunksize=500000, tmpdir=None,
+              compression=None):
+    ### merge root files in a parallel tree reduction
+    # input arguments:
+    # - inputfiles: list of root files to merge
+    # - outputfile: output file to (re)create
+    # - nworkers: number of parallel worker processes
+    # - fanin: number of files merged into one at each step
+    # - chunksize: number of tree entries to copy at once (limits the memory usage)
+    # - tmpdir: directory for the intermediate files (default: next to the output file)
+    # - compression: compression of the output file (see get_compression)
+    # note: in each step, the files are merged in consecutive groups of fanin files
+    #       (in parallel), until one file remains;
+    #       the order of the tree entries is the same as in the input file list.
+    # note: the intermediate files are written with fast (LZ4) compression,
+    #       since they are only read once.
+    if fanin<2: raise Exception('ERROR: fan-in must be at least 2.')
+    outputdir = os.path.dirname(os.path.abspath(outputfile))
+    if not os.path.exists(outputdir): os.makedirs(outputdir)
+    if tmpdir is None: tmpdir = outputdir
+    workdir = tempfile.mkdtemp(prefix='treemerge_', dir=tmpdir)
+    starttime = time.time()
+    current = list(inputfiles)
+    level = 0
+    try:
+        while( level==0 or len(current)>1 ):
+            groups = [current[i:i+fanin] for i in range(0, len(current), fanin)]
+            if len(groups)==1:
+                outputs = [outputfile]
+                thiscompression = compression
+            else:
+                outputs = [os.path.join(workdir, 'level{}_{}.root'.format(level, i))
+                           for i in range(len(groups))]
+                thiscompression = 'LZ4:1'
+            jobs = [(group, output, chunksize, thiscompression)
+                    for group, output in zip(groups, outputs)]
+            print('Merging step {}: {} files into {}'.format(level+1, len(current), len(outputs)))
+            def report(results):
+                for i, _ in enumerate(results):
+                    msg = '  merged {} of {} groups'.format(i+1, len(jobs))
+                    msg += ' ({:.1f} s elapsed)'.format(time.time()-starttime)
+                    print(msg)
+                    sys.stdout.flush()
+            nprocesses = min(nworkers, len(jobs))
+            if nprocesses<=1: report(map(merge_rootfiles_job, jobs))
+            else:
+                with multiprocessing.Pool(processes=nprocesses) as pool:
+                    report(pool.imap_unordered(merge_rootfiles_job, jobs))
+            # remove intermediate files of the previous step
+            if level>0:
+                for f in current: os.remove(f)
+            current = outputs
+            level += 1
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print('Merged {} files into {} in {:.1f} s'.format(len(inputfiles), outputfile,
+                                                       time.time()-starttime))
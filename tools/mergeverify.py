@@ -0,0 +1,153 @@
+##########################################
+# tools for verifying merged root files #
+##########################################
+# Checks that a merged file is consistent with its input files,
+# i.e. that each tree has the summed number of entries of the input trees,
+# and that each histogram (e.g. hCounter and nTrueInteractions) has the summed content
+# of the input histograms (per bin, including under- and overflow).
+# Only the metadata (number of entries) and histograms are read, not the tree contents,
+# and the input files are read in parallel, so that the check is fast
+# and can be run as the final step of each merge (see mergetools.py).
+
+# usage example:
+# python3 mergeverify.py -i <input file(s) or directory> -o <merged file> --nworkers 8
+
+import os
+import sys
+import fnmatch
+import argparse
+import multiprocessing
+import numpy as np
+
+
+def get_summary(filename):
+    ### get the number of entries of each tree and the content of each histogram in a file
+    # returns a dict of the form {'trees': {name: entries}, 'histograms': {name: values}},
+    # where the histogram values include under- and overflow
+    # note: objects in subdirectories are included (with their full path as name).
+    import uproot
+    summary = {'trees': {}, 'histograms': {}}
+    with uproot.open(filename) as f:
+        for name, classname in f.classnames(recursive=True, cycle=False).items():
+            if classname in ['TTree', 'ROOT::RNTuple']:
+                summary['trees'][name] = f[name].num_entries
+            elif classname.startswith('TH'):
+                summary['histograms'][name] = np.asarray(f[name].values(flow=True))
+    return summary
+
+def get_summaries(filenames, nworkers=1):
+    ### get the summaries (see get_summary) of a list of files, in parallel
+    if( nworkers<=1 or len(filenames)<=1 ): return [get_summary(f) for f in filenames]
+    with multiprocessing.Pool(processes=min(nworkers, len(filenames))) as pool:
+        return pool.map(get_summary, filenames)
+
+def sum_summaries(summaries):
+    ### sum a list of summaries (see get_summary)
+    # returns a tuple of the form (summed summary, list of error messages),
+    # where the messages concern histograms with inconsistent binning between the inputs
+    total = {'trees': {}, 'histograms': {}}
+    errors = []
+    for summary in summaries:
+        for name, nentries in summary['trees'].items():
+            total['trees'][name] = total['trees'].get(name, 0) + nentries
+        for name, values in summary['histograms'].items():
+            if name not in total['histograms']: total['histograms'][name] = np.array(values, dtype=float)
+            elif total['histograms'][name].shape!=values.shape:
+                errors.append('histogram {} has a different binning in the input files'.format(name))
+            else: total['histograms'][name] += values
+    return (total, errors)
+
+def compare_summaries(expected, merged, rtol=1e-6):
+    ### compare the summed summary of the input files with the summary of the merged file
+    # returns a list of mismatches (as messages)
+    # note: histogram contents are compared with a relative tolerance,
+    #       since the summing order can differ between merging tools.
+    mismatches = []
+    for name in sorted(set(expected['trees'].keys()) | set(merged['trees'].keys())):
+        if name not in merged['trees']:
+            mismatches.append('tree {} is missing in the merged file'.format(name))
+        elif name not in expected['trees']:
+            mismatches.append('tree {} is not present in the input files'.format(name))
+        elif merged['trees'][name]!=expected['trees'][name]:
+            msg = 'tree {} has {} entries'.format(name, merged['trees'][name])
+            msg += ' instead of {}'.format(expected['trees'][name])
+            mismatches.append(msg)
+    for name in sorted(set(expected['histograms'].keys()) | set(merged['histograms'].keys())):
+        if name not in merged['histograms']:
+            mismatches.append('histogram {} is missing in the merged file'.format(name))
+            continue
+        if name not in expected['histograms']:
+            mismatches.append('histogram {} is not present in the input files'.format(name))
+            continue
+        (exp, res) = (expected['histograms'][name], merged['histograms'][name])
+        if exp.shape!=res.shape:
+            mismatches.append('histogram {} has a different binning in the merged file'.format(name))
+        elif not np.allclose(res, exp, rtol=rtol, atol=0):
+            nbins = int(np.sum(~np.isclose(res, exp, rtol=rtol, atol=0)))
+            msg = 'histogram {} differs in {} bins'.format(name, nbins)
+            msg += ' (sum {} instead of {})'.format(np.sum(res), np.sum(exp))
+            mismatches.append(msg)
+    return mismatches
+
+def verify_merge(inputfiles, outputfile, nworkers=1, rtol=1e-6, removed=None):
+    ### check a merged file against its input files
+    # input arguments:
+    # - inputfiles: list of input files
+    # - outputfile: merged file
+    # - nworkers: number of parallel processes for reading the input files
+    # - rtol: relative tolerance for the histogram contents
+    # - removed: dict matching tree names to the number of entries removed during the merge
+    #   (e.g. duplicate events, see dedupmerge.py)
+    # returns a list of mismatches (as messages); an empty list means the merge is consistent
+    if not os.path.exists(outputfile): return ['merged file {} does not exist'.format(outputfile)]
+    summaries = get_summaries(list(inputfiles)+[outputfile], nworkers=nworkers)
+    (expected, errors) = sum_summaries(summaries[:-1])
+    if removed is not None:
+        for name, nremoved in removed.items():
+            if name in expected['trees']: expected['trees'][name] -= nremoved
+    return errors + compare_summaries(expected, summaries[-1], rtol=rtol)
+
+def check_merge(inputfiles, outputfile, nworkers=1, **kwargs):
+    ### same as verify_merge, but print a report and raise an error in case of mismatches
+    print('Verifying merged file {} against {} input files...'.format(outputfile, len(inputfiles)))
+    mismatches = verify_merge(inputfiles, outputfile, nworkers=nworkers, **kwargs)
+    if len(mismatches)>0:
+        msg = 'ERROR: merged file {} is not consistent with its input files:\n'.format(outputfile)
+        for mismatch in mismatches: msg += '  - {}\n'.format(mismatch)
+        raise Exception(msg)
+    print('Merged file {} is consistent with its input files.'.format(outputfile))
+
+
+if __name__=='__main__':
+
+    # read command line arguments
+    parser = argparse.ArgumentParser( description = 'Verify a merged root file' )
+    parser.add_argument('-i', '--inputfiles', required=True, nargs='+', type=os.path.abspath,
+                        help='Input files and/or directories containing input files')
+    parser.add_argument('-o', '--outputfile', required=True, type=os.path.abspath,
+                        help='Merged file to verify')
+    parser.add_argument('-k', '--key', default='*.root',
+                        help='Pattern for input files in directories')
+    parser.add_argument('--nworkers', default=1, type=int)
+    parser.add_argument('--rtol', default=1e-6, type=float)
+    args = parser.parse_args()
+
+    # find input files
+    inputfiles = []
+    for inputpath in args.inputfiles:
+        if os.path.isdir(inputpath):
+            inputfiles += sorted([os.path.join(inputpath, f) for f in os.listdir(inputpath)
+                                  if fnmatch.fnmatch(f, args.key)])
+        else: inputfiles.append(inputpath)
+    inputfiles = [f for f in inputfiles if f!=args.outputfile]
+    if len(inputfiles)==0: raise Exception('ERROR: no input files found.')
+
+    # verify the merged file
+    mismatches = verify_merge(inputfiles, args.outputfile, nworkers=args.nworkers, rtol=args.rtol)
+    if len(mismatches)==0:
+        print('Merged file {} is consistent with its {} input files.'.format(
+              args.outputfile, len(inputfiles)))
+    else:
+        print('Found {} mismatches in merged file {}:'.format(len(mismatches), args.outputfile))
+        for mismatch in mismatches: print('  - {}'.format(mismatch))
+        sys.exit(1)
@@ -0,0 +1,226 @@
+#############################################################
+# tools for writing and reading V0 trees as parquet datasets #
+#############################################################
+# The output trees of the V0 building (see v0building/v0builder.py) can be exported
+# to parquet files (see v0building/v0parquet.py), in a directory structure of the form
+# <output directory>/era=<era>/sample=<sample>/<tree name>/<file name>.parquet
+# (i.e. partitioned by era and sample, following the hive conventions).
+# The directory of a given era and sample can be used in place of a V0 root file
+# in the analysis steps; it is read through the ParquetFile class below,
+# which mimics the parts of the uproot file interface used there,
+# while only reading the requested columns and skipping row groups
+# that do not pass the requested filters (based on the row group statistics).
+# note: requires pyarrow, which is only imported when these tools are actually used.
+
+import os
+import numpy as np
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+    import pyarrow.dataset as ds
+except ImportError:
+    pyarrow = None
+
+# operators allowed in filters
+filteroperators = ['<', '<=', '>', '>=', '==', '!=']
+
+
+def check_pyarrow():
+    ### raise an error if pyarrow is not available
+    if pyarrow is None:
+        msg = 'ERROR: reading or writing parquet files requires pyarrow,'
+        msg += ' but it could not be imported.'
+        raise Exception(msg)
+
+def get_partitiondir(outputdir, era, sample):
+    ### get the directory for a given era and sample
+    return os.path.join(outputdir, 'era={}'.format(era), 'sample={}'.format(sample))
+
+def isparquet(path):
+    ### check whether a path is a parquet dataset (as opposed to a root file)
+    if not os.path.isdir(path): return False
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            if f.endswith('.parquet'): return True
+    return False
+
+def get_treefiles(path, treename):
+    ### find all parquet files for a given tree in a dataset directory
+    # note: path can be the top directory of the dataset or the directory of a partition.
+    treefiles = []
+    for root, dirs, files in os.walk(path):
+        if os.path.basename(root)!=treename: continue
+        treefiles += [os.path.join(root, f) for f in files if f.endswith('.parquet')]
+    return sorted(treefiles)
+
+def get_treenames(path):
+    ### find the names of all trees in a dataset directory
+    treenames = set()
+    for root, dirs, files in os.walk(path):
+        if any(f.endswith('.parquet') for f in files): treenames.add(os.path.basename(root))
+    return sorted(treenames)
+
+def get_filter(filters):
+    ### convert a list of filters of the form (column, operator, value) to a pyarrow expression
+    if filters is None or len(filters)==0: return None
+    expression = None
+    for (column, op, value) in filters:
+        if op not in filteroperators:
+            raise Exception('ERROR: filter operator {} not recognized.'.format(op))
+        field = ds.field(column)
+        if op=='<': thisexpression = (field < value)
+        elif op=='<=': thisexpression = (field <= value)
+        elif op=='>': thisexpression = (field > value)
+        elif op=='>=': thisexpression = (field >= value)
+        elif op=='==': thisexpression = (field == value)
+        elif op=='!=': thisexpression = (field != value)
+        expression = thisexpression if expression is None else (expression & thisexpression)
+    return expression
+
+def write_tree(branches, outputfile, rowgroupsize=100000, sortby=None, metadata=None, writer=None):
+    ### write a chunk of a tree to a parquet file
+    # input arguments:
+    # - branches: dict of numpy arrays
+    # - outputfile: parquet file to write (ignored if writer is provided)
+    # - rowgroupsize: number of rows per row group
+    # - sortby: name of a column to sort the rows by (within the chunk),
+    #   which makes the row group statistics more selective when filtering on this column
+    # - metadata: dict of strings to store in the file
+    # - writer: parquet writer returned by a previous call, to append to the same file
+    # returns the parquet writer (close it after the last chunk)
+    check_pyarrow()
+    if sortby is not None:
+        order = np.argsort(branches[sortby], kind='stable')
+        branches = {name: values[order] for name, values in branches.items()}
+    table = pyarrow.table(branches)
+    if writer is None:
+        schema = table.schema
+        if metadata is not None: schema = schema.with_metadata(metadata)
+        outputdir = os.path.dirname(outputfile)
+        if( len(outputdir)>0 and not os.path.exists(outputdir) ): os.makedirs(outputdir)
+        writer = pq.ParquetWriter(outputfile, schema)
+    writer.write_table(table.cast(writer.schema), row_group_size=rowgroupsize)
+    return writer
+
+def open(path, filters=None):
+    ### open a parquet dataset (analogous to uproot.open)
+    return ParquetFile(path, filters=filters)
+
+def get_sourcefile(path):
+    ### get the root file a parquet dataset was converted from
+    # (returns the path itself in case it is not a parquet dataset)
+    if not isparquet(path): return path
+    with ParquetFile(path) as f: return f.get_metadata('source')
+
+
+class ParquetFile(object):
+    ### read-only access to a parquet dataset with an interface similar to uproot files
+    # note: the per-sample sum of weights is available as f['hCounter'].values()[0],
+    #       like the content of the first bin of the hCounter histogram in root files.
+
+    def __init__(self, path, filters=None):
+        ### initializer
+        # input arguments:
+        # - path: top directory of the dataset or directory of a partition
+        # - filters: list of filters of the form (column, operator, value),
+        #   applied to all trees that contain the filtered columns
+        check_pyarrow()
+        self.path = path
+        self.filters = filters
+        self.treenames = get_treenames(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        return False
+
+    def keys(self):
+        keys = list(self.treenames)
+        if self.get_metadata('hCounter') is not None: keys.append('hCounter')
+        return keys
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __getitem__(self, key):
+        if key in self.treenames: return ParquetTree(get_treefiles(self.path, key), filters=self.filters)
+        if( key=='hCounter' and 'hCounter' in self.keys() ): return ParquetCounter(self.get_sumweights())
+        raise KeyError('ERROR: {} not found in parquet dataset {}.'.format(key, self.path))
+
+    def get_metadata(self, key):
+        ### get a metadata value from the first parquet file in the dataset
+        for treename in self.treenames:
+            for treefile in get_treefiles(self.path, treename):
+                metadata = pq.read_schema(treefile).metadata
+                if( metadata is not None and key.encode() in metadata ):
+                    return metadata[key.encode()].decode()
+        return None
+
+    def get_sumweights(self):
+        ### get the sum of weights (summed over all converted root files)
+        # note: the sum of weights is stored in each file of each tree,
+        #       so only the files of the first tree are taken into account.
+        sumweights = 0.
+        treefiles = get_treefiles(self.path, self.treenames[0])
+        for treefile in treefiles:
+            metadata = pq.read_schema(treefile).metadata
+            sumweights += float(metadata[b'hCounter'])
+        return sumweights
+
+
+class ParquetCounter(object):
+    ### minimal replacement for the hCounter histogram in a parquet dataset
+
+    def __init__(self, sumweights):
+        self.sumweights = sumweights
+
+    def values(self):
+        return np.array([self.sumweights])
+
+
+class ParquetTree(object):
+    ### read-only access to a tree in a parquet dataset with an interface similar to uproot trees
+    # note: columns are read only when requested (and cached),
+    #       and only row groups that can pass the filters are read.
+
+    def __init__(self, treefiles, filters=None):
+        self.dataset = ds.dataset(treefiles, format='parquet')
+        self.columns = self.dataset.schema.names
+        # only apply filters on columns that are present in this tree
+        if filters is not None: filters = [f for f in filters if f[0] in self.columns]
+        self.filter = get_filter(filters)
+        self.cache = {}
+        self._num_entries = None
+
+    @property
+    def num_entries(self):
+        if self._num_entries is None: self._num_entries = self.dataset.count_rows(filter=self.filter)
+        return self._num_entries
+
+    def keys(self):
+        return list(self.columns)
+
+    def __getitem__(self, name):
+        if name not in self.columns:
+            raise KeyError('ERROR: column {} not found in parquet tree.'.format(name))
+        return ParquetBranch(self, name)
+
+    def read(self, name):
+        ### read a single column
+        if name not in self.cache:
+            table = self.dataset.to_table(columns=[name], filter=self.filter)
+            self.cache[name] = table.column(name).to_numpy()
+        return self.cache[name]
+
+
+class ParquetBranch(object):
+    ### single column of a parquet tree with an interface similar to uproot branches
+
+    def __init__(self, tree, name):
+        self.tree = tree
+        self.name = name
+
+    def array(self, library='np', entry_start=None, entry_stop=None):
+        if library!='np': raise Exception('ERROR: only numpy arrays are supported for parquet trees.')
+        return self.tree.read(self.name)[entry_start:entry_stop]
@@ -0,0 +1,195 @@
+####################################################
+# Split the trees in a file based on run ranges #
+####################################################
+# Generalization of splitprepost.py to any number of run ranges (e.g. eras),
+# each written to its own output file, in a single pass over each tree.
+# The run ranges are given as a table matching output files to [first run, last run]
+# (inclusive; null/empty for an open boundary), either as a json file of the form
+# {"<output file>": [<first run>, <last run>], ...} or on the command line
+# as <output file>:<first run>-<last run>.
+# The trees are read in chunks of entries, and each entry is routed to its output
+# with a single searchsorted over the sorted run ranges, followed by a stable sort
+# on the output index; the memory use is bounded by the chunk size,
+# and the runtime does not depend on the number of output ranges.
+# Entries with a run number outside all ranges are not written (their number is printed).
+# note: for normalized V0 files (see eventindextools.py), the per-lepton and per-V0 trees
+#       have no run number branch; their entries are routed with their parent event.
+# note: only trees are split; histograms are not copied.
+
+# usage example:
+# python3 splitruns.py -i <input file> -r 2016B.root:272007-275376 2016C.root:275657-276283
+# python3 splitruns.py -i <input file> -r <json file> -t nimloth laurelin
+
+import os
+import sys
+import json
+import argparse
+import numpy as np
+import uproot
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+import eventindextools as eit
+import mergetools as mt
+
+# name of the run number branch
+runbranchname = '_runNb'
+
+
+def parse_runrange(runrange):
+    ### parse a run range of the form <output file>:<first run>-<last run>
+    # returns a tuple (output file, first run, last run), with None for open boundaries
+    try:
+        (outputfile, runs) = runrange.rsplit(':', 1)
+        (first, last) = runs.split('-')
+        first = int(first) if len(first)>0 else None
+        last = int(last) if len(last)>0 else None
+    except ValueError:
+        msg = 'ERROR: run range {} not recognized;'.format(runrange)
+        msg += ' expected <output file>:<first run>-<last run>.'
+        raise Exception(msg)
+    return (outputfile, first, last)
+
+def read_runranges(runranges):
+    ### read a table of run ranges
+    # input arguments:
+    # - runranges: json file name, or list of strings (see parse_runrange)
+    # returns a list of tuples (output file, first run, last run)
+    if( len(runranges)==1 and runranges[0].endswith('.json') ):
+        with open(runranges[0], 'r') as f: content = json.load(f)
+        return [(outputfile, first, last) for outputfile, (first, last) in content.items()]
+    return [parse_runrange(runrange) for runrange in runranges]
+
+
+class RunRouter(object):
+    ### route run numbers to the index of the run range containing them
+
+    def __init__(self, runranges):
+        ### initializer
+        # input arguments:
+        # - runranges: list of tuples (output file, first run, last run)
+        # note: the ranges may be given in any order, but may not overlap.
+        self.outputfiles = [outputfile for (outputfile, _, _) in runranges]
+        if len(set(self.outputfiles))!=len(self.outputfiles):
+            raise Exception('ERROR: each run range should have a different output file.')
+        bounds = [(first if first is not None else 0,
+                   last if last is not None else np.iinfo(np.int64).max, i)
+                  for i, (_, first, last) in enumerate(runranges)]
+        bounds = sorted(bounds)
+        for (first, last, i) in bounds:
+            if last<first: raise Exception('ERROR: empty run range for {}.'.format(self.outputfiles[i]))
+        for (prev, this) in zip(bounds[:-1], bounds[1:]):
+            if this[0]<=prev[1]:
+                msg = 'ERROR: run ranges for {} and {} overlap.'.format(
+                      self.outputfiles[prev[2]], self.outputfiles[this[2]])
+                raise Exception(msg)
+        self.firsts = np.array([b[0] for b in bounds], dtype=np.int64)
+        self.lasts = np.array([b[1] for b in bounds], dtype=np.int64)
+        self.indices = np.array([b[2] for b in bounds], dtype=np.int64)
+
+    def route(self, runs):
+        ### get the index of the run range for each run number (-1 if not in any range)
+        runs = np.asarray(runs).astype(np.int64)
+        pos = np.searchsorted(self.firsts, runs, side='right')-1
+        inrange = ( (pos>=0) & (runs<=self.lasts[np.maximum(pos, 0)]) )
+        return np.where(inrange, self.indices[np.maximum(pos, 0)], -1)
+
+    def split(self, routes):
+        ### get the entries for each output from an array of routes (see route)
+        # returns a list of index arrays, one per output (in the order of the output files)
+        order = np.argsort(routes, kind='stable')
+        counts = np.bincount(routes+1, minlength=len(self.outputfiles)+1)
+        offsets = np.cumsum(counts)
+        # (the first block holds the entries outside all ranges)
+        return [order[offsets[i]:offsets[i+1]] for i in range(len(self.outputfiles))]
+
+
+def get_eventroutes(f, router):
+    ### get the routes of the events in the per-event tree (for normalized files)
+    # note: only the run number branch is read.
+    return router.route(f[eit.eventtreename][runbranchname].array(library='np'))
+
+def get_treeroutes(f, treename, router, entry_start, entry_stop, eventroutes=None, eventoffsets=None):
+    ### get the routes of a chunk of entries in a tree
+    # input arguments:
+    # - f: opened (uproot) file
+    # - treename: name of the tree
+    # - router: RunRouter object
+    # - entry_start and entry_stop: range of entries
+    # - eventroutes: routes of the events in the per-event tree (for normalized trees)
+    # - eventoffsets: cumulative number of entries per event in this tree (for normalized trees)
+    tree = f[treename]
+    if runbranchname in tree.keys():
+        return router.route(tree[runbranchname].array(library='np',
+                            entry_start=entry_start, entry_stop=entry_stop))
+    if eventoffsets is None:
+        msg = 'ERROR: tree {} has no branch {}'.format(treename, runbranchname)
+        msg += ' and is not stored in normalized form.'
+        raise Exception(msg)
+    return eventroutes[eit.get_chunkeventindex(eventoffsets, entry_start, entry_stop)]
+
+def splitruns(inputfile, runranges, treenames=None, chunksize=500000, compression=None):
+    ### split the trees in a file in run ranges
+    # input arguments:
+    # - inputfile: input file
+    # - runranges: list of tuples (output file, first run, last run)
+    # - treenames: names of the trees to split (default: all trees in the file)
+    # - chunksize: number of entries to read at once
+    # - compression: compression of the output files (see mergetools.get_compression)
+    # returns a dict matching tree names to the number of entries per output file
+    router = RunRouter(runranges)
+    kwargs = {}
+    if compression is not None: kwargs['compression'] = mt.get_compression(compression)
+    summary = {}
+    with uproot.open(inputfile) as f:
+        if treenames is None:
+            treenames = [name for name, objtype in mt.get_mergeobjects(f).items() if objtype=='tree']
+        eventroutes = None
+        fouts = [uproot.recreate(outputfile, **kwargs) for outputfile in router.outputfiles]
+        try:
+            for treename in treenames:
+                print('Splitting tree {}...'.format(treename))
+                tree = f[treename]
+                eventoffsets = None
+                if( runbranchname not in tree.keys() and eit.isnormalized(f, treename) ):
+                    if eventroutes is None: eventroutes = get_eventroutes(f, router)
+                    eventoffsets = eit.read_eventoffsets(f, treename)
+                outtrees = [None]*len(fouts)
+                nentries = np.zeros(len(fouts)+1, dtype=np.int64)
+                for entry_start in range(0, max(tree.num_entries, 1), chunksize):
+                    entry_stop = min(entry_start+chunksize, tree.num_entries)
+                    arrays = tree.arrays(entry_start=entry_start, entry_stop=entry_stop, library='np')
+                    routes = get_treeroutes(f, treename, router, entry_start, entry_stop,
+                                            eventroutes=eventroutes, eventoffsets=eventoffsets)
+                    nentries += np.bincount(routes+1, minlength=len(fouts)+1)
+                    for i, indices in enumerate(router.split(routes)):
+                        # (the trees are made on the first chunk, so that empty outputs have them too)
+                        if outtrees[i] is None:
+                            outtrees[i] = fouts[i].mktree(treename, mt.get_branchtypes(arrays))
+                        if len(indices)==0: continue
+                        outtrees[i].extend({name: values[indices] for name, values in arrays.items()})
+                # printouts
+                print('  Total number of instances: {}'.format(tree.num_entries))
+                for i, outputfile in enumerate(router.outputfiles):
+                    print('  Instances in {}: {}'.format(outputfile, nentries[i+1]))
+                if nentries[0]>0: print('  Instances outside all run ranges: {}'.format(nentries[0]))
+                summary[treename] = dict(zip(router.outputfiles, nentries[1:].tolist()))
+        finally:
+            for fout in fouts: fout.close()
+    return summary
+
+
+if __name__=='__main__':
+
+    # read command line arguments
+    parser = argparse.ArgumentParser( description = 'Split trees in run ranges' )
+    parser.add_argument('-i', '--inputfile', required=True, type=os.path.abspath)
+    parser.add_argument('-r', '--runranges', required=True, nargs='+',
+                        help='Json file or list of <output file>:<first run>-<last run>')
+    parser.add_argument('-t', '--treenames', default=None, nargs='+',
+                        help='Trees to split (default: all trees)')
+    parser.add_argument('--chunksize', default=500000, type=int)
+    parser.add_argument('--compression', default=None,
+                        help='Compression of the output files, e.g. LZ4:4 (default: ZLIB:1)')
+    args = parser.parse_args()
+
+    splitruns(args.inputfile, read_runranges(args.runranges), treenames=args.treenames,
+              chunksize=args.chunksize, compression=args.compression)
@@ -0,0 +1,305 @@
+#######################################################
+# Generator of synthetic skimmed ntuples for testing #
+#######################################################
+# Writes a file with the same structure as the output of the skimmer
+# (see skimming/skim_ztomumu.cc), i.e. a blackJackAndHookers/blackJackAndHookersTree
+# with the V0 branches written by the V0Analyzer (see ntuplizer),
+# the per-event and di-muon branches added by the skimmer,
+# and the hCounter, nTrueInteractions and nVertices histograms (the former two only for simulation).
+# The content is random but roughly realistic:
+# - Z to mu+ mu- events with a number of V0 candidates per event following a Poisson distribution;
+# - K0s and Lambda candidates with a mass peak on top of a combinatorial background,
+#   where the signal candidates have a displaced vertex with a decay length following
+#   the lifetime of the particle, good track quality and a momentum pointing back to the primary vertex,
+#   while the background candidates are mostly close to the primary vertex, with worse track quality
+#   and random pointing (so that the V0 selection has a realistic effect);
+# - for simulation, positive and negative generator weights and a pileup distribution.
+# This allows to run and benchmark the v0building, filling, fitting and plotting steps
+# locally, without access to the real ntuples.
+
+# usage example:
+# python3 syntheticntuple.py -o sim.root -n 100000
+# python3 syntheticntuple.py -o data.root -n 100000 --data --seed 2
+
+import sys
+import os
+import argparse
+import numpy as np
+import awkward as ak
+import uproot
+
+# tree and histogram names
+dirname = 'blackJackAndHookers'
+treename = 'blackJackAndHookersTree'
+
+# particle properties (mass in GeV and c*tau in cm)
+ksmass = 0.49761
+kstau = 2.6844
+lambdamass = 1.1157
+lambdatau = 7.89
+zmass = 91.1876
+zwidth = 2.4952
+
+# mass windows applied by the V0Analyzer around the nominal masses
+kswindow = 0.07
+lambdawindow = 0.05
+
+# maximum number of V0 candidates per event in the V0Analyzer
+nv0max = 50
+
+# names and types of the V0 branches (in the order of the V0Analyzer)
+v0branches = ([('InvMass', np.float64), ('Type', np.uint32)]
+              + [(name, np.float64) for name in [
+                  'X', 'Y', 'Z', 'XUnc', 'YUnc', 'ZUnc',
+                  'RPV', 'RBS', 'RPVUnc', 'RBSUnc', 'RPVSig', 'RBSSig',
+                  'Px', 'Py', 'Pz', 'Pt', 'Eta', 'Phi',
+                  'DCA', 'PCAX', 'PCAY', 'PCAZ', 'VtxNormChi2',
+                  'PxPos', 'PyPos', 'PzPos', 'PtPos', 'PxNeg', 'PyNeg', 'PzNeg', 'PtNeg',
+                  'EtaPos', 'EtaNeg', 'PhiPos', 'PhiNeg',
+                  'NHitsPos', 'NHitsNeg', 'NormChi2Pos', 'NormChi2Neg',
+                  'D0Pos', 'DzPos', 'D0Neg', 'DzNeg', 'IsoPos', 'IsoNeg']])
+
+
+def generate_events(rng, nevents, isdata, firstevent=0, runrange=(315252, 325175),
+        nlumisperrun=500, negweightfraction=0.1):
+    ### generate the per-event branches for a chunk of events
+    # input arguments:
+    # - rng: numpy random generator
+    # - nevents: number of events to generate
+    # - isdata: whether to generate data (run/lumi numbers) or simulation (weights and pileup)
+    # - firstevent: index of the first event in this chunk (to make event numbers unique)
+    # - runrange: range of run numbers (for data)
+    # - nlumisperrun: number of lumi blocks per run (for data)
+    # - negweightfraction: fraction of events with negative weight (for simulation)
+    events = {}
+    eventidx = firstevent + np.arange(nevents, dtype=np.uint64)
+    if isdata:
+        # events are ordered by run and lumi block (about 100 events per lumi block)
+        lumiidx = eventidx // 100
+        nruns = runrange[1]-runrange[0]+1
+        events['_runNb'] = (runrange[0] + (lumiidx // nlumisperrun) % nruns).astype(np.uint64)
+        events['_lumiBlock'] = (1 + lumiidx % nlumisperrun).astype(np.uint64)
+        events['_eventNb'] = (1 + eventidx*7919 % 1000000007).astype(np.uint64)
+    else:
+        events['_runNb'] = np.ones(nevents, dtype=np.uint64)
+        events['_lumiBlock'] = (1 + eventidx // 1000).astype(np.uint64)
+        events['_eventNb'] = (1 + eventidx).astype(np.uint64)
+        events['_weight'] = np.where(rng.random(nevents)<negweightfraction, -1., 1.)
+        events['_nTrueInt'] = np.clip(rng.normal(32., 12., nevents), 0.5, 99.5).astype(np.float32)
+    # number of reconstructed vertices (correlated with pileup in simulation)
+    if isdata: events['_nVertex'] = rng.poisson(25., nevents).astype(np.uint32)
+    else: events['_nVertex'] = rng.poisson(0.8*events['_nTrueInt']).astype(np.uint32)
+    # beam spot and primary vertex
+    events['_beamSpotX'] = np.full(nevents, 0.0107)
+    events['_beamSpotY'] = np.full(nevents, 0.0417)
+    events['_beamSpotZ'] = np.full(nevents, 0.35)
+    events['_primaryVertexX'] = events['_beamSpotX'] + rng.normal(0., 0.0012, nevents)
+    events['_primaryVertexY'] = events['_beamSpotY'] + rng.normal(0., 0.0012, nevents)
+    events['_primaryVertexZ'] = events['_beamSpotZ'] + rng.normal(0., 3.5, nevents)
+    events['_primaryVertexXUnc'] = rng.uniform(0.0008, 0.002, nevents)
+    events['_primaryVertexYUnc'] = rng.uniform(0.0008, 0.002, nevents)
+    events['_primaryVertexZUnc'] = rng.uniform(0.001, 0.003, nevents)
+    # di-muon system (within the Z mass window applied by the skimmer)
+    mll = zmass + 0.5*zwidth*np.tan(np.pi*(rng.random(nevents)-0.5))
+    outside = (np.abs(mll-zmass)>10.)
+    while np.any(outside):
+        mll[outside] = zmass + 0.5*zwidth*np.tan(np.pi*(rng.random(np.sum(outside))-0.5))
+        outside = (np.abs(mll-zmass)>10.)
+    events['_nimloth_Mll'] = mll
+    events['_nimloth_nJets'] = rng.poisson(0.6, nevents).astype(np.uint32)
+    events['_celeborn_lPt'] = 25. + rng.exponential(15., (nevents,2))
+    events['_celeborn_lEta'] = rng.uniform(-2.4, 2.4, (nevents,2))
+    events['_celeborn_lPhi'] = rng.uniform(-np.pi, np.pi, (nevents,2))
+    charge = np.where(rng.random(nevents)<0.5, 1, -1).astype(np.int32)
+    events['_celeborn_lCharge'] = np.stack([charge, -charge], axis=1)
+    return events
+
+def generate_v0s(rng, events, nv0mean=3., ksfraction=0.25, lambdafraction=0.05):
+    ### generate the V0 branches for a chunk of events
+    # input arguments:
+    # - rng: numpy random generator
+    # - events: per-event branches (see generate_events)
+    # - nv0mean: mean number of V0 candidates per event
+    # - ksfraction: fraction of candidates that are true K0s
+    # - lambdafraction: fraction of candidates that are true Lambdas (or anti-Lambdas)
+    # returns a tuple of the form (number of V0s per event, dict of flat arrays)
+    nevents = len(events['_runNb'])
+    counts = np.minimum(rng.poisson(nv0mean, nevents), nv0max)
+    ntotal = int(np.sum(counts))
+    eventidx = np.repeat(np.arange(nevents), counts)
+    v0s = {}
+
+    # category of each candidate: 0 = background, 1 = K0s, 2 = Lambda
+    u = rng.random(ntotal)
+    category = np.where(u<ksfraction, 1, np.where(u<ksfraction+lambdafraction, 2, 0))
+    issignal = (category>0)
+
+    # candidate type (as assigned by the V0Analyzer) and invariant mass
+    # (signal: gaussian peak, background: linearly falling within the mass window)
+    vtype = np.where(category==1, 1, np.where(rng.random(ntotal)<0.5, 2, 3))
+    bkgtype = rng.choice([1, 2, 3], size=ntotal, p=[0.6, 0.2, 0.2])
+    vtype = np.where(issignal, vtype, bkgtype)
+    isks = (vtype==1)
+    nominal = np.where(isks, ksmass, lambdamass)
+    window = np.where(isks, kswindow, lambdawindow)
+    bkgmass = nominal - window + 2*window*(1-np.sqrt(1-rng.random(ntotal)))
+    sigmass = nominal + rng.normal(0., 1., ntotal)*np.where(isks, 0.006, 0.0025)
+    mass = np.where(issignal, sigmass, bkgmass)
+    mass = np.clip(mass, nominal-window+1e-6, nominal+window-1e-6)
+    v0s['InvMass'] = mass
+    v0s['Type'] = vtype.astype(np.uint32)
+
+    # kinematics
+    pt = 0.3 + rng.exponential(np.where(issignal, 2.0, 1.2))
+    eta = rng.uniform(-2.4, 2.4, ntotal)
+    phi = rng.uniform(-np.pi, np.pi, ntotal)
+    v0s['Px'] = pt*np.cos(phi)
+    v0s['Py'] = pt*np.sin(phi)
+    v0s['Pz'] = pt*np.sinh(eta)
+    v0s['Pt'] = pt
+    v0s['Eta'] = eta
+    v0s['Phi'] = phi
+
+    # vertex position: transverse decay length following the lifetime for signal,
+    # small and in a random direction with respect to the momentum for background
+    ctau = np.where(category==2, lambdatau, kstau)
+    sigr = rng.exponential(pt/np.where(category==2, lambdamass, ksmass)*ctau)
+    bkgr = rng.exponential(1.5, ntotal)
+    r = np.where(issignal, sigr, bkgr)
+    r = np.minimum(r, 60.)
+    pointing = np.where(issignal, rng.normal(0., 0.02, ntotal), rng.normal(0., 0.6, ntotal))
+    vtxphi = phi + pointing
+    pvx = events['_primaryVertexX'][eventidx]
+    pvy = events['_primaryVertexY'][eventidx]
+    pvz = events['_primaryVertexZ'][eventidx]
+    bsx = events['_beamSpotX'][eventidx]
+    bsy = events['_beamSpotY'][eventidx]
+    v0s['X'] = pvx + r*np.cos(vtxphi)
+    v0s['Y'] = pvy + r*np.sin(vtxphi)
+    v0s['Z'] = pvz + r*np.sinh(eta)
+    unc = 0.005 + 0.002*r
+    v0s['XUnc'] = unc*rng.uniform(0.8, 1.2, ntotal)
+    v0s['YUnc'] = unc*rng.uniform(0.8, 1.2, ntotal)
+    v0s['ZUnc'] = 2*unc*rng.uniform(0.8, 1.2, ntotal)
+    v0s['RPV'] = np.sqrt((v0s['X']-pvx)**2 + (v0s['Y']-pvy)**2)
+    v0s['RBS'] = np.sqrt((v0s['X']-bsx)**2 + (v0s['Y']-bsy)**2)
+    v0s['RPVUnc'] = unc
+    v0s['RBSUnc'] = unc
+    v0s['RPVSig'] = v0s['RPV']/v0s['RPVUnc']
+    v0s['RBSSig'] = v0s['RBS']/v0s['RBSUnc']
+
+    # vertex quality
+    v0s['DCA'] = rng.exponential(np.where(issignal, 0.03, 0.15))
+    v0s['PCAX'] = v0s['X'] + rng.normal(0., 0.01, ntotal)
+    v0s['PCAY'] = v0s['Y'] + rng.normal(0., 0.01, ntotal)
+    v0s['PCAZ'] = v0s['Z'] + rng.normal(0., 0.02, ntotal)
+    v0s['VtxNormChi2'] = rng.exponential(np.where(issignal, 1.0, 4.0))
+
+    # daughter tracks: share of the momentum and small opening angle
+    frac = rng.uniform(0.2, 0.8, ntotal)
+    opening = 0.5*np.where(isks, ksmass, lambdamass)/pt
+    for (suffix, thisfrac, sign) in [('Pos', frac, 1.), ('Neg', 1.-frac, -1.)]:
+        dpt = pt*thisfrac
+        deta = eta + sign*rng.normal(0., 1., ntotal)*opening
+        dphi = phi + sign*np.abs(rng.normal(0., 1., ntotal))*opening
+        v0s['Px'+suffix] = dpt*np.cos(dphi)
+        v0s['Py'+suffix] = dpt*np.sin(dphi)
+        v0s['Pz'+suffix] = dpt*np.sinh(deta)
+        v0s['Pt'+suffix] = dpt
+        v0s['Eta'+suffix] = deta
+        v0s['Phi'+suffix] = np.mod(dphi+np.pi, 2*np.pi)-np.pi
+        nhits = np.where(issignal, rng.integers(6, 26, ntotal), rng.integers(3, 20, ntotal))
+        v0s['NHits'+suffix] = nhits.astype(np.float64)
+        v0s['NormChi2'+suffix] = rng.exponential(np.where(issignal, 1.0, 2.5))
+        v0s['D0'+suffix] = rng.normal(0., 1., ntotal)*(0.01 + 0.3*r/(1.+r))
+        v0s['Dz'+suffix] = rng.normal(0., 1., ntotal)*(0.02 + 0.5*r/(1.+r))
+        v0s['Iso'+suffix] = rng.exponential(0.5, ntotal)
+    return (counts, v0s)
+
+def write_ntuple(outputfile, nevents, isdata=False, seed=1, chunksize=100000,
+        nv0mean=3., ksfraction=0.25, lambdafraction=0.05, skimefficiency=0.5, **kwargs):
+    ### write a synthetic skimmed ntuple
+    # input arguments:
+    # - outputfile: name of the root file to write
+    # - nevents: number of events
+    # - isdata: whether to write a data-like or simulation-like file
+    # - seed: seed for the random generator (same seed gives the same file content)
+    # - chunksize: number of events to generate and write at once (bounds the memory usage)
+    # - nv0mean, ksfraction, lambdafraction: see generate_v0s
+    # - skimefficiency: fraction of events passing the skim,
+    #   used to set the (pre-skim) sum of weights in hCounter
+    # - kwargs: passed down to generate_events
+    rng = np.random.default_rng(seed)
+    eventtypes = None
+    sumweights = 0.
+    ntrueint = np.zeros(100)
+    nvertices = np.zeros(120)
+    with uproot.recreate(outputfile) as fout:
+        # note: use fast compression, since random values do not compress well anyway
+        fout.compression = uproot.LZ4(4)
+        for firstevent in range(0, nevents, chunksize):
+            nchunk = min(chunksize, nevents-firstevent)
+            events = generate_events(rng, nchunk, isdata, firstevent=firstevent, **kwargs)
+            (counts, v0s) = generate_v0s(rng, events, nv0mean=nv0mean,
+                              ksfraction=ksfraction, lambdafraction=lambdafraction)
+            branches = dict(events)
+            branches['_V0'] = ak.zip({name: ak.unflatten(v0s[name].astype(dtype), counts)
+                                      for (name, dtype) in v0branches})
+            if eventtypes is None:
+                # create the tree, with one shared counter branch _nV0s for all V0 branches
+                eventtypes = {}
+                for name, values in events.items():
+                    if values.ndim==1: eventtypes[name] = values.dtype
+                    else: eventtypes[name] = (values.dtype, values.shape[1:])
+                eventtypes['_V0'] = branches['_V0'].type
+                fout.mktree('{}/{}'.format(dirname, treename), eventtypes,
+                  field_name=(lambda outer, inner: outer+inner),
+                  counter_name=(lambda counted: '_nV0s'))
+            fout['{}/{}'.format(dirname, treename)].extend(branches)
+            # fill histograms
+            weights = np.ones(nchunk) if isdata else events['_weight']
+            nvertices += np.histogram(events['_nVertex'], bins=np.arange(121), weights=weights)[0]
+            if not isdata:
+                sumweights += np.sum(weights)
+                ntrueint += np.histogram(events['_nTrueInt'], bins=np.arange(101), weights=weights)[0]
+            print('Generated {} out of {} events'.format(firstevent+nchunk, nevents))
+        # write histograms
+        fout['{}/nVertices'.format(dirname)] = (nvertices, np.arange(121.))
+        if not isdata:
+            fout['{}/hCounter'.format(dirname)] = (np.array([sumweights/skimefficiency]), np.array([0., 1.]))
+            fout['{}/nTrueInteractions'.format(dirname)] = (ntrueint/skimefficiency, np.arange(101.))
+
+
+if __name__=='__main__':
+
+    # read command line arguments
+    parser = argparse.ArgumentParser( description = 'Generate synthetic skimmed ntuple' )
+    parser.add_argument('-o', '--outputfile', required=True, type=os.path.abspath)
+    parser.add_argument('-n', '--nevents', default=10000, type=int)
+    parser.add_argument('--data', default=False, action='store_true',
+                        help='Generate a data-like file (default: simulation)')
+    parser.add_argument('--seed', default=1, type=int)
+    parser.add_argument('--chunksize', default=100000, type=int)
+    parser.add_argument('--nv0mean', default=3., type=float,
+                        help='Mean number of V0 candidates per event')
+    parser.add_argument('--ksfraction', default=0.25, type=float,
+                        help='Fraction of V0 candidates that are true K0s')
+    parser.add_argument('--lambdafraction', default=0.05, type=float,
+                        help='Fraction of V0 candidates that are true Lambdas')
+    parser.add_argument('--skimefficiency', default=0.5, type=float,
+                        help='Fraction of events passing the skim (for the sum of weights)')
+    parser.add_argument('--runrange', default=[315252, 325175], type=int, nargs=2,
+                        help='Range of run numbers (for data)')
+    args = parser.parse_args()
+
+    # check arguments
+    if args.ksfraction+args.lambdafraction>1:
+        raise Exception('ERROR: sum of K0s and Lambda fractions must not exceed 1.')
+    outputdir = os.path.dirname(args.outputfile)
+    if not os.path.exists(outputdir): os.makedirs(outputdir)
+
+    # generate the ntuple
+    write_ntuple(args.outputfile, args.nevents, isdata=args.data, seed=args.seed,
+                 chunksize=args.chunksize, nv0mean=args.nv0mean,
+                 ksfraction=args.ksfraction, lambdafraction=args.lambdafraction,
+                 skimefficiency=args.skimefficiency, runrange=tuple(args.runrange))
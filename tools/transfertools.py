@@ -0,0 +1,157 @@
+#############################################################
+# tools for staging input and output files on a local disk #
+#############################################################
+# The Stager class copies input files to a local temporary directory in a background thread
+# (in the order in which they will be processed), so that the next input file
+# is already being transferred while the current one is processed.
+# Output files written to the local directory are moved to their final destination
+# in another background thread. All copies are verified with a checksum.
+# The total size of the files on the local disk is bounded:
+# no new input file is staged as long as the limit would be exceeded
+# (except if no other files are staged, to make sure that large files can still be processed).
+
+import os
+import zlib
+import threading
+import concurrent.futures
+
+# size of the blocks in which files are copied
+blocksize = 16*1024*1024
+
+
+def get_tmpdir():
+    ### get the local temporary directory
+    if 'TMPDIR' in os.environ: return os.environ['TMPDIR']
+    return '/tmp'
+
+def get_checksum(filename):
+    ### calculate the adler32 checksum of a file
+    checksum = 1
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(blocksize)
+            if not block: break
+            checksum = zlib.adler32(block, checksum)
+    return checksum
+
+def copyfile(source, destination):
+    ### copy a file, verifying the checksum of the copy
+    # returns the checksum
+    checksum = 1
+    with open(source, 'rb') as fin, open(destination, 'wb') as fout:
+        while True:
+            block = fin.read(blocksize)
+            if not block: break
+            checksum = zlib.adler32(block, checksum)
+            fout.write(block)
+    copychecksum = get_checksum(destination)
+    if copychecksum!=checksum:
+        os.remove(destination)
+        msg = 'ERROR: checksum mismatch when copying {} to {}'.format(source, destination)
+        msg += ' ({} vs {}).'.format(checksum, copychecksum)
+        raise Exception(msg)
+    return checksum
+
+def movefile(source, destination):
+    ### move a file, verifying the checksum of the copy before removing the source
+    destinationdir = os.path.dirname(destination)
+    if( len(destinationdir)>0 and not os.path.exists(destinationdir) ):
+        os.makedirs(destinationdir)
+    copyfile(source, destination)
+    os.remove(source)
+
+
+class Stager(object):
+    ### stage input files to and output files from a local directory in the background
+
+    def __init__(self, inputfiles, tmpdir=None, maxsize=10e9):
+        ### initializer
+        # input arguments:
+        # - inputfiles: list of input files, in the order in which they will be requested
+        # - tmpdir: local directory to stage to (default: $TMPDIR or /tmp)
+        # - maxsize: maximum total size (in bytes) of staged files on the local disk
+        if tmpdir is None: tmpdir = get_tmpdir()
+        self.tmpdir = tmpdir
+        self.maxsize = maxsize
+        self.used = 0
+        self.sizes = {}
+        self.staged = {}
+        self.condition = threading.Condition()
+        self.uploads = []
+        self.uploader = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.prefetcher = threading.Thread(target=self._prefetch, args=(list(inputfiles),))
+        self.prefetcher.daemon = True
+        self.prefetcher.start()
+
+    def get_localname(self, filename):
+        ### get the name of the local copy of a file
+        return os.path.join(self.tmpdir, filename.strip('/').replace('/','_'))
+
+    def _reserve(self, localfile, size):
+        ### wait until there is enough space on the local disk and reserve it
+        with self.condition:
+            while( self.used>0 and self.used+size>self.maxsize ): self.condition.wait()
+            self.used += size
+            self.sizes[localfile] = size
+
+    def _free(self, localfile):
+        ### free the space reserved for a local file
+        with self.condition:
+            self.used -= self.sizes.pop(localfile, 0)
+            self.condition.notify_all()
+
+    def _prefetch(self, inputfiles):
+        ### copy input files to the local directory one by one
+        for inputfile in inputfiles:
+            localfile = self.get_localname(inputfile)
+            error = None
+            try:
+                self._reserve(localfile, os.path.getsize(inputfile))
+                copyfile(inputfile, localfile)
+            except Exception as e:
+                error = 'ERROR: staging of {} failed: {}'.format(inputfile, repr(e))
+                self._free(localfile)
+            with self.condition:
+                self.staged[inputfile] = (localfile, error)
+                self.condition.notify_all()
+
+    def get(self, inputfile):
+        ### get the local copy of an input file, waiting for it to be staged if needed
+        with self.condition:
+            while inputfile not in self.staged: self.condition.wait()
+            (localfile, error) = self.staged[inputfile]
+        if error is not None: raise Exception(error)
+        return localfile
+
+    def release(self, inputfile):
+        ### remove the local copy of an input file that is no longer needed
+        with self.condition:
+            if inputfile not in self.staged: return
+            (localfile, error) = self.staged.pop(inputfile)
+        if error is not None: return
+        if os.path.exists(localfile): os.remove(localfile)
+        self._free(localfile)
+
+    def upload(self, localfile, destination):
+        ### move a local output file to its destination in the background
+        # note: the output file counts towards the local disk usage until it is moved.
+        with self.condition:
+            self.used += os.path.getsize(localfile)
+            self.sizes[localfile] = os.path.getsize(localfile)
+        def job():
+            try: movefile(localfile, destination)
+            finally: self._free(localfile)
+        self.uploads.append((destination, self.uploader.submit(job)))
+
+    def finish(self):
+        ### wait for all uploads to finish and remove remaining staged input files
+        # returns a list of tuples of the form (destination, error message) for failed uploads
+        with self.condition: remaining = list(self.staged.keys())
+        for inputfile in remaining: self.release(inputfile)
+        failed = []
+        for (destination, upload) in self.uploads:
+            try: upload.result()
+            except Exception as e:
+                failed.append((destination, 'ERROR: upload to {} failed: {}'.format(destination, repr(e))))
+        self.uploader.shutdown()
+        return failed
@@ -0,0 +1,244 @@
+#######################################################
+# tools for virtual (manifest-based) merged V0 files #
+#######################################################
+# Instead of physically merging V0 files (e.g. the per-era files into a per-year file,
+# see v0building/mergeeras.py), a virtual dataset can be defined by a small json manifest
+# listing the constituent files, the number of entries of each tree in each file,
+# and the histograms (e.g. hCounter and nTrueInteractions) summed over all files.
+# The manifest can be used in place of a merged V0 root file in the analysis steps;
+# it is read through the VirtualFile class below, which mimics the parts of the
+# uproot file interface used there and reads the constituent files lazily,
+# i.e. only the files overlapping the requested range of entries are opened.
+# note: the constituent files are referred to relative to the directory of the manifest,
+#       so that the files and manifests can be moved together.
+# note: the function open is named after uproot.open, use io.open for regular files here.
+
+# usage example:
+# python3 virtualtools.py -i <file(s)> -o <manifest>
+
+import os
+import io
+import json
+import argparse
+import numpy as np
+import uproot
+
+# type tag and extension of manifests
+manifesttype = 'virtualdataset'
+manifestextension = '.virtual.json'
+
+
+def get_manifestname(rootfile):
+    ### get the name of the manifest replacing a (merged) root file
+    return os.path.splitext(rootfile)[0]+manifestextension
+
+def isvirtual(path):
+    ### check whether a path is a virtual dataset manifest
+    return path.endswith(manifestextension)
+
+def get_datasetfile(rootfile):
+    ### get the file to read for a (merged) root file:
+    # the root file itself if it exists, else its manifest if that exists
+    if os.path.exists(rootfile): return rootfile
+    manifest = get_manifestname(rootfile)
+    if os.path.exists(manifest): return manifest
+    return rootfile
+
+def get_fileentry(filename, manifestdir):
+    ### get the description of a constituent file for the manifest
+    # returns a dict with the path (relative to the manifest directory),
+    # size, number of entries per tree and histograms (values including under- and overflow)
+    path = os.path.abspath(filename)
+    entry = {'file': os.path.relpath(path, manifestdir),
+             'size': os.path.getsize(path), 'entries': {}, 'histograms': {}, 'strings': {}}
+    with uproot.open(path) as f:
+        for name, classname in f.classnames(recursive=False, cycle=False).items():
+            if classname in ['TTree', 'ROOT::RNTuple']: entry['entries'][name] = f[name].num_entries
+            elif classname.startswith('TH1'):
+                hist = f[name]
+                entry['histograms'][name] = {'edges': hist.axis().edges().tolist(),
+                                             'values': hist.values(flow=True).tolist()}
+            elif classname=='TObjString': entry['strings'][name] = str(f[name])
+    return entry
+
+def make_manifest(inputfiles, manifest):
+    ### make a virtual dataset manifest for a list of V0 files
+    # note: only the metadata of the input files is read.
+    manifestdir = os.path.dirname(os.path.abspath(manifest))
+    files = [get_fileentry(f, manifestdir) for f in inputfiles]
+    if len(files)==0: raise Exception('ERROR: cannot make a virtual dataset without files.')
+    # check that all files have the same trees and histograms
+    for f in files[1:]:
+        for key in ['entries', 'histograms']:
+            if set(f[key].keys())!=set(files[0][key].keys()):
+                msg = 'ERROR: file {} does not have the same {}'.format(f['file'], key)
+                msg += ' as {}.'.format(files[0]['file'])
+                raise Exception(msg)
+    # sum the entries and histograms
+    entries = dict((name, sum(f['entries'][name] for f in files)) for name in files[0]['entries'])
+    histograms = {}
+    for name, hist in files[0]['histograms'].items():
+        for f in files[1:]:
+            if f['histograms'][name]['edges']!=hist['edges']:
+                msg = 'ERROR: histogram {} in file {} has a different binning'.format(name, f['file'])
+                msg += ' than in {}.'.format(files[0]['file'])
+                raise Exception(msg)
+        values = np.sum([f['histograms'][name]['values'] for f in files], axis=0)
+        histograms[name] = {'edges': hist['edges'], 'values': values.tolist()}
+    content = {
+        'type': manifesttype,
+        'trees': list(entries.keys()),
+        'entries': entries,
+        'histograms': histograms,
+        'strings': files[0]['strings'],
+        'files': files
+    }
+    with io.open(manifest, 'w') as f: json.dump(content, f, indent=1)
+    return content
+
+def read_manifest(manifest):
+    ### read a virtual dataset manifest
+    with io.open(manifest, 'r') as f: content = json.load(f)
+    if content.get('type', None)!=manifesttype:
+        raise Exception('ERROR: file {} is not a virtual dataset manifest.'.format(manifest))
+    manifestdir = os.path.dirname(os.path.abspath(manifest))
+    for f in content['files']: f['path'] = os.path.normpath(os.path.join(manifestdir, f['file']))
+    return content
+
+def open(path):
+    ### open a virtual dataset (analogous to uproot.open)
+    return VirtualFile(path)
+
+def get_histogramvalues(path, name):
+    ### get the values (including under- and overflow) and edges of a summed histogram
+    # in a virtual dataset, e.g. the nTrueInteractions profile for the pileup reweighting
+    # returns a tuple (values, edges), or (None, None) if the histogram is not present
+    # note: only the manifest is read.
+    histograms = read_manifest(path)['histograms']
+    if name not in histograms: return (None, None)
+    return (np.array(histograms[name]['values']), np.array(histograms[name]['edges']))
+
+
+class VirtualFile(object):
+    ### read-only access to a virtual dataset with an interface similar to uproot files
+    # note: the constituent files are opened only when needed and closed together.
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest = read_manifest(path)
+        self.files = {}
+        # check that the constituent files did not change since the manifest was made
+        for f in self.manifest['files']:
+            if( not os.path.exists(f['path']) or os.path.getsize(f['path'])!=f['size'] ):
+                msg = 'ERROR: file {} in virtual dataset {}'.format(f['path'], path)
+                msg += ' is missing or was modified; please remake the manifest.'
+                raise Exception(msg)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        for f in self.files.values(): f.close()
+        self.files = {}
+
+    def get_file(self, i):
+        ### get the opened constituent file with index i
+        if i not in self.files: self.files[i] = uproot.open(self.manifest['files'][i]['path'])
+        return self.files[i]
+
+    def keys(self):
+        return (list(self.manifest['trees']) + list(self.manifest['histograms'].keys())
+                + list(self.manifest['strings'].keys()))
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __getitem__(self, key):
+        if key in self.manifest['trees']: return VirtualTree(self, key)
+        if key in self.manifest['histograms']: return VirtualHistogram(self.manifest['histograms'][key])
+        if key in self.manifest['strings']: return self.manifest['strings'][key]
+        raise KeyError('ERROR: {} not found in virtual dataset {}.'.format(key, self.path))
+
+
+class VirtualHistogram(object):
+    ### summed histogram in a virtual dataset
+
+    def __init__(self, hist):
+        self.edges = np.array(hist['edges'])
+        self.valueswithflow = np.array(hist['values'])
+
+    def values(self, flow=False):
+        if flow: return self.valueswithflow
+        return self.valueswithflow[1:-1]
+
+
+class VirtualTree(object):
+    ### read-only access to a tree in a virtual dataset with an interface similar to uproot trees
+
+    def __init__(self, vfile, name):
+        self.vfile = vfile
+        self.name = name
+        self.counts = np.array([f['entries'][name] for f in vfile.manifest['files']], dtype=np.int64)
+        self.offsets = np.concatenate(([0], np.cumsum(self.counts)))
+
+    @property
+    def num_entries(self):
+        return int(self.offsets[-1])
+
+    def keys(self):
+        # (taken from the first non-empty constituent file)
+        nonempty = np.nonzero(self.counts)[0]
+        return self.vfile.get_file(nonempty[0] if len(nonempty)>0 else 0)[self.name].keys()
+
+    def __getitem__(self, name):
+        return VirtualBranch(self, name)
+
+    def read(self, name, entry_start=None, entry_stop=None):
+        ### read a branch for a range of entries, only opening the files overlapping that range
+        (entry_start, entry_stop, _) = slice(entry_start, entry_stop).indices(self.num_entries)
+        values = []
+        for i in range(len(self.counts)):
+            start = max(entry_start, self.offsets[i])
+            stop = min(entry_stop, self.offsets[i+1])
+            if stop<=start: continue
+            branch = self.vfile.get_file(i)[self.name][name]
+            values.append(branch.array(library='np', entry_start=start-self.offsets[i],
+                                       entry_stop=stop-self.offsets[i]))
+        if len(values)==0:
+            # (read an empty range to get the right type)
+            return self.vfile.get_file(0)[self.name][name].array(library='np', entry_stop=0)
+        return np.concatenate(values)
+
+
+class VirtualBranch(object):
+    ### single branch of a virtual tree with an interface similar to uproot branches
+
+    def __init__(self, tree, name):
+        self.tree = tree
+        self.name = name
+
+    def array(self, library='np', entry_start=None, entry_stop=None):
+        if library!='np': raise Exception('ERROR: only numpy arrays are supported for virtual trees.')
+        return self.tree.read(self.name, entry_start=entry_start, entry_stop=entry_stop)
+
+
+if __name__=='__main__':
+
+    # read command line arguments
+    parser = argparse.ArgumentParser( description = 'Make a virtual dataset manifest' )
+    parser.add_argument('-i', '--inputfiles', required=True, nargs='+', type=os.path.abspath)
+    parser.add_argument('-o', '--outputfile', required=True, type=os.path.abspath,
+                        help='Manifest to write (should end with {})'.format(manifestextension))
+    args = parser.parse_args()
+    if not isvirtual(args.outputfile):
+        raise Exception('ERROR: manifest name should end with {}.'.format(manifestextension))
+
+    # make the manifest
+    content = make_manifest(args.inputfiles, args.outputfile)
+    print('Written virtual dataset {} with {} files:'.format(args.outputfile, len(content['files'])))
+    for treename, nentries in content['entries'].items():
+        print('  - {}: {} entries'.format(treename, nentries))
@@ -9,7 +9,10 @@ from fnmatch import fnmatch
 sys.path.append('../tools')
 import mergetools as mt
 
-# this script will hadd all root files with appendix '_selected.root' in a folder
+# this script will merge all root files with appendix '_selected.root' in a folder
+# note: by default, the files are merged with the python merger
+#       in a parallel tree reduction (see tools/mergetools.py, treemerge);
+#       use --hadd to merge with hadd instead.
 
 if __name__=='__main__':
 
@@ -20,6 +23,17 @@ if __name__=='__main__':
     parser.add_argument('-o',   '--outputfile',     default='selected.root')
     parser.add_argument('-f',   '--force',          default=False,      action='store_true')
     parser.add_argument(        '--remove_input',   default=False,      action='store_true')
+    parser.add_argument(        '--nworkers',       default=1,          type=int,
+                                help='Number of parallel worker processes for merging')
+    parser.add_argument(        '--fanin',          default=8,          type=int,
+                                help='Number of files merged into one at each merging step')
+    parser.add_argument(        '--compression',    default=None,
+                                help='Compression of the merged files, e.g. LZ4:4 (default: ZLIB:1)')
+    parser.add_argument(        '--hadd',           default=False,      action='store_true',
+                                help='Merge with hadd instead of the python merger')
+    parser.add_argument(        '--noverify',       default=False,      action='store_true',
+                                help='Do not check the merged files against the input files'
+                                    +' (see tools/mergeverify.py)')
     args = parser.parse_args()
 
     # find all subdirectories in provided directory
@@ -60,4 +74,6 @@ if __name__=='__main__':
             os.system(  cmd)
             continue
         # now general case of multiple files
-        mt.mergefiles(inputfiles, outfile, removeinput=args.remove_input, runjob=False)
+        mt.mergefiles(inputfiles, outfile, removeinput=args.remove_input, runjob=False,
+                      nworkers=(None if args.hadd else args.nworkers), fanin=args.fanin,
+                      compression=args.compression, verify=(not args.noverify))
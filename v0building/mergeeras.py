@@ -6,7 +6,12 @@
 
 import sys
 import os
+import glob
 import argparse
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),'../tools')))
+import mergetools as mt
+import virtualtools as vt
+import mergeverify as mv
 
 
 if __name__=='__main__':
@@ -17,6 +22,20 @@ if __name__=='__main__':
     parser.add_argument('-o', '--outputfile',   default='selected.root')
     parser.add_argument('-v', '--version',      default='run2ul')
     parser.add_argument('-f', '--force',        default=False,      action='store_true')
+    parser.add_argument(      '--nworkers',     default=1,          type=int,
+                              help='Number of parallel worker processes for merging')
+    parser.add_argument(      '--fanin',        default=8,          type=int,
+                              help='Number of files merged into one at each merging step')
+    parser.add_argument(      '--compression',  default=None,
+                              help='Compression of the merged files, e.g. LZ4:4 (default: ZLIB:1)')
+    parser.add_argument(      '--hadd',         default=False,      action='store_true',
+                              help='Merge with hadd instead of the python merger')
+    parser.add_argument(      '--noverify',     default=False,      action='store_true',
+                              help='Do not check the merged files against the input files'
+                                  +' (see tools/mergeverify.py)')
+    parser.add_argument(      '--virtual',      default=False,      action='store_true',
+                              help='Do not copy the files, but write a virtual dataset manifest'
+                                  +' listing them (see tools/virtualtools.py)')
     args = parser.parse_args()
 
     # Define years to be merged together. --> Hardcoded for now, should be improved
@@ -238,11 +257,31 @@ if __name__=='__main__':
         yeardir = os.path.join(args.filedir, yeardir)
         # make output directory
         if not os.path.exists(yeardir): os.makedirs(yeardir)
-        # make hadd command
-        cmd = 'hadd'
-        if args.force: cmd += ' -f'
-        cmd += ' {}'.format(os.path.join(yeardir, args.outputfile))
+        # find input files
+        outputfile = os.path.join(yeardir, args.outputfile)
+        inputfiles = []
         for eradir in eradirs:
-            cmd += ' {}*/*.root'.format(os.path.join(args.filedir, eradir))
-        # run hadd command
-        os.system(cmd)
+            inputfiles += sorted(glob.glob('{}*/*.root'.format(os.path.join(args.filedir, eradir))))
+        print('Now merging {} files into {}'.format(len(inputfiles), outputfile))
+        if len(inputfiles)==0:
+            print('WARNING: no input files found, skipping this merge.')
+            continue
+        if args.virtual: outputfile = vt.get_manifestname(outputfile)
+        if os.path.exists(outputfile):
+            if not args.force:
+                print('WARNING: output file {} already exists, skipping this merge.'.format(outputfile))
+                continue
+            os.remove(outputfile)
+        # write a virtual dataset manifest if requested
+        # (the analysis steps read it in place of the merged file)
+        if args.virtual:
+            vt.make_manifest(inputfiles, outputfile)
+            continue
+        # merge the files
+        # (using the python merger in a parallel tree reduction, see tools/mergetools.py)
+        if args.hadd:
+            os.system('hadd {} {}'.format(outputfile, ' '.join(inputfiles)))
+        else:
+            mt.treemerge(inputfiles, outputfile, nworkers=args.nworkers, fanin=args.fanin,
+                         compression=args.compression)
+        if not args.noverify: mv.check_merge(inputfiles, outputfile, nworkers=args.nworkers)
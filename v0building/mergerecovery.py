@@ -4,8 +4,12 @@
 
 import os
 import sys
+import glob
 import argparse
 from six.moves import input
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),'../tools')))
+import mergeverify as mv
+import dedupmerge as dm
 
 
 if __name__=='__main__':
@@ -17,6 +21,14 @@ if __name__=='__main__':
     parser.add_argument('-f', '--force', default=False, action='store_true')
     parser.add_argument('--recoverytag', default=None)
     parser.add_argument('--remove_input', default=False, action='store_true')
+    parser.add_argument('--nworkers', default=1, type=int,
+                        help='Number of parallel processes for verifying the merged files')
+    parser.add_argument('--noverify', default=False, action='store_true',
+                        help='Do not check the merged files against the input files'
+                            +' (see tools/mergeverify.py)')
+    parser.add_argument('--deduplicate', default=False, action='store_true',
+                        help='Remove events present in both the original and recovery files'
+                            +' (see tools/dedupmerge.py)')
     args = parser.parse_args()
 
     if args.recoverytag is not None:
@@ -41,12 +53,29 @@ if __name__=='__main__':
         if go!='y': sys.exit()
         for origdir, val in mergedict.items():
             outputfile = os.path.join(origdir, args.outputfile)
-            cmd = 'hadd'
-            if args.force: cmd += ' -f'
-            cmd += ' {}'.format(outputfile)
-            for el in val: cmd += ' {}/*.root'.format(el)
-            print(cmd)
-            os.system(cmd)
+            inputfiles = []
+            for el in val: inputfiles += sorted(glob.glob('{}/*.root'.format(el)))
+            inputfiles = [f for f in inputfiles if f!=outputfile]
+            removed = None
+            duplicatesfile = os.path.splitext(outputfile)[0]+'_duplicates.txt'
+            if args.deduplicate:
+                # (original files first, so that their copy of duplicate events is kept)
+                if( os.path.exists(outputfile) and not args.force ):
+                    msg = 'WARNING: output file {} already exists;'.format(outputfile)
+                    msg += ' use -f to overwrite; skipping this directory.'
+                    print(msg)
+                    continue
+                removed = dm.dedupmerge(inputfiles, outputfile, duplicatesfile=duplicatesfile)
+            else:
+                cmd = 'hadd'
+                if args.force: cmd += ' -f'
+                cmd += ' {}'.format(outputfile)
+                cmd += ' {}'.format(' '.join(inputfiles))
+                print(cmd)
+                os.system(cmd)
+            # check the merged file before removing the input files
+            if not args.noverify:
+                mv.check_merge(inputfiles, outputfile, nworkers=args.nworkers, removed=removed)
             if args.remove_input:
                 for el in val:
                     if el==origdir: continue
@@ -55,7 +84,7 @@ if __name__=='__main__':
                     os.system(cmd)
                 for f in os.listdir(origdir):
                     f = os.path.join(origdir, f)
-                    if f==outputfile: continue
+                    if f in [outputfile, duplicatesfile]: continue
                     cmd = 'rm {}'.format(f)
                     print(cmd)
                     os.system(cmd)
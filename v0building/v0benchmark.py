@@ -0,0 +1,214 @@
+#########################################################
+# python script to benchmark the throughput of v0builder #
+#########################################################
+# runs the V0 building (see v0builder.py) on a fixed set of input files
+# and reports for each file the number of processed events and candidates per second,
+# the time spent in each phase (reading branches, auxiliary variables, selection,
+# flattening into output trees, and writing each output tree) and the peak memory usage.
+# the results are stored in a json file, so that they can be compared between code versions
+# (use --compare to print the relative change with respect to a previous result).
+# note: each file is processed in a separate process, so that the peak memory usage
+#       is measured per file and does not include the memory of previous files.
+
+# usage examples:
+# - benchmark on synthetic ntuples (generated once and reused, see tools/syntheticntuple.py):
+#   python3 v0benchmark.py --synthetic 200000 -o benchmark.json
+# - benchmark on reference files and compare with a previous result:
+#   python3 v0benchmark.py -i <file(s)> -o benchmark_new.json --compare benchmark.json
+
+
+# import external modules
+import sys
+import os
+import json
+import time
+import socket
+import argparse
+import resource
+import platform
+import contextlib
+import subprocess
+import multiprocessing
+# import framework modules
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),'../tools')))
+import syntheticntuple as sn
+from v0builder import build_file, get_builderversion
+
+
+def get_synthetic_inputs(workdir, nevents):
+  ### get a fixed set of synthetic input files (one simulation and one data file),
+  # generating them if they do not exist yet
+  inputfiles                = []
+  for (tag, isdata, seed) in [('sim', False, 1), ('data', True, 2)]:
+    inputfile               = os.path.join(workdir, 'synthetic_{}_{}_seed{}.root'.format(tag, nevents, seed))
+    if not os.path.exists(inputfile):
+      print('Generating synthetic input file {}...'.format(inputfile))
+      with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        sn.write_ntuple(inputfile, nevents, isdata=isdata, seed=seed)
+    inputfiles.append(inputfile)
+  return inputfiles
+
+def get_commit():
+  ### get the current git commit (if available)
+  try:
+    cmd                     = ['git', 'rev-parse', '--short', 'HEAD']
+    return subprocess.check_output(cmd, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                   stderr=subprocess.DEVNULL).decode().strip()
+  except (OSError, subprocess.CalledProcessError): return None
+
+def benchmark_file(job):
+  ### run the V0 building on a single file and collect the benchmark results
+  # input arguments:
+  # - job: tuple of the form (input file, output file, dict of arguments for build_file)
+  # note: meant to be run in a fresh process (see run_benchmark).
+  (inputfile, outputfile, kwargs) = job
+  starttime                 = time.time()
+  with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+    stats                   = build_file(inputfile, outputfile, **kwargs)
+  totaltime                 = time.time() - starttime
+  # peak resident memory (ru_maxrss is in kB on linux and in bytes on mac)
+  peakrss                   = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  if sys.platform=='darwin': peakrss /= 1024.
+  result                    = {
+                                'inputfile':            inputfile,
+                                'inputsize_mb':         os.path.getsize(inputfile)/1e6,
+                                'outputsize_mb':        os.path.getsize(outputfile)/1e6,
+                                'nevents':              stats['nevents'],
+                                'ncandidates':          stats['ncandidates'],
+                                'nselected':            stats['nselected'],
+                                'timings':              stats['timings'],
+                                'total':                totaltime,
+                                'eventspersecond':      stats['nevents']/totaltime,
+                                'candidatespersecond':  stats['ncandidates']/totaltime,
+                                'peakrss_mb':           peakrss/1024.
+                            }
+  os.remove(outputfile)
+  return result
+
+def run_benchmark(inputfiles, workdir, repeat=1, **kwargs):
+  ### run the benchmark on a list of input files
+  # input arguments:
+  # - inputfiles: list of input files
+  # - workdir: directory for the (temporary) output files
+  # - repeat: number of times to process each file (the fastest run is kept)
+  # - kwargs: passed down to build_file
+  # returns a list of per-file results (see benchmark_file)
+  results                   = []
+  for inputfile in inputfiles:
+    outputfile              = os.path.join(workdir,
+                                os.path.basename(inputfile).replace('.root','_benchmark.root'))
+    best                    = None
+    for i in range(repeat):
+      # use a fresh process for each run (for the memory measurement)
+      with multiprocessing.Pool(processes=1, maxtasksperchild=1) as pool:
+        result              = pool.apply(benchmark_file, ((inputfile, outputfile, kwargs),))
+      if( best is None or result['total']<best['total'] ): best = result
+    print_result(best)
+    results.append(best)
+  return results
+
+def get_summary(results):
+  ### sum the results over all files
+  summary                   = {'nevents': 0, 'ncandidates': 0, 'nselected': 0, 'total': 0., 'timings': {}}
+  for result in results:
+    for key in ['nevents', 'ncandidates', 'nselected', 'total']: summary[key] += result[key]
+    for phase, t in result['timings'].items():
+      summary['timings'][phase] = summary['timings'].get(phase, 0.) + t
+  summary['eventspersecond'] = summary['nevents']/summary['total']
+  summary['candidatespersecond'] = summary['ncandidates']/summary['total']
+  summary['peakrss_mb']     = max([result['peakrss_mb'] for result in results])
+  return summary
+
+def print_result(result, label=None):
+  ### print the benchmark result of a file (or the summary)
+  if label is None: label   = result['inputfile']
+  print('{}:'.format(label))
+  msg                       = '  {} events, {} candidates'.format(result['nevents'], result['ncandidates'])
+  msg                       += ' in {:.2f} s'.format(result['total'])
+  msg                       += ' ({:.0f} events/s, {:.0f} candidates/s),'.format(
+                                result['eventspersecond'], result['candidatespersecond'])
+  msg                       += ' peak memory {:.0f} MB'.format(result['peakrss_mb'])
+  print(                    msg)
+  for phase, t in result['timings'].items():
+    print('    - {:<18} {:8.3f} s ({:5.1f}%)'.format(phase, t, 100.*t/result['total']))
+
+def compare_results(summary, refsummary):
+  ### print the relative change of the summary with respect to a reference summary
+  def change(new, old):
+    if old==0: return '   n/a'
+    return '{:+6.1f}%'.format(100.*(new-old)/old)
+  print('Comparison with reference:')
+  for key in ['eventspersecond', 'candidatespersecond', 'total', 'peakrss_mb']:
+    print('  {:<20} {:12.2f} -> {:12.2f} ({})'.format(key, refsummary[key], summary[key],
+                                                     change(summary[key], refsummary[key])))
+  for phase, t in summary['timings'].items():
+    reft                    = refsummary['timings'].get(phase, 0.)
+    print('    - {:<18} {:8.3f} -> {:8.3f} s ({})'.format(phase, reft, t, change(t, reft)))
+
+
+if __name__=='__main__':
+
+  # read command line arguments
+  parser = argparse.ArgumentParser( description = 'Benchmark the V0 building' )
+  parser.add_argument('-i', '--inputfiles', default=None,       type=os.path.abspath, nargs='+',
+                            help='Input files to benchmark on')
+  parser.add_argument(      '--synthetic',  default=0,          type=int,
+                            help='Benchmark on synthetic input files with this number of events'
+                                +' (generated in the working directory if needed)')
+  parser.add_argument('-o', '--outputfile', default=None,       type=os.path.abspath,
+                            help='Json file to write the results to')
+  parser.add_argument('-w', '--workdir',    default='benchmark', type=os.path.abspath,
+                            help='Working directory for synthetic inputs and temporary outputs')
+  parser.add_argument(      '--compare',    default=None,       type=os.path.abspath,
+                            help='Json file with previous results to compare to')
+  parser.add_argument(      '--repeat',     default=1,          type=int,
+                            help='Number of runs per file (the fastest one is kept)')
+  parser.add_argument('-s', '--selection',  default='legacy')
+  parser.add_argument(      '--chunksize',  default=-1,         type=int)
+  parser.add_argument(      '--loose',      default=False,      action='store_true')
+  parser.add_argument(      '--normalized', default=False,      action='store_true')
+  parser.add_argument(      '--compression', default=None,      nargs='+')
+  parser.add_argument(      '--basketsize', default=None,       nargs='+')
+  args = parser.parse_args()
+
+  # define input files
+  if not os.path.exists(args.workdir): os.makedirs(args.workdir)
+  inputfiles                = []
+  if args.inputfiles is not None: inputfiles += args.inputfiles
+  if args.synthetic>0: inputfiles += get_synthetic_inputs(args.workdir, args.synthetic)
+  if len(inputfiles)==0:
+    raise Exception('ERROR: no input files; use --inputfiles and/or --synthetic.')
+
+  # run the benchmark
+  settings                  = {
+                                'selection_name':   args.selection,
+                                'chunksize':        args.chunksize,
+                                'loose':            args.loose,
+                                'normalized':       args.normalized,
+                                'compression':      args.compression,
+                                'basketsize':       args.basketsize
+                            }
+  results                   = run_benchmark(inputfiles, args.workdir, repeat=args.repeat, **settings)
+  summary                   = get_summary(results)
+  print_result(summary, label='Total')
+
+  # write results
+  if args.outputfile is not None:
+    output                  = {
+                                'commit':           get_commit(),
+                                'version':          get_builderversion(),
+                                'date':             time.strftime('%Y-%m-%d %H:%M:%S'),
+                                'host':             socket.gethostname(),
+                                'python':           platform.python_version(),
+                                'settings':         settings,
+                                'files':            results,
+                                'summary':          summary
+                            }
+    with open(args.outputfile, 'w') as f: json.dump(output, f, indent=2)
+    print('Results written to {}'.format(args.outputfile))
+
+  # compare to previous results
+  if args.compare is not None:
+    with open(args.compare, 'r') as f: reference = json.load(f)
+    compare_results(summary, reference['summary'])
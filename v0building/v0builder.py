@@ -10,116 +10,426 @@
 # import external modules
 import sys
 import os
+import time
 import argparse
+import functools
+import multiprocessing
 import numpy as np
 import uproot
 import awkward as ak
-import vector
 # import framework modules
-from v0selections import cospointing
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),'../tools')))
+import mergetools as mt
+import eventindextools as eit
+import transfertools as tt
+import manifesttools as mft
+import lumimasktools as lmt
+import v0selections
+from v0selections import cospointing_branches
 from v0selections import selection
+from v0selections import selection_branches
+from v0selections import preselection
+from v0selections import cutbits
+from v0selections import get_selection
+from v0selections import load_selections
 
 
-if __name__=='__main__':
+# per-event variables to copy to nimloth
+nimlothvars                 = [
+                                '_nimloth_Mll',
+                                '_nimloth_nJets',
+                                '_beamSpotX',
+                                '_beamSpotY',
+                                '_beamSpotZ',
+                                '_primaryVertexX',
+                                '_primaryVertexY',
+                                '_primaryVertexZ',
+                                '_runNb',
+                                '_lumiBlock',
+                                '_eventNb'
+                            ]
 
-  # write starting tag (for automatic crash checking)
-  sys.stderr.write('###starting###\n')
+# per-lepton variables to copy to celeborn
+celebornvars                = [
+                                '_celeborn_lPt',
+                                '_celeborn_lEta',
+                                '_celeborn_lPhi',
+                                '_celeborn_lCharge'
+                            ]
 
-  # read command line arguments
-  parser = argparse.ArgumentParser( description = 'Perform V0 candidate selection' )
-  parser.add_argument('-i', '--inputfile',  required=True,      type=os.path.abspath)
-  parser.add_argument('-o', '--outputfile', required=True,      type=os.path.abspath)
-  parser.add_argument('-s', '--selection',  default='legacy')
-  parser.add_argument('-n', '--nevents',    default=-1,         type=int)
-  parser.add_argument(      '--transfer',   default=False,      action='store_true')
-  args = parser.parse_args()
+# per-event variables only available in simulation
+simvars                     = ['_weight', '_nTrueInt']
 
-  # check selection_name
-  allowed_selections        = [
-                                'legacy',
+# output columns of the per-V0 trees (laurelin and telperion)
+# each entry is of the form (output name, source, level), where:
+# - source is either the name of an input branch or of a derived variable (see derivedvars),
+# - level is 'candidate' for per-V0 quantities or 'event' for per-event quantities
+#   (the latter are copied to each selected V0 in the event).
+# note: per-event simulation variables (see simvars) are skipped for data.
+v0columns                   = [
+                                ('_mass',           '_V0InvMass',       'candidate'),
+                                ('_vertexX',        '_V0X',             'candidate'),
+                                ('_vertexY',        '_V0Y',             'candidate'),
+                                ('_vertexZ',        '_V0Z',             'candidate'),
+                                ('_RPV',            '_V0RPV',           'candidate'),
+                                ('_RBS',            '_V0RBS',           'candidate'),
+                                ('_RPVSig',         '_V0RPVSig',        'candidate'),
+                                ('_RBSSig',         '_V0RBSSig',        'candidate'),
+                                ('_pt',             '_V0Pt',            'candidate'),
+                                ('_ptSum',          'ptSum',            'candidate'),
+                                ('_eta',            '_V0Eta',           'candidate'),
+                                ('_phi',            '_V0Phi',           'candidate'),
+                                ('_nHitsPos',       '_V0NHitsPos',      'candidate'),
+                                ('_nHitsNeg',       '_V0NHitsNeg',      'candidate'),
+                                ('_ptPos',          '_V0PtPos',         'candidate'),
+                                ('_ptNeg',          '_V0PtNeg',         'candidate'),
+                                ('_normChi2Pos',    '_V0NormChi2Pos',   'candidate'),
+                                ('_normChi2Neg',    '_V0NormChi2Neg',   'candidate'),
+                                ('_trackdR',        'trackdR',          'candidate'),
+                                ('_runNb',          '_runNb',           'event'),
+                                ('_lumiBlock',      '_lumiBlock',       'event'),
+                                ('_eventNb',        '_eventNb',         'event'),
+                                ('_weight',         '_weight',          'event'),
+                                ('_nTrueInt',       '_nTrueInt',        'event'),
                             ]
-  if args.selection not in allowed_selections:
-    raise Exception('ERROR: selection '+args.selection+' not recognized.')
-
-  # handle case of transfering input file (instead of reading it directly)
-  if args.transfer:
-    # set temporary directory where to transfer to
-    tmpdir                  = '/tmp'
-    if 'TMPDIR' in os.environ: tmpdir = os.environ['TMPDIR']
-    # set new input file name
-    tmpfile                 = args.inputfile.strip('/').replace('/','_')
-    tmpfile                 = os.path.join(tmpdir, tmpfile)
-    # do the transfer
-    cmd                     = 'cp {} {}'.format(args.inputfile, tmpfile)
-    print('Transfering input file to {}...'.format(tmpdir))
-    print(                  cmd)
-    os.system(              cmd)
-    print('Done transfering input file.')
-    args.inputfile          = tmpfile
-    # set new output file name
-    origoutputfile          = args.outputfile
-    args.outputfile         = tmpfile.replace('.root','_out.root')
-
-  # open input file
-  with uproot.open(args.inputfile) as f:
-    fkeys                   = [key.split(';')[0] for key in f.keys()]
-    tree                    = f["blackJackAndHookers"]["blackJackAndHookersTree"]
-    nVertices               = f["blackJackAndHookers"]["nVertices"]
 
-    # read counter histograms
-    isdata                  = False
-    hcounterkey             = "blackJackAndHookers/hCounter"
-    ntrueintkey             = "blackJackAndHookers/nTrueInteractions"
-    if( hcounterkey not in fkeys or ntrueintkey not in fkeys ):
-        print('No valid hCounter or nTrueInt found in this file, assuming this is data...')
-        isdata              = True
-    else:
-        hcounter            = f[hcounterkey]
-        ntrueint            = f[ntrueintkey]
-    
-    # define branches to read from input file
-    branchnames             = [
-                                '_runNb', 
-                                '_lumiBlock', 
-                                '_eventNb',
-                                '_nimloth_Mll', 
-                                '_nimloth_nJets',
-                                '_beamSpotX', 
-                                '_beamSpotY', 
-                                '_beamSpotZ',
-                                '_primaryVertexX', 
-                                '_primaryVertexY', 
-                                '_primaryVertexZ',
-                                '_celeborn_lPt', 
-                                '_celeborn_lEta', 
-                                '_celeborn_lPhi', 
-                                '_celeborn_lCharge'
+# additional output columns of the per-V0 trees in loose build mode
+# (needed to re-apply tightened versions of the cuts afterwards, see v0reselect.py)
+loosev0columns              = [
+                                ('_dca',            '_V0DCA',           'candidate'),
+                                ('_vtxNormChi2',    '_V0VtxNormChi2',   'candidate'),
+                                ('_cospointingPV',  'cospointingPV',    'candidate'),
+                                ('_cospointingBS',  'cospointingBS',    'candidate'),
+                                ('_selectionBits',  'selectionBits',    'candidate'),
                             ]
-    if not isdata:          branchnames += ['_weight', '_nTrueInt']
-    for b in tree.keys():
-        if b.startswith('_V0'): branchnames.append(b)
 
-    # read the data
-    entry_stop              = None
-    if( args.nevents>0 and args.nevents<tree.num_entries ): entry_stop = args.nevents
-    msg                     = 'Tree is found to have {} entries'.format(tree.num_entries)
-    msg                     += ' of which {} will be read'.format(entry_stop if entry_stop is not None 
-                                                                    else tree.num_entries)
-    print(                  msg)
-    print('Reading branches')
-    sys.stdout.flush()
-    sys.stderr.flush()
-    branches                = tree.arrays(branchnames, entry_stop=entry_stop)
+# derived per-V0 variables (calculated in build_chunk) and the input branches they need
+derivedvars                 = {
+                                'cospointingPV':    cospointing_branches(reference='primaryVertex'),
+                                'cospointingBS':    cospointing_branches(reference='beamSpot'),
+                                'ptSum':            ['_V0PtPos', '_V0PtNeg'],
+                                'trackdR':          ['_V0PtPos', '_V0EtaPos', '_V0PhiPos',
+                                                     '_V0PtNeg', '_V0EtaNeg', '_V0PhiNeg'],
+                                'selectionBits':    [],
+                            }
+
+# branch names that differ in the old naming convention
+oldv0branchnames            = {
+                                '_V0RPVSig':        '_V0RSigPV',
+                                '_V0RBSSig':        '_V0RSigBS',
+                            }
+
+# names of the output trees
+# (in case of multiple selections, the per-V0 trees get the selection name as suffix,
+#  see get_v0treenames)
+outtreenames                = ['nimloth', 'celeborn', 'laurelin', 'telperion']
+
+# available compression algorithms for the output file and their default levels
+compressioncodecs           = {
+                                'ZLIB':             (uproot.ZLIB,   1),
+                                'LZ4':              (uproot.LZ4,    4),
+                                'ZSTD':             (uproot.ZSTD,   5),
+                                'LZMA':             (uproot.LZMA,   8),
+                            }
+
+def get_v0columns(loose=False):
+  ### get the output columns of the per-V0 trees
+  if loose: return v0columns + loosev0columns
+  return v0columns
+
+def get_v0branchnames(vnametype='new', loose=False):
+  ### get the names of the V0 branches needed to fill laurelin and telperion
+  v0branchnames             = ['_V0Type']
+  for (_, source, level) in get_v0columns(loose=loose):
+    if( level=='candidate' and source not in derivedvars.keys() ): v0branchnames.append(source)
+  for inputs in derivedvars.values(): v0branchnames += inputs
+  if vnametype=='old':
+    v0branchnames           = [oldv0branchnames.get(b, b) for b in v0branchnames]
+  return v0branchnames
+
+def gather_columns(branches, derived, mask, isdata, columns=v0columns, normalized=False):
+  ### fill the output columns of a per-V0 tree for the candidates passing a mask
+  # input arguments:
+  # - branches: awkward array with the branches read from the input tree
+  # - derived: dict with derived per-V0 variables (jagged, same structure as the V0 branches)
+  # - mask: jagged boolean mask selecting the candidates to write
+  # - isdata: whether the input is data (simulation-only variables are skipped)
+  # - columns: output column definitions (see v0columns)
+  # - normalized: skip per-event columns (see build_chunk)
+  # note: the mapping from selected candidates to positions in the flat V0 arrays
+  #       and to their parent events is computed only once and shared by all columns.
+  counts                    = ak.to_numpy(ak.num(mask, axis=1))
+  candidx                   = np.flatnonzero(ak.to_numpy(ak.flatten(mask)))
+  eventidx                  = np.repeat(np.arange(len(counts)), counts)[candidx]
+  output                    = {}
+  for (name, source, level) in columns:
+    if( isdata and source in simvars ): continue
+    if( normalized and level=='event' ): continue
+    values                  = derived[source] if source in derived.keys() else branches[source]
+    if level=='candidate':  output[name] = ak.to_numpy(ak.flatten(values))[candidx]
+    elif level=='event':    output[name] = ak.to_numpy(values)[eventidx]
+  return output
+
+def get_selectionlist(selection_name):
+  ### convert a selection name or list of selection names into a list
+  if isinstance(selection_name, str): return [selection_name]
+  return list(selection_name)
+
+def get_v0treenames(selection_name):
+  ### get the names of the per-V0 trees for one or more selections
+  # returns a dict matching selection names to tuples of the form (K0s tree, Lambda tree);
+  # in case of a single selection, the trees are named laurelin and telperion,
+  # else laurelin_<selection name> and telperion_<selection name>.
+  selection_names           = get_selectionlist(selection_name)
+  if len(selection_names)==1: return {selection_names[0]: ('laurelin', 'telperion')}
+  return {name: ('laurelin_{}'.format(name), 'telperion_{}'.format(name)) for name in selection_names}
+
+def get_branchnames(tree, isdata, selection_name, vnametype='new', loose=False):
+  ### get the names of the branches to read from the input tree
+  # note: only the branches that are needed for the selection and the output trees are read,
+  #       the other V0 branches in the input tree are never decompressed.
+  branchnames               = nimlothvars + celebornvars
+  if not isdata:            branchnames = branchnames + simvars
+  branchnames               = branchnames + get_v0branchnames(vnametype=vnametype, loose=loose)
+  for name in get_selectionlist(selection_name):
+    branchnames             = branchnames + selection_branches(name, derivednames=derivedvars.keys())
+  # the normalized chi2 branches are not present in the old naming convention
+  # (they are set to zero in build_chunk instead)
+  if vnametype=='old':
+    branchnames             = [b for b in branchnames if b not in ['_V0NormChi2Pos', '_V0NormChi2Neg']]
+  # remove duplicates while keeping the order
+  branchnames               = list(dict.fromkeys(branchnames))
+  # check that all branches are present
+  missing                   = [b for b in branchnames if b not in tree.keys()]
+  if len(missing)>0:
+    msg                     = 'ERROR: following required branches are not present'
+    msg                     += ' in the input tree: {}'.format(missing)
+    raise Exception(msg)
+  return branchnames
+
+def get_entry_ranges(nentries, chunksize=-1):
+  ### split the entries to read in consecutive (start, stop) ranges
+  # note: if chunksize is not positive, all entries are read in one go;
+  #       at least one (possibly empty) range is always returned,
+  #       so that the output trees are created even for empty input trees.
+  if( chunksize<=0 or nentries<=chunksize ): return [(0, nentries)]
+  return [(start, min(start+chunksize, nentries)) for start in range(0, nentries, chunksize)]
+
+def parse_treesettings(specs, parsevalue):
+  ### parse per-tree settings of the form '[<tree name>:]<value>'
+  # input arguments:
+  # - specs: list of strings, settings without tree name apply to all output trees
+  # - parsevalue: function converting the value part of a setting
+  # returns a dict matching output tree names and 'default' to parsed values
+  settings                  = {}
+  if specs is None: return settings
+  for spec in specs:
+    (treename, value)       = ('default', spec)
+    if spec.split(':')[0] in outtreenames: (treename, value) = spec.split(':', 1)
+    settings[treename]      = parsevalue(value)
+  return settings
+
+def get_treesetting(settings, treename, default=None):
+  ### get the setting for a tree from a dict returned by parse_treesettings
+  # note: per-V0 trees for a specific selection (e.g. laurelin_<selection>)
+  #       take the setting of the corresponding base tree (e.g. laurelin).
+  basename                  = treename.split('_')[0]
+  return settings.get(treename, settings.get(basename, settings.get('default', default)))
+
+def parse_compression(value):
+  ### parse a compression setting of the form '<algorithm>[:<level>]', e.g. 'LZ4:4'
+  parts                     = value.split(':')
+  if( len(parts)>2 or parts[0].upper() not in compressioncodecs.keys() ):
+    msg                     = 'ERROR: compression setting {} not recognized;'.format(value)
+    msg                     += ' expected format is <algorithm>[:<level>]'
+    msg                     += ' with algorithm one of {}.'.format(list(compressioncodecs.keys()))
+    raise Exception(msg)
+  (codec, level)            = compressioncodecs[parts[0].upper()]
+  if len(parts)==2: level   = int(parts[1])
+  return codec(level)
+
+class TreeWriter(object):
+  ### write output trees to a file with per-tree compression and basket sizes
+  # note: uproot writes one basket per branch for each call to extend,
+  #       so fixed basket sizes are obtained by buffering the entries of consecutive chunks.
+
+  def __init__(self, fout, compression=None, basketsize=None):
+    ### initializer
+    # input arguments:
+    # - fout: output file opened with uproot
+    # - compression: list of per-tree compression settings (see parse_treesettings),
+    #   e.g. ['LZ4:4', 'laurelin:ZSTD:5'] (default: compression of the output file)
+    # - basketsize: list of per-tree basket sizes in number of entries (see parse_treesettings),
+    #   e.g. ['100000', 'nimloth:500000'] (default: one basket per chunk)
+    self.fout               = fout
+    self.compression        = parse_treesettings(compression, parse_compression)
+    self.basketsize         = parse_treesettings(basketsize, int)
+    self.buffers            = {}
+    self.writetime          = {}
+
+  def get_basketsize(self, treename):
+    return get_treesetting(self.basketsize, treename, default=-1)
+
+  def _write(self, treename, branches):
+    ### write a basket to a tree, creating the tree if needed
+    starttime               = time.time()
+    if treename not in self.writetime.keys():
+      defaultcompression    = self.fout.compression
+      compression           = get_treesetting(self.compression, treename)
+      if compression is not None: self.fout.compression = compression
+      self.fout[treename]   = branches
+      self.fout.compression = defaultcompression
+      self.writetime[treename] = 0.
+    else: self.fout[treename].extend(branches)
+    self.writetime[treename] += time.time() - starttime
+
+  def write(self, treename, branches):
+    ### add a chunk of entries to a tree
+    basketsize              = self.get_basketsize(treename)
+    if basketsize<=0:
+      self._write(treename, branches)
+      return
+    # add entries to the buffer and write as many full baskets as possible
+    branches                = {name: ak.to_numpy(values) for name, values in branches.items()}
+    if treename in self.buffers.keys():
+      buffer                = self.buffers[treename]
+      branches              = {name: np.concatenate((buffer[name], values)) for name, values in branches.items()}
+    nentries                = len(next(iter(branches.values())))
+    nwritten                = 0
+    while nentries-nwritten>=basketsize:
+      self._write(treename, {name: values[nwritten:nwritten+basketsize] for name, values in branches.items()})
+      nwritten              += basketsize
+    self.buffers[treename]  = {name: values[nwritten:] for name, values in branches.items()}
+
+  def close(self):
+    ### write the remaining buffered entries
+    # note: trees for which no basket was written yet are created here (possibly empty).
+    for treename, buffer in self.buffers.items():
+      nentries              = len(next(iter(buffer.values())))
+      if( nentries>0 or treename not in self.writetime.keys() ): self._write(treename, buffer)
+    self.buffers            = {}
+
+def get_treesizes(filename, treenames):
+  ### get the number of entries, compressed and uncompressed size (in bytes) of trees in a file
+  # note: for RNTuples (written by uproot when assigning arrays to a file, see TreeWriter),
+  #       the sizes are the sums over the pages of all columns (without the header and footer).
+  sizes                     = {}
+  with uproot.open(filename) as f:
+    for treename in treenames:
+      tree                  = f[treename]
+      if hasattr(tree, 'compressed_bytes'):
+        sizes[treename]     = (tree.num_entries, tree.compressed_bytes, tree.uncompressed_bytes)
+      elif hasattr(tree, 'page_link_list'):
+        (compressed, uncompressed) = (0, 0)
+        for cluster in tree.page_link_list:
+          for column, columnpages in zip(tree.column_records, cluster):
+            for page in columnpages.pages:
+              compressed    += page.locator.num_bytes
+              uncompressed  += page.num_elements*column.nbits//8
+        sizes[treename]     = (tree.num_entries, compressed, uncompressed)
+  return sizes
+
+def derived_variables(branches, derived=None):
+  ### calculate the derived per-V0 variables (see derivedvars) in one go
+  # input arguments:
+  # - branches: awkward array with the branches read from the input tree
+  # - derived: dict with branches that replace the ones in branches (e.g. old naming convention)
+  # returns a dict of jagged arrays with the same structure as the V0 branches
+  # note: the calculation is done on the flat content of the V0 branches
+  #       (with the per-event reference points repeated once per candidate),
+  #       so that no jagged temporaries are created and shared intermediate results
+  #       (e.g. the transverse momentum of the V0) are computed only once;
+  #       the results are identical to cospointing in v0selections.py
+  #       and to the deltaR between massless track four-vectors.
+  if derived is None: derived = {}
+  counts                    = ak.num(branches['_V0X'], axis=1)
+  ncands                    = ak.to_numpy(counts)
+  def flat(name):
+    values                  = derived[name] if name in derived.keys() else branches[name]
+    return ak.to_numpy(ak.flatten(values))
+  def perv0(name):
+    values                  = derived[name] if name in derived.keys() else branches[name]
+    return np.repeat(ak.to_numpy(values), ncands)
+
+  # pointing angle wrt primary vertex and beam spot
+  # (intermediate results are overwritten in place to limit the number of temporaries)
+  vx                        = flat('_V0X')
+  vy                        = flat('_V0Y')
+  px                        = flat('_V0Px')
+  py                        = flat('_V0Py')
+  pnorm                     = np.square(px)
+  pnorm                    += np.square(py)
+  np.sqrt(pnorm, out=pnorm)
+  cospointing               = {}
+  for reference in ['primaryVertex', 'beamSpot']:
+    x                       = vx - perv0('_{}X'.format(reference))
+    y                       = vy - perv0('_{}Y'.format(reference))
+    cosine                  = x*px
+    cosine                 += y*py
+    np.square(x, out=x)
+    x                      += np.square(y, out=y)
+    np.sqrt(x, out=x)
+    x                      *= pnorm
+    cosine                 /= x
+    cospointing[reference]  = cosine
+    del x, y
+
+  # sum of track pt
+  ptsum                     = flat('_V0PtPos') + flat('_V0PtNeg')
+
+  # deltaR between tracks
+  # (with the azimuthal difference wrapped to [-pi, pi))
+  dphi                      = flat('_V0PhiPos') - flat('_V0PhiNeg')
+  dphi                     += np.pi
+  np.remainder(dphi, 2*np.pi, out=dphi)
+  dphi                     -= np.pi
+  np.square(dphi, out=dphi)
+  deta                      = flat('_V0EtaPos') - flat('_V0EtaNeg')
+  dphi                     += np.square(deta, out=deta)
+  trackdr                   = np.sqrt(dphi, out=dphi)
+  del deta
+
+  # restore the jagged structure (without copying the flat arrays)
+  derivedvalues             = {
+                                'cospointingPV':    cospointing['primaryVertex'],
+                                'cospointingBS':    cospointing['beamSpot'],
+                                'ptSum':            ptsum,
+                                'trackdR':          trackdr,
+                            }
+  return {name: ak.unflatten(values, counts) for name, values in derivedvalues.items()}
+
+def add_time(timings, phase, starttime):
+  ### add the time elapsed since starttime to a phase in a timings dict (if provided)
+  # returns the current time, to be used as start time for the next phase
+  now                       = time.time()
+  if timings is not None: timings[phase] = timings.get(phase, 0.) + now - starttime
+  return now
+
+def build_chunk(branches, selection_name, isdata, vnametype='new', loose=False, normalized=False,
+                timings=None):
+  ### make the output trees for a chunk of events
+  # input arguments:
+  # - branches: awkward array with the branches read from the input tree
+  # - selection_name: name of the V0 selection to apply, or list of names
+  #   (each selection is evaluated on the same arrays and written to its own per-V0 trees,
+  #    see get_v0treenames)
+  # - isdata: whether the input is data (no weights and pileup info) or simulation
+  # - vnametype: switch between older and newer variable naming conventions
+  # - loose: keep all candidates passing the preselection instead of the selection,
+  #          and store the outcome of each individual cut as a bitmask
+  # - normalized: do not copy the per-event variables to the per-lepton and per-V0 trees,
+  #               but store the number of entries in each of these trees per event in nimloth
+  #               (see tools/eventindextools.py for reading them back)
+  # - timings: dict to which the time spent in each phase is added (for benchmarking)
+  # returns a tuple of the form (dict of output trees, dict matching selection names to cutflow dicts)
+  starttime                 = time.time()
+  selection_names           = get_selectionlist(selection_name)
 
   # switch between older and newer variable naming conventions
-  #vnametype = 'old'
-  vnametype                 = 'new'
-  if vnametype=='new':
-    rpvsigkey               = 'RPVSig'
-    rbssigkey               = 'RBSSig'
-  elif vnametype=='old':
-    rpvsigkey               = 'RSigPV'
-    rbssigkey               = 'RSigBS'
+  # (the derived dict below is also used to map old branch names to new ones)
+  derived                   = {}
+  if vnametype=='old':
+    for newname, oldname in oldv0branchnames.items(): derived[newname] = branches[oldname]
     branches['_V0NormChi2Pos'] = branches['_V0PtPos']*0.
     branches['_V0NormChi2Neg'] = branches['_V0PtNeg']*0.
 
@@ -131,165 +441,520 @@ if __name__=='__main__':
 
   # define extra variables
   print('Constructing auxiliary variables')
-  
-  # pointing angle wrt primary vertex
-  cospointingPV             = cospointing(branches, reference='primaryVertex')
-  
-  # pointing angle wrt beam spot
-  cospointingBS             = cospointing(branches, reference='beamSpot')
-  
-  # sum of track pt
-  ptSum                     = branches['_V0PtPos'] + branches['_V0PtNeg']
-
-  # deltaR between tracks
-  posp4                     = vector.zip({
-                                'pt':               branches['_V0PtPos'],
-                                'eta':              branches['_V0EtaPos'],
-                                'phi':              branches['_V0PhiPos'],
-                                'mass':             0.
-                            })
-  negp4                     = vector.zip({
-                                'pt':               branches['_V0PtNeg'],
-                                'eta':              branches['_V0EtaNeg'],
-                                'phi':              branches['_V0PhiNeg'],
-                                'mass':             0.
-                            })
-  trackdR                   = posp4.deltaR(negp4)
+  derived.update(derived_variables(branches, derived=derived))
+  starttime                 = add_time(timings, 'auxiliary', starttime)
 
   # make masks for quality selections
+  # (the derived variables can be used in the cut expressions, see v0selections.py,
+  #  and are shared between the selections)
   print('Performing selections')
-  extra                     = {
-                                'cospointingPV':    cospointingPV,
-                                'cospointingBS':    cospointingBS
-                            }
-  (selmask, allmasks)       = selection(branches, args.selection, extra=extra, cutflow=True)
-  print('Selection summary:')
-  print('  Before selection: {} candidates'.format(ak.count(selmask)))
-  for maskname, mask in allmasks.items():
-    print('  - {}: {}'.format(maskname, np.sum(mask)))
-  print('  -> Candidates passing all selections: {}'.format(np.sum(selmask)))
+  extra                     = derived
+  selmasks                  = {}
+  cutflow                   = {}
+  for name in selection_names:
+    (selmask, allmasks)     = selection(branches, name, extra=extra, cutflow=True)
+    thiscutflow             = {'all': ak.count(selmask)}
+    for maskname, mask in allmasks.items():
+      thiscutflow[maskname] = np.sum(mask)
+    thiscutflow['selected'] = np.sum(selmask)
+
+    # in loose mode, replace the selection by the preselection
+    # and store the individual cuts instead
+    # (only supported for a single selection, see build_file)
+    if loose:
+      derived['selectionBits'] = cutbits(allmasks)
+      selmask               = preselection(branches, name, extra=extra)
+      thiscutflow['preselected'] = np.sum(selmask)
+    selmasks[name]          = selmask
+    cutflow[name]           = thiscutflow
+  starttime                 = add_time(timings, 'selection', starttime)
 
   # fill nimloth
   print('Filling per-event tree')
   nimloth                   = {}
-  nimlothvars               = [
-                                '_nimloth_Mll', 
-                                '_nimloth_nJets',
-                                '_beamSpotX', 
-                                '_beamSpotY', 
-                                '_beamSpotZ',
-                                '_primaryVertexX', 
-                                '_primaryVertexY', 
-                                '_primaryVertexZ'
-                            ]
-  nimlothvars               += ['_runNb', '_lumiBlock', '_eventNb']
-  if not isdata: nimlothvars += ['_weight', '_nTrueInt']
   for var in nimlothvars:   nimloth[var] = branches[var]
+  if not isdata:
+    for var in simvars:     nimloth[var] = branches[var]
 
   # fill celeborn
   print('Filling per-lepton tree')
   celeborn                  = {}
-  celebornvars              = [
-                                '_celeborn_lPt', 
-                                '_celeborn_lEta', 
-                                '_celeborn_lPhi', 
-                                '_celeborn_lCharge'
-                            ]
   for var in celebornvars:  celeborn[var] = ak.flatten(branches[var])
-  celeborn['_runNb']        = np.repeat(branches['_runNb'], 2)
-  celeborn['_lumiBlock']    = np.repeat(branches['_lumiBlock'], 2)
-  celeborn['_eventNb']      = np.repeat(branches['_eventNb'], 2)
-  if not isdata:
-    celeborn['_weight']     = np.repeat(branches['_weight'], 2)
-    celeborn['_nTrueInt']   = np.repeat(branches['_nTrueInt'], 2)
-
-  # fill laurelin
-  print('Filling K0s tree')
-  laurelin                  = {}
-  laurelinmask              = (ksmask & selmask)
-  print('Found {} K0s candidates'.format(np.sum(laurelinmask)))
-  laurelin['_mass']         = ak.flatten(branches['_V0InvMass'][laurelinmask])
-  laurelin['_vertexX']      = ak.flatten(branches['_V0X'][laurelinmask])
-  laurelin['_vertexY']      = ak.flatten(branches['_V0Y'][laurelinmask])
-  laurelin['_vertexZ']      = ak.flatten(branches['_V0Z'][laurelinmask])
-  laurelin['_RPV']          = ak.flatten(branches['_V0RPV'][laurelinmask])
-  laurelin['_RBS']          = ak.flatten(branches['_V0RBS'][laurelinmask])
-  laurelin['_RPVSig']       = ak.flatten(branches['_V0'+rpvsigkey][laurelinmask])
-  laurelin['_RBSSig']       = ak.flatten(branches['_V0'+rbssigkey][laurelinmask])
-  laurelin['_pt']           = ak.flatten(branches['_V0Pt'][laurelinmask])
-  laurelin['_ptSum']        = ak.flatten(ptSum[laurelinmask])
-  laurelin['_eta']          = ak.flatten(branches['_V0Eta'][laurelinmask])
-  laurelin['_phi']          = ak.flatten(branches['_V0Phi'][laurelinmask])
-  laurelin['_nHitsPos']     = ak.flatten(branches['_V0NHitsPos'][laurelinmask])
-  laurelin['_nHitsNeg']     = ak.flatten(branches['_V0NHitsNeg'][laurelinmask])
-  laurelin['_ptPos']        = ak.flatten(branches['_V0PtPos'][laurelinmask])
-  laurelin['_ptNeg']        = ak.flatten(branches['_V0PtNeg'][laurelinmask])
-  laurelin['_normChi2Pos']  = ak.flatten(branches['_V0NormChi2Pos'][laurelinmask])
-  laurelin['_normChi2Neg']  = ak.flatten(branches['_V0NormChi2Neg'][laurelinmask])
-  laurelin['_trackdR']      = ak.flatten(trackdR[laurelinmask])
-  laurelin['_runNb']        = ak.flatten( (branches['_V0Pt'][laurelinmask]>-1.)*branches['_runNb'] )
-  laurelin['_lumiBlock']    = ak.flatten( (branches['_V0Pt'][laurelinmask]>-1.)*branches['_lumiBlock'] )
-  laurelin['_eventNb']      = ak.flatten( (branches['_V0Pt'][laurelinmask]>-1.)*branches['_eventNb'] )
-  #laurelin['_nVertices']   = nVertices
-  if not isdata:
-    laurelin['_weight']     = ak.flatten( (branches['_V0Pt'][laurelinmask]>-1.)*branches['_weight'] )
-    laurelin['_nTrueInt']   = ak.flatten( (branches['_V0Pt'][laurelinmask]>-1.)*branches['_nTrueInt'] )
-
-  # fill telperion
-  print('Filling Lambda tree')
-  telperion                 = {}
-  telperionmask             = (lmask & selmask)
-  print('Found {} Lambda candidates'.format(np.sum(telperionmask)))
-  telperion['_mass']        = ak.flatten(branches['_V0InvMass'][telperionmask])
-  telperion['_vertexX']     = ak.flatten(branches['_V0X'][telperionmask])
-  telperion['_vertexY']     = ak.flatten(branches['_V0Y'][telperionmask])
-  telperion['_vertexZ']     = ak.flatten(branches['_V0Z'][telperionmask])
-  telperion['_RPV']         = ak.flatten(branches['_V0RPV'][telperionmask])
-  telperion['_RBS']         = ak.flatten(branches['_V0RBS'][telperionmask])
-  telperion['_RPVSig']      = ak.flatten(branches['_V0'+rpvsigkey][telperionmask])
-  telperion['_RBSSig']      = ak.flatten(branches['_V0'+rbssigkey][telperionmask])
-  telperion['_pt']          = ak.flatten(branches['_V0Pt'][telperionmask])
-  telperion['_ptSum']       = ak.flatten(ptSum[telperionmask])
-  telperion['_eta']         = ak.flatten(branches['_V0Eta'][telperionmask])
-  telperion['_phi']         = ak.flatten(branches['_V0Phi'][telperionmask])
-  telperion['_nHitsPos']    = ak.flatten(branches['_V0NHitsPos'][telperionmask])
-  telperion['_nHitsNeg']    = ak.flatten(branches['_V0NHitsNeg'][telperionmask])
-  telperion['_ptPos']       = ak.flatten(branches['_V0PtPos'][telperionmask])
-  telperion['_ptNeg']       = ak.flatten(branches['_V0PtNeg'][telperionmask])
-  telperion['_normChi2Pos'] = ak.flatten(branches['_V0NormChi2Pos'][telperionmask])
-  telperion['_normChi2Neg'] = ak.flatten(branches['_V0NormChi2Neg'][telperionmask])
-  telperion['_trackdR']     = ak.flatten(trackdR[telperionmask])
-  telperion['_runNb']       = ak.flatten( (branches['_V0Pt'][telperionmask]>-1.)*branches['_runNb'] )
-  telperion['_lumiBlock']   = ak.flatten( (branches['_V0Pt'][telperionmask]>-1.)*branches['_lumiBlock'] )
-  telperion['_eventNb']     = ak.flatten( (branches['_V0Pt'][telperionmask]>-1.)*branches['_eventNb'] )
-  if not isdata:
-    telperion['_weight']    = ak.flatten( (branches['_V0Pt'][telperionmask]>-1.)*branches['_weight'] )
-    telperion['_nTrueInt']  = ak.flatten( (branches['_V0Pt'][telperionmask]>-1.)*branches['_nTrueInt'] )
-
-  # write output trees to file
-  print('Writing trees to output file')
-  with uproot.recreate(args.outputfile) as f:
-    f['nimloth']            = nimloth
-    f['celeborn']           = celeborn
-    f['laurelin']           = laurelin
-    f['telperion']          = telperion
-    f['nVertices']          = nVertices
+  if not normalized:
+    celeborn['_runNb']      = np.repeat(branches['_runNb'], 2)
+    celeborn['_lumiBlock']  = np.repeat(branches['_lumiBlock'], 2)
+    celeborn['_eventNb']    = np.repeat(branches['_eventNb'], 2)
     if not isdata:
-        f['hCounter']       = hcounter
-        f['nTrueInteractions'] = ntrueint
-
-  # handle case of transfering output file
-  if args.transfer:
-    # move output to destination
-    cmd = 'mv {} {}'.format(args.outputfile, origoutputfile)
-    print('Transfering output file...')
-    print(cmd)
-    os.system(cmd)
-    print('Done transfering output file.')
-    # remove temporary file
-    cmd = 'rm {}'.format(tmpfile)
-    print('Removing temporary file {}'.format(tmpfile))
-    os.system(cmd)
+      celeborn['_weight']   = np.repeat(branches['_weight'], 2)
+      celeborn['_nTrueInt'] = np.repeat(branches['_nTrueInt'], 2)
+
+  trees                     = {
+                                'nimloth':          nimloth,
+                                'celeborn':         celeborn,
+                            }
+  # store the number of per-lepton and per-V0 entries per event in nimloth
+  if normalized:
+    nimloth[eit.get_countbranchname('celeborn')] = np.full(len(branches), 2, dtype=np.int32)
+
+  # fill laurelin and telperion for each selection
+  for name, (laurelinname, telperionname) in get_v0treenames(selection_names).items():
+    for (treename, typemask, label) in [(laurelinname, ksmask, 'K0s'), (telperionname, lmask, 'Lambda')]:
+      print('Filling {} tree'.format(label))
+      mask                  = (typemask & selmasks[name])
+      print('Found {} {} candidates'.format(np.sum(mask), label))
+      trees[treename]       = gather_columns(branches, derived, mask, isdata,
+                                columns=get_v0columns(loose=loose), normalized=normalized)
+      if normalized:
+        nimloth[eit.get_countbranchname(treename)] = ak.to_numpy(ak.sum(mask, axis=1)).astype(np.int32)
+  add_time(timings, 'flattening', starttime)
+  return (trees, cutflow)
+
+
+def build_file(inputfile, outputfile, selection_name,
+               nevents=-1, chunksize=-1, loose=False, normalized=False,
+               compression=None, basketsize=None, selectionfile=None, lumimask=None):
+  ### make the V0 output trees for a single input file
+  # input arguments:
+  # - inputfile: skimmed ntuple to read
+  # - outputfile: output file to (re)create
+  # - selection_name: name of the V0 selection to apply, or list of names
+  #   (all selections are evaluated in a single pass over the input, see build_chunk)
+  # - nevents: number of events to read (default: all)
+  # - chunksize: number of events to process at once (default: all)
+  # - loose: run in loose build mode (see build_chunk)
+  # - normalized: write normalized output trees (see build_chunk)
+  # - compression: list of per-tree compression settings (see TreeWriter)
+  # - basketsize: list of per-tree basket sizes (see TreeWriter)
+  # - selectionfile: file with additional selection definitions (see v0selections.py)
+  # - lumimask: json file with the lumi sections to keep (e.g. golden json), applied to data only;
+  #   the processed lumi sections are written to a json file next to the output file
+  #   (see get_lumilistfile and tools/lumimasktools.py)
+  # returns a dict with the number of processed events and candidates
+  # and the time spent in each phase (see also v0benchmark.py)
+
+  # load additional selection definitions
+  # (also needed here since build_file can run in a separate worker process)
+  if selectionfile is not None: load_selections(selectionfile)
+  selection_names           = get_selectionlist(selection_name)
+  for name in selection_names: get_selection(name)
+  if( loose and len(selection_names)>1 ):
+    raise Exception('ERROR: loose build mode is only supported for a single selection.')
+
+  # open input file and output file
+  # note: the output trees are filled chunk by chunk,
+  #       so both files need to stay open during the event loop.
+  print('Now running on file {}...'.format(inputfile))
+  with uproot.open(inputfile) as f, uproot.recreate(outputfile) as fout:
+    fkeys                   = [key.split(';')[0] for key in f.keys()]
+    tree                    = f["blackJackAndHookers"]["blackJackAndHookersTree"]
+    nVertices               = f["blackJackAndHookers"]["nVertices"]
+
+    # read counter histograms
+    isdata                  = False
+    hcounterkey             = "blackJackAndHookers/hCounter"
+    ntrueintkey             = "blackJackAndHookers/nTrueInteractions"
+    if( hcounterkey not in fkeys or ntrueintkey not in fkeys ):
+        print('No valid hCounter or nTrueInt found in this file, assuming this is data...')
+        isdata              = True
+    else:
+        hcounter            = f[hcounterkey]
+        ntrueint            = f[ntrueintkey]
+
+    # compile the lumi mask
+    lumimasker              = None
+    if lumimask is not None:
+      if not isdata: print('WARNING: this is simulation, the lumi mask will be ignored.')
+      else:
+        lumimasker          = lmt.LumiMask(lumimask)
+        lumikeys            = []
+        nlumimasked         = 0
+
+    # define branches to read from input file
+    branchnames             = get_branchnames(tree, isdata, selection_name, loose=loose)
+    print('Will read {} out of {} branches'.format(len(branchnames), len(tree.keys())))
+
+    # define the entry ranges to read
+    entry_stop              = tree.num_entries
+    if( nevents>0 and nevents<tree.num_entries ): entry_stop = nevents
+    entry_ranges            = get_entry_ranges(entry_stop, chunksize=chunksize)
+    msg                     = 'Tree is found to have {} entries'.format(tree.num_entries)
+    msg                     += ' of which {} will be read'.format(entry_stop)
+    msg                     += ' in {} chunk(s)'.format(len(entry_ranges))
+    print(                  msg)
+
+    # loop over chunks
+    cutflow                 = {}
+    timings                 = {}
+    writer                  = TreeWriter(fout, compression=compression, basketsize=basketsize)
+    for (entry_start, chunk_stop) in entry_ranges:
+      print('Reading branches for entries {} to {}'.format(entry_start, chunk_stop))
+      sys.stdout.flush()
+      sys.stderr.flush()
+      starttime             = time.time()
+      branches              = tree.arrays(branchnames, entry_start=entry_start, entry_stop=chunk_stop)
+      starttime             = add_time(timings, 'read', starttime)
+
+      # only keep events in the lumi mask
+      if lumimasker is not None:
+        keys                = lmt.get_lumikeys(branches['_runNb'], branches['_lumiBlock'])
+        lumimaskpass        = lumimasker.contains_keys(keys)
+        nlumimasked         += int(np.sum(~lumimaskpass))
+        lumikeys.append(    np.unique(keys[lumimaskpass]))
+        branches            = branches[lumimaskpass]
+        add_time(timings, 'lumimask', starttime)
+
+      # make the output trees for this chunk
+      (outtrees, chunkcutflow) = build_chunk(branches, selection_name, isdata,
+                                  loose=loose, normalized=normalized, timings=timings)
+      for name, thiscutflow in chunkcutflow.items():
+        if name not in cutflow.keys(): cutflow[name] = {}
+        for key, val in thiscutflow.items():
+          cutflow[name][key] = cutflow[name].get(key, 0) + val
+
+      # write output trees to file
+      # (the first chunk creates the trees, the others are appended)
+      print('Writing trees to output file')
+      for treename, outtree in outtrees.items(): writer.write(treename, outtree)
+    writer.close()
+
+    # print selection summary
+    for name in selection_names:
+      thiscutflow           = cutflow[name]
+      if len(selection_names)==1: print('Selection summary:')
+      else: print('Selection summary for {}:'.format(name))
+      print('  Before selection: {} candidates'.format(thiscutflow['all']))
+      cutnames              = [key for key in thiscutflow.keys() if key not in ['all', 'selected', 'preselected']]
+      for maskname in cutnames:
+        print('  - {}: {}'.format(maskname, thiscutflow[maskname]))
+      print('  -> Candidates passing all selections: {}'.format(thiscutflow['selected']))
+      if loose:
+        print('  -> Candidates passing the preselection (written to output): {}'.format(thiscutflow['preselected']))
+        # store the meaning of the bits in _selectionBits
+        fout['selectionName'] = name
+        fout['cutNames']    = ','.join(cutnames)
+
+    # write the processed lumi sections
+    if lumimasker is not None:
+      lumilist              = lmt.compact_lumilist(np.concatenate(lumikeys))
+      lmt.write_lumilist(lumilist, get_lumilistfile(outputfile))
+      msg                   = 'Lumi mask: removed {} out of {} events;'.format(nlumimasked, entry_stop)
+      msg                   += ' processed {} lumi sections'.format(lmt.count_lumis(lumilist))
+      msg                   += ' in {} runs'.format(len(lumilist))
+      print(                msg)
+
+    # write histograms to output file
+    fout['nVertices']       = nVertices
+    if not isdata:
+        fout['hCounter']    = hcounter
+        fout['nTrueInteractions'] = ntrueint
+
+  # print output summary
+  print('Output summary:')
+  writtentreenames          = list(writer.writetime.keys())
+  treesizes                 = get_treesizes(outputfile, writtentreenames)
+  for treename in writtentreenames:
+    msg                     = '  - {}: write time {:.2f} s'.format(treename, writer.writetime[treename])
+    if treename in treesizes.keys():
+      (nentries, compressed, uncompressed) = treesizes[treename]
+      msg                   += ', {} entries'.format(nentries)
+      msg                   += ', {:.2f} MB compressed'.format(compressed/1e6)
+      msg                   += ' ({:.2f} MB uncompressed'.format(uncompressed/1e6)
+      if compressed>0: msg  += ', ratio {:.2f}'.format(uncompressed/float(compressed))
+      msg                   += ')'
+    print(                  msg)
+  for treename in writtentreenames:
+    timings['write_{}'.format(treename)] = writer.writetime[treename]
+  stats                     = {
+                                'nevents':          entry_stop,
+                                'ncandidates':      int(cutflow[selection_names[0]]['all']),
+                                'nselected':        int(sum(cutflow[name]['selected'] for name in selection_names)),
+                                'timings':          timings
+                            }
+  return stats
+
+def get_lumilistfile(outputfile):
+  ### get the name of the json file with the processed lumi sections belonging to an output file
+  return os.path.splitext(outputfile)[0]+'_lumis.json'
+
+def get_builderversion():
+  ### get a version tag of the V0 building code (a checksum of its source files),
+  # used to recognize outputs made with another version (see tools/manifesttools.py)
+  # note: the imported tools that can change the output (normalized layout, lumi mask,
+  #       staging of files and merging of multiple outputs) are included as well.
+  sourcefiles               = [__file__, v0selections.__file__, eit.__file__, lmt.__file__,
+                               tt.__file__, mt.__file__]
+  sourcefiles               = [os.path.abspath(sourcefile) for sourcefile in sourcefiles]
+  return mft.get_version(sourcefiles + [v0selections.selectionfile])
+
+def get_buildsettings(selection_name, nevents=-1, loose=False, normalized=False,
+                      compression=None, basketsize=None, lumimask=None, **kwargs):
+  ### get the settings that determine the content of an output file (for the manifest)
+  # note: other arguments (e.g. chunksize) do not change the output and are ignored.
+  # note: the definition of the selection is included as well,
+  #       since it can come from a user-provided selection file.
+  # note: the lumi mask is included by checksum (and only if used,
+  #       so that records made without lumi mask stay valid).
+  definition                = [get_selection(name).definition for name in get_selectionlist(selection_name)]
+  if isinstance(selection_name, str): definition = definition[0]
+  settings                  = {
+    'selection':            selection_name,
+    'selectiondefinition':  definition,
+    'nevents':              nevents,
+    'loose':                loose,
+    'normalized':           normalized,
+    'compression':          compression,
+    'basketsize':           basketsize
+  }
+  if lumimask is not None: settings['lumimask'] = mft.get_version([lumimask])
+  return settings
+
+def build_file_job(job, **kwargs):
+  ### wrapper around build_file for use in a worker pool
+  # input arguments:
+  # - job: tuple of the form (input file, output file)
+  # - kwargs: passed down to build_file
+  # returns a tuple of the form (input file, output file, error message or None),
+  # so that a failure in one file does not stop the processing of the others.
+  (inputfile, outputfile)   = job
+  try: build_file(inputfile, outputfile, **kwargs)
+  except Exception as e:
+    msg                     = 'ERROR: processing of {} failed: {}'.format(inputfile, repr(e))
+    print(                  msg)
+    return (inputfile, outputfile, msg)
+  return (inputfile, outputfile, None)
+
+def build_files(jobs, nworkers=1, transfer=False, maxstagesize=10e9,
+                manifest=False, checksum=False, **kwargs):
+  ### make the V0 output trees for multiple input files in a pool of worker processes
+  # input arguments:
+  # - jobs: list of tuples of the form (input file, output file)
+  # - nworkers: number of parallel worker processes
+  # - transfer: copy the input files to a local temporary directory before reading
+  #             and write the output files there before moving them to their destination;
+  #             the next input files are staged in the background while the current ones
+  #             are processed, and finished outputs are moved in the background as well
+  #             (see tools/transfertools.py).
+  # - maxstagesize: maximum total size (in bytes) of the staged files on the local disk
+  # - manifest: add a record for each successfully made output file
+  #             to the manifest of its directory (see tools/manifesttools.py)
+  # - checksum: include a checksum of the input file in the manifest records
+  # - kwargs: passed down to build_file
+  # returns a list of the jobs that failed (same format as build_file_job)
+  jobfunc                   = functools.partial(build_file_job, **kwargs)
+  failed                    = []
+
+  # add a finished output file to the manifest
+  if manifest:
+    settings                = get_buildsettings(**kwargs)
+    version                 = get_builderversion()
+  def add_record(inputfile, outputfile):
+    if not manifest: return
+    mft.add_record(inputfile, outputfile, settings, version, checksum=checksum)
+
+  # define the jobs to run, with local input and output files in case of transfer
+  runjobs                   = jobs
+  if transfer:
+    stager                  = tt.Stager([inputfile for (inputfile, _) in jobs], maxsize=maxstagesize)
+    localjobs               = {}
+    def stagedjobs():
+      for (inputfile, outputfile) in jobs:
+        try: localinput     = stager.get(inputfile)
+        except Exception as e:
+          print(            str(e))
+          failed.append(    (inputfile, outputfile, str(e)))
+          continue
+        localoutput         = localinput.replace('.root','_out.root')
+        localjobs[localinput] = (inputfile, outputfile)
+        yield (localinput, localoutput)
+    runjobs                 = stagedjobs()
+
+  # handle the result of a job
+  def handle_result(result):
+    if not transfer:
+      if result[2] is not None: failed.append(result)
+      else: add_record(result[0], result[1])
+      return
+    # in case of transfer, clean up local input and move local output
+    (localinput, localoutput, msg) = result
+    (inputfile, outputfile) = localjobs[localinput]
+    stager.release(inputfile)
+    if msg is not None:
+      for localfile in [localoutput, get_lumilistfile(localoutput)]:
+        if os.path.exists(localfile): os.remove(localfile)
+      failed.append(        (inputfile, outputfile, msg))
+    else:
+      stager.upload(        localoutput, outputfile)
+      if os.path.exists(get_lumilistfile(localoutput)):
+        stager.upload(      get_lumilistfile(localoutput), get_lumilistfile(outputfile))
+
+  # run the jobs
+  if( nworkers<=1 or len(jobs)<=1 ):
+    for job in runjobs: handle_result(jobfunc(job))
+  else:
+    nworkers                = min(nworkers, len(jobs))
+    print('Processing {} files with {} worker processes...'.format(len(jobs), nworkers))
+    with multiprocessing.Pool(processes=nworkers) as pool:
+      nfinished             = 0
+      for result in pool.imap_unordered(jobfunc, runjobs):
+        handle_result(result)
+        nfinished           += 1
+        print('Finished {} of {} files'.format(nfinished, len(jobs)))
+        sys.stdout.flush()
+
+  # wait for the output files to be moved
+  if transfer:
+    print('Waiting for output files to be transferred...')
+    for (destination, msg) in stager.finish():
+      print(                msg)
+      (inputfile, outputfile) = [job for job in jobs
+                                  if destination in [job[1], get_lumilistfile(job[1])]][0]
+      failed.append(        (inputfile, outputfile, msg))
+    failedoutputs           = [outputfile for (_, outputfile, _) in failed]
+    for (inputfile, outputfile) in localjobs.values():
+      if outputfile not in failedoutputs: add_record(inputfile, outputfile)
+  return failed
+
+def get_inputfiles(inputs):
+  ### expand a list of input files and/or directories into a list of input files
+  # note: directories are not searched recursively, only root files directly inside are taken.
+  inputfiles                = []
+  for inputpath in inputs:
+    if os.path.isdir(inputpath):
+      inputfiles            += sorted([os.path.join(inputpath, f) for f in os.listdir(inputpath)
+                                        if f.endswith('.root')])
+    else: inputfiles.append(inputpath)
+  return inputfiles
+
+
+if __name__=='__main__':
+
+  # write starting tag (for automatic crash checking)
+  sys.stderr.write('###starting###\n')
+
+  # read command line arguments
+  parser = argparse.ArgumentParser( description = 'Perform V0 candidate selection' )
+  parser.add_argument('-i', '--inputfile',  required=True,      type=os.path.abspath,   nargs='+',
+                            help='Input file(s) and/or directories containing input files')
+  parser.add_argument('-o', '--outputfile', required=True,      type=os.path.abspath,
+                            help='Output file; in case of multiple input files,'
+                                +' output directory (one output file per input file),'
+                                +' or a single .root file to merge all outputs into')
+  parser.add_argument('-s', '--selection',  default=['legacy'],   nargs='+',
+                            help='Name of the selection to apply; in case of multiple selections,'
+                                +' all are evaluated in one pass and written to separate per-V0 trees'
+                                +' (laurelin_<selection> and telperion_<selection>)')
+  parser.add_argument(      '--selectionfile', default=None,    type=os.path.abspath,
+                            help='Json or yaml file with additional selection definitions'
+                                +' (see v0selections.py and selections.json)')
+  parser.add_argument('-n', '--nevents',    default=-1,         type=int)
+  parser.add_argument(      '--chunksize',  default=-1,         type=int,
+                            help='Number of input events to process at once'
+                                +' (default: all events in one go)')
+  parser.add_argument(      '--nworkers',   default=1,          type=int,
+                            help='Number of input files to process in parallel')
+  parser.add_argument(      '--transfer',   default=False,      action='store_true',
+                            help='Stage input and output files on the local disk'
+                                +' (in the background, see tools/transfertools.py)')
+  parser.add_argument(      '--maxstagesize', default=10.,      type=float,
+                            help='Maximum size (in GB) of staged files on the local disk')
+  parser.add_argument(      '--loose',      default=False,      action='store_true',
+                            help='Keep all candidates passing the preselection'
+                                +' and store the individual cuts as a bitmask (see v0reselect.py)')
+  parser.add_argument(      '--compression', default=None,      nargs='+',
+                            help='Compression of the output trees, in the format [<tree>:]<algorithm>[:<level>]'
+                                +' (e.g. LZ4:4 laurelin:ZSTD:5), algorithm is one of '
+                                +', '.join(compressioncodecs.keys()))
+  parser.add_argument(      '--basketsize', default=None,       nargs='+',
+                            help='Number of entries per basket of the output trees,'
+                                +' in the format [<tree>:]<entries> (default: one basket per chunk)')
+  parser.add_argument(      '--normalized', default=False,      action='store_true',
+                            help='Do not copy per-event variables to the per-lepton and per-V0 trees,'
+                                +' but store the number of entries per event in nimloth instead')
+  parser.add_argument(      '--manifest',   default=False,      action='store_true',
+                            help='Record each output file in the manifest of its directory'
+                                +' (used by v0builder_submit.py to skip up-to-date outputs)')
+  parser.add_argument(      '--checksum',   default=False,      action='store_true',
+                            help='Include a checksum of the input file in the manifest records')
+  parser.add_argument(      '--lumimask',   default=None,       type=os.path.abspath,
+                            help='Json file with the lumi sections to keep in data (e.g. golden json);'
+                                +' the processed lumi sections are written to <output>_lumis.json')
+  args = parser.parse_args()
+
+  # check selection_name
+  if args.selectionfile is not None: load_selections(args.selectionfile)
+  for selection_name in args.selection: get_selection(selection_name)
+  if( args.loose and len(args.selection)>1 ):
+    raise Exception('ERROR: loose build mode is only supported for a single selection.')
+  selection_name            = args.selection[0] if len(args.selection)==1 else args.selection
+
+  # check compression and basket size settings
+  parse_treesettings(args.compression, parse_compression)
+  parse_treesettings(args.basketsize, int)
+
+  # find input files
+  inputfiles                = get_inputfiles(args.inputfile)
+  if len(inputfiles)==0:
+    raise Exception('ERROR: no input files found in {}.'.format(args.inputfile))
+
+  # define output files
+  combine                   = False
+  if len(inputfiles)==1: jobs = [(inputfiles[0], args.outputfile)]
+  elif args.outputfile.endswith('.root'):
+    # one output per input in a temporary directory, merged at the end
+    combine                 = True
+    partsdir                = os.path.splitext(args.outputfile)[0]+'_parts'
+    if not os.path.exists(partsdir): os.makedirs(partsdir)
+    jobs                    = [(f, os.path.join(partsdir, '{}_{}'.format(i, os.path.basename(f))))
+                                for i, f in enumerate(inputfiles)]
+  else:
+    if not os.path.exists(args.outputfile): os.makedirs(args.outputfile)
+    jobs                    = [(f, os.path.join(args.outputfile,
+                                  os.path.basename(f).replace('.root','_selected.root')))
+                                for f in inputfiles]
+
+  # run the V0 building
+  failed                    = build_files(jobs, nworkers=args.nworkers,
+                                selection_name=selection_name,
+                                selectionfile=args.selectionfile,
+                                nevents=args.nevents,
+                                chunksize=args.chunksize,
+                                transfer=args.transfer,
+                                maxstagesize=args.maxstagesize*1e9,
+                                manifest=(args.manifest and not combine),
+                                checksum=args.checksum,
+                                loose=args.loose,
+                                normalized=args.normalized,
+                                compression=args.compression,
+                                basketsize=args.basketsize,
+                                lumimask=args.lumimask)
+  if len(failed)>0:
+    msg                     = 'ERROR: processing failed for {} out of {} files:\n'.format(len(failed), len(jobs))
+    for (inputfile, _, _) in failed: msg += '  - {}\n'.format(inputfile)
+    raise Exception(msg)
+
+  # merge the outputs if requested
+  if combine:
+    print('Merging {} output files into {}...'.format(len(jobs), args.outputfile))
+    # (with the python merger, see tools/mergetools.py, keeping the default compression if set)
+    mergecompression        = None
+    if args.compression is not None:
+      defaults              = [spec for spec in args.compression if spec.split(':')[0] not in outtreenames]
+      if len(defaults)>0: mergecompression = defaults[-1]
+    mt.mergefiles([job[1] for job in jobs], args.outputfile, nworkers=args.nworkers,
+                  compression=mergecompression, verify=True)
+    if not os.path.exists(args.outputfile):
+      msg                   = 'ERROR: merging failed, the individual outputs'
+      msg                   += ' are kept in {}.'.format(partsdir)
+      raise Exception(msg)
+    for job in jobs: os.remove(job[1])
+    # merge the processed lumi sections as well
+    lumilistfiles           = [get_lumilistfile(job[1]) for job in jobs
+                                if os.path.exists(get_lumilistfile(job[1]))]
+    if len(lumilistfiles)>0:
+      lumilist              = lmt.merge_lumilists([lmt.read_lumilist(f) for f in lumilistfiles])
+      lmt.write_lumilist(lumilist, get_lumilistfile(args.outputfile))
+      for f in lumilistfiles: os.remove(f)
+    os.rmdir(partsdir)
 
   # write closing tag (for automatic crash checkiing)
   sys.stderr.write('###done###\n')
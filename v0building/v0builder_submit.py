@@ -2,6 +2,11 @@
 # Python script to prepare and submit V0 building jobs #
 ########################################################
 # note: the entire folder structure in inputdir will be copied to output dir.
+# note: each output directory holds a manifest recording how its output files were made
+#       (see tools/manifesttools.py); on resubmission, only the input files
+#       for which the output is missing or stale are processed (unless --force is used).
+#       stale outputs and outputs without corresponding input file are removed
+#       (together with their manifest record) before submitting.
 
 
 # import external modules
@@ -12,26 +17,35 @@ from six.moves import input
 # import framework modules
 sys.path.append('../tools')
 import condortools as ct
+import manifesttools as mft
 CMSSW = '/user/jbierken/CMSSW_15_0_17'
 import listtools as lt
 import sampletools as st
+import v0selections
 
 
 # read command line arguments
 parser = argparse.ArgumentParser( description = 'Perform V0 candidate selection' )
 parser.add_argument(    '-i',   '--inputdir',                       required=True, type=os.path.abspath)
 parser.add_argument(    '-o',   '--outputdir',                      required=True, type=os.path.abspath)
-parser.add_argument(    '-s',   '--selection',  default='legacy')
+parser.add_argument(    '-s',   '--selection',  default=['legacy'],   nargs='+')
+parser.add_argument(            '--selectionfile', default=None,    type=os.path.abspath)
+parser.add_argument(            '--chunksize',  default=-1,         type=int)
 parser.add_argument(            '--transfer',   default=False,      action='store_true')
+parser.add_argument(            '--normalized', default=False,      action='store_true')
+parser.add_argument(            '--compression', default=None,      nargs='+')
+parser.add_argument(            '--basketsize', default=None,       nargs='+')
 parser.add_argument(            '--runmode',    default='condor',   choices=['local', 'condor'])
+parser.add_argument(            '--nworkers',   default=1,          type=int)
+parser.add_argument(            '--checksum',   default=False,      action='store_true')
+parser.add_argument(            '--force',      default=False,      action='store_true')
+parser.add_argument(            '--lumimask',   default=None,       type=os.path.abspath)
 args = parser.parse_args()
 
 # check selection name
-allowed_selections  = [
-                        'legacy',
-                    ]
-if args.selection not in allowed_selections:
-    raise Exception('ERROR: selection '+args.selection+' not recognized.')
+if args.selectionfile is not None: v0selections.load_selections(args.selectionfile)
+for selection_name in args.selection: v0selections.get_selection(selection_name)
+selection_name      = args.selection[0] if len(args.selection)==1 else args.selection
 
 # check if input directory exists
 if not os.path.exists(args.inputdir):
@@ -62,32 +76,91 @@ go                  = input()
 if not go=='y':
     sys.exit()
 
+# get the settings and code version to compare to the manifests
+from v0builder import get_buildsettings, get_builderversion
+settings            = get_buildsettings(selection_name,
+                        normalized=args.normalized,
+                        compression=args.compression,
+                        basketsize=args.basketsize,
+                        lumimask=args.lumimask)
+version             = get_builderversion()
+
 workdir             = os.getcwd()
 cmds                = []
+jobs                = []
+nuptodate           = 0
 # loop over input directories
 for indirname in sorted(inputfiles.keys()):
     outdirname      = os.path.join(args.outputdir, indirname)
-    # clean outputdir if it exists, else create it
-    if os.path.exists(outdirname):
-        os.system('rm -r '+outdirname)
-    os.makedirs(outdirname)
+    # create outputdir if it does not exist yet, else read its manifest
+    if not os.path.exists(outdirname): os.makedirs(outdirname)
+    manifest        = mft.read_manifest(outdirname)
+    # remove outputs without corresponding input file
+    # (e.g. if the input file was removed or renamed),
+    # so that they do not end up in the merged file
+    outputnames     = [inputfile.replace('.root','_selected.root') for inputfile in inputfiles[indirname]]
+    orphans         = sorted(set([f for f in os.listdir(outdirname) if f.endswith('_selected.root')]
+                        + list(manifest.keys())) - set(outputnames))
+    for orphan in orphans: print('Removing output {} (no corresponding input file)'.format(
+                                 os.path.join(outdirname, orphan)))
+    mft.remove_outputs(outdirname, orphans, extensions=['_lumis.json'])
     # loop over input files
-    for inputfile in inputfiles[indirname]:
-        outputfile  = os.path.join(outdirname,inputfile.replace('.root','_selected.root'))
+    stale           = []
+    for inputfile, outputname in zip(inputfiles[indirname], outputnames):
+        outputfile  = os.path.join(outdirname,outputname)
         inputfile   = os.path.join(args.inputdir,indirname,inputfile)
+        # skip input files for which the output is up to date
+        if not args.force:
+            reason  = mft.get_staleness(manifest.get(outputname, None),
+                        inputfile, outputfile, settings, version)
+            if reason is None:
+                nuptodate += 1
+                continue
+            print('Will (re)process {} ({})'.format(inputfile, reason))
+        stale.append(outputname)
         # make command
         cmd = 'python3 v0builder.py'
         cmd += ' -i {}'.format(inputfile)
         cmd += ' -o {}'.format(outputfile)
-        cmd += ' -s {}'.format(args.selection)
+        cmd += ' -s {}'.format(' '.join(args.selection))
+        if args.selectionfile is not None: cmd += ' --selectionfile {}'.format(args.selectionfile)
+        if args.chunksize>0: cmd += ' --chunksize {}'.format(args.chunksize)
         if args.transfer: cmd += ' --transfer'
+        if args.normalized: cmd += ' --normalized'
+        if args.compression is not None: cmd += ' --compression {}'.format(' '.join(args.compression))
+        if args.basketsize is not None: cmd += ' --basketsize {}'.format(' '.join(args.basketsize))
+        if args.lumimask is not None: cmd += ' --lumimask {}'.format(args.lumimask)
+        cmd += ' --manifest'
+        if args.checksum: cmd += ' --checksum'
         cmds.append(cmd)
+        jobs.append((inputfile, outputfile))
+    # remove the stale outputs and their records before remaking them,
+    # so that they are not left in place if the remaking fails
+    mft.remove_outputs(outdirname, stale, extensions=['_lumis.json'])
+
+# print number of files to process
+print('{} output files are up to date, {} files will be processed.'.format(nuptodate, len(jobs)))
+if len(jobs)==0: sys.exit()
 
 # submit jobs
 if args.runmode=='local':
-    for cmd in cmds:
-        print(      cmd)
-        os.system(  cmd)
+    # run all files in a single process (with a pool of workers if requested),
+    # to avoid paying the startup and import cost for each file separately
+    from v0builder import build_files
+    failed = build_files(jobs, nworkers=args.nworkers,
+                selection_name=selection_name,
+                selectionfile=args.selectionfile,
+                chunksize=args.chunksize,
+                transfer=args.transfer,
+                normalized=args.normalized,
+                compression=args.compression,
+                basketsize=args.basketsize,
+                lumimask=args.lumimask,
+                manifest=True,
+                checksum=args.checksum)
+    if len(failed)>0:
+        print('WARNING: processing failed for following files:')
+        for (inputfile, _, _) in failed: print('  - {}'.format(inputfile))
 elif args.runmode=='condor':
     store_dir = CMSSW + '/src/K0sAnalysis/log_automatic_jobs/'
     ct.submitCommandsAsCondorCluster(store_dir + 'cjob_v0builder', cmds, cmssw_version=CMSSW)
@@ -0,0 +1,125 @@
+#########################################################
+# python script to export V0 trees to a parquet dataset #
+#########################################################
+# the output trees of v0builder.py (or of a merge of several such files) are written
+# as parquet files in a directory structure partitioned by era and sample:
+# <outputdir>/era=<era>/sample=<sample>/<tree name>/<input file name>.parquet
+# (see tools/parquettools.py for more info and for reading them back).
+# the directory <outputdir>/era=<era>/sample=<sample> can then be used
+# in place of the root file of that sample in the analysis steps.
+# note: for normalized input files (see v0builder.py --normalized),
+#       the per-event variables are added again to the per-lepton and per-V0 trees,
+#       so that each exported table can be read on its own.
+# note: requires pyarrow.
+
+# usage example:
+# python3 v0parquet.py -i <merged V0 file> -o <dataset dir> --era 2018 --sample DYJetsToLL --sortby _RPV
+
+
+# import external modules
+import sys
+import os
+import argparse
+import uproot
+# import framework modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),'../tools')))
+import eventindextools as eit
+import parquettools as pt
+
+
+# per-event variables that are copied to the per-lepton and per-V0 trees
+# in non-normalized files (if present in the per-event tree)
+eventbranchnames = ['_runNb', '_lumiBlock', '_eventNb', '_weight', '_nTrueInt']
+
+def export_tree(f, treename, outputfile, metadata=None,
+        rowgroupsize=100000, sortby=None, chunksize=1000000):
+  ### export a single tree of an opened (uproot) V0 file to a parquet file
+  # input arguments:
+  # - f: opened (uproot) V0 file
+  # - treename: name of the tree to export
+  # - outputfile: name of the parquet file to write
+  # - metadata: dict of strings to store in the parquet file
+  # - rowgroupsize: number of entries per row group
+  # - sortby: name of a branch to sort the entries by (within each chunk)
+  # - chunksize: number of entries to read and write at once
+  # returns the number of exported entries
+  tree = f[treename]
+  branchnames = list(tree.keys())
+  normalized = eit.isnormalized(f, treename)
+  if normalized:
+    # read the per-event variables from the per-event tree
+    eventtree = f[eit.eventtreename]
+    addbranchnames = [b for b in eventbranchnames if b in eventtree.keys()]
+    eventindex = eit.read_eventindex(f, treename)
+  elif treename==eit.eventtreename:
+    # remove the entry counts, as they are no longer needed
+    branchnames = [b for b in branchnames if not eit.iscountbranch(b)]
+  if( sortby is not None and sortby not in branchnames ): sortby = None
+  nentries = tree.num_entries
+  writer = None
+  for entry_start in range(0, max(nentries,1), chunksize):
+    entry_stop = min(entry_start+chunksize, nentries)
+    branches = tree.arrays(branchnames, library='np', entry_start=entry_start, entry_stop=entry_stop)
+    if normalized:
+      branches.update(eit.read_eventbranches(f, treename, addbranchnames,
+        eventindex=eventindex[entry_start:entry_stop]))
+    writer = pt.write_tree(branches, outputfile, rowgroupsize=rowgroupsize, sortby=sortby,
+               metadata=metadata, writer=writer)
+  writer.close()
+  return nentries
+
+def export_file(inputfile, outputdir, era, sample, treenames=None,
+        rowgroupsize=100000, sortby=None, chunksize=1000000):
+  ### export the trees of a V0 file to the partition of a parquet dataset
+  # returns a dict matching tree names to exported parquet files
+  if treenames is None: treenames = ['nimloth', 'celeborn', 'laurelin', 'telperion']
+  partitiondir = pt.get_partitiondir(outputdir, era, sample)
+  outputfiles = {}
+  with uproot.open(inputfile) as f:
+    metadata = {'source': inputfile}
+    if 'hCounter' in f: metadata['hCounter'] = repr(float(f['hCounter'].values()[0]))
+    for treename in treenames:
+      if treename not in f:
+        print('WARNING: tree {} not found in {}, skipping it.'.format(treename, inputfile))
+        continue
+      outputfile = os.path.join(partitiondir, treename,
+                     os.path.splitext(os.path.basename(inputfile))[0]+'.parquet')
+      nentries = export_tree(f, treename, outputfile, metadata=metadata,
+                   rowgroupsize=rowgroupsize, sortby=sortby, chunksize=chunksize)
+      print('  - {}: {} entries written to {}'.format(treename, nentries, outputfile))
+      outputfiles[treename] = outputfile
+  return outputfiles
+
+
+if __name__=='__main__':
+
+  # write starting tag (for automatic crash checking)
+  sys.stderr.write('###starting###\n')
+
+  # read command line arguments
+  parser = argparse.ArgumentParser( description = 'Export V0 trees to a parquet dataset' )
+  parser.add_argument('-i', '--inputfiles', required=True,      type=os.path.abspath, nargs='+')
+  parser.add_argument('-o', '--outputdir',  required=True,      type=os.path.abspath)
+  parser.add_argument(      '--era',        required=True)
+  parser.add_argument(      '--sample',     required=True)
+  parser.add_argument('-t', '--treenames',  default=['nimloth', 'celeborn', 'laurelin', 'telperion'],
+                            nargs='+')
+  parser.add_argument(      '--rowgroupsize', default=100000,   type=int)
+  parser.add_argument(      '--sortby',     default=None,
+                            help='Branch to sort the entries by, e.g. _RPV or _mass,'
+                                +' which makes filtering on this branch more efficient when reading')
+  parser.add_argument(      '--chunksize',  default=1000000,    type=int)
+  args = parser.parse_args()
+
+  # check pyarrow before doing anything else
+  pt.check_pyarrow()
+
+  # export the files
+  for inputfile in args.inputfiles:
+    print('Exporting {}...'.format(inputfile))
+    export_file(inputfile, args.outputdir, args.era, args.sample,
+      treenames=args.treenames, rowgroupsize=args.rowgroupsize,
+      sortby=args.sortby, chunksize=args.chunksize)
+
+  # write finishing tag (for automatic crash checking)
+  sys.stderr.write('###done###\n')
@@ -0,0 +1,155 @@
+###############################################################
+# python script to re-apply a V0 selection on a loose V0 file #
+###############################################################
+# note: will only work on files that have been produced with v0builder.py --loose,
+#       which contain all preselected candidates together with a bitmask
+#       holding the outcome of each individual cut of the nominal selection.
+# the output has the same structure as the input, but with only the candidates
+# that pass the requested (possibly modified) selection in the per-V0 trees.
+
+
+# import external modules
+import sys
+import os
+import re
+import argparse
+import operator
+import numpy as np
+import uproot
+# import framework modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),'../tools')))
+import eventindextools as eit
+
+
+# operators allowed in additional cuts
+cutoperators = {
+    '<':    operator.lt,
+    '<=':   operator.le,
+    '>':    operator.gt,
+    '>=':   operator.ge,
+    '==':   operator.eq,
+    '!=':   operator.ne,
+}
+
+def parse_cut(cut):
+  ### parse an additional cut of the form '<branch><operator><value>', e.g. '_dca<0.1'
+  # returns a tuple of the form (branch name, operator function, value)
+  match = re.match(r'^\s*(\w+)\s*(<=|>=|==|!=|<|>)\s*([-+0-9.eE]+)\s*$', cut)
+  if match is None:
+    msg = 'ERROR: cut {} could not be parsed;'.format(cut)
+    msg += ' expected format is e.g. \'_dca<0.1\'.'
+    raise Exception(msg)
+  return (match.group(1), cutoperators[match.group(2)], float(match.group(3)))
+
+def get_requiredbits(cutnames, drop=None):
+  ### get the bitmask of cuts to require, given the names of the cuts to drop
+  if drop is None: drop = []
+  unknown = [cutname for cutname in drop if cutname not in cutnames]
+  if len(unknown)>0:
+    msg = 'ERROR: cuts {} to drop are not part of the selection;'.format(unknown)
+    msg += ' valid cut names are {}.'.format(cutnames)
+    raise Exception(msg)
+  requiredbits = 0
+  for i, cutname in enumerate(cutnames):
+    if cutname not in drop: requiredbits |= (1<<i)
+  return requiredbits
+
+def reselect(branches, requiredbits, cuts=None):
+  ### make a mask of candidates passing the required cuts
+  # input arguments:
+  # - branches: dict of numpy arrays with (at least) the _selectionBits branch
+  # - requiredbits: bitmask of the cuts that must be passed (see get_requiredbits)
+  # - cuts: list of additional cuts (see parse_cut)
+  bits = branches['_selectionBits']
+  mask = ((bits & requiredbits)==requiredbits)
+  if cuts is not None:
+    for (branchname, op, value) in cuts: mask = (mask & op(branches[branchname], value))
+  return mask
+
+
+if __name__=='__main__':
+
+  # write starting tag (for automatic crash checking)
+  sys.stderr.write('###starting###\n')
+
+  # read command line arguments
+  parser = argparse.ArgumentParser( description = 'Re-apply V0 selection on loose V0 file' )
+  parser.add_argument('-i', '--inputfile',  required=True,      type=os.path.abspath)
+  parser.add_argument('-o', '--outputfile', required=True,      type=os.path.abspath)
+  parser.add_argument('-d', '--drop',       default=[],         nargs='+',
+                            help='Names of cuts in the nominal selection to drop')
+  parser.add_argument('-c', '--cuts',       default=[],         nargs='+',
+                            help='Additional cuts on output variables, e.g. \'_dca<0.1\''
+                                +' (only meaningful if tighter than the preselection)')
+  parser.add_argument('-t', '--treenames',  default=['laurelin', 'telperion'], nargs='+',
+                            help='Names of the per-V0 trees to apply the selection to')
+  parser.add_argument(      '--chunksize',  default=1000000,    type=int)
+  args = parser.parse_args()
+
+  # parse the additional cuts
+  cuts = [parse_cut(cut) for cut in args.cuts]
+
+  # open input file and output file
+  with uproot.open(args.inputfile) as f, uproot.recreate(args.outputfile) as fout:
+    fkeys = [key.split(';')[0] for key in f.keys()]
+
+    # read the names of the cuts stored in the bitmask
+    if 'cutNames' not in fkeys:
+      msg = 'ERROR: no cutNames found in {};'.format(args.inputfile)
+      msg += ' was it produced with v0builder.py --loose?'
+      raise Exception(msg)
+    cutnames = str(f['cutNames']).split(',')
+    requiredbits = get_requiredbits(cutnames, drop=args.drop)
+    print('Found selection {} with following cuts:'.format(str(f['selectionName'])))
+    for cutname in cutnames:
+      print('  - {}{}'.format(cutname, ' (dropped)' if cutname in args.drop else ''))
+    if len(cuts)>0:
+      print('Additional cuts:')
+      for cut in args.cuts: print('  - {}'.format(cut))
+
+    # loop over objects in the input file
+    # note: the per-V0 trees are processed first, so that in case of normalized input files,
+    #       the number of selected entries per event can be updated in the per-event tree.
+    fkeys = ([key for key in fkeys if key in args.treenames]
+              + [key for key in fkeys if key not in args.treenames])
+    newcounts = {}
+    for key in fkeys:
+      obj = f[key]
+      if key in ['selectionName', 'cutNames']:
+        # copy strings
+        fout[key] = str(obj)
+        continue
+      if not hasattr(obj, 'iterate'):
+        # copy histograms as is
+        fout[key] = obj
+        continue
+
+      # copy trees in chunks, applying the selection to the per-V0 trees
+      print('Processing tree {}...'.format(key))
+      ninput = 0
+      noutput = 0
+      normalized = (key in args.treenames and eit.isnormalized(f, key))
+      if normalized:
+        eventindex = eit.read_eventindex(f, key)
+        newcounts[key] = np.zeros(f[eit.eventtreename].num_entries, dtype=np.int32)
+      for i, branches in enumerate(obj.iterate(library='np', step_size=args.chunksize)):
+        nchunk = len(next(iter(branches.values())))
+        if key in args.treenames:
+          mask = reselect(branches, requiredbits, cuts=cuts)
+          branches = {name: values[mask] for name, values in branches.items()}
+          if normalized:
+            chunkindex = eventindex[ninput:ninput+nchunk][mask]
+            newcounts[key] += np.bincount(chunkindex, minlength=len(newcounts[key])).astype(np.int32)
+        if key==eit.eventtreename:
+          for treename, counts in newcounts.items():
+            branches[eit.get_countbranchname(treename)] = counts[ninput:ninput+nchunk]
+        ninput += nchunk
+        noutput += len(next(iter(branches.values())))
+        if i==0: fout[key] = branches
+        else: fout[key].extend(branches)
+      # handle case of empty trees
+      if ninput==0: fout[key] = obj.arrays(library='np')
+      print('  {} out of {} entries selected'.format(noutput, ninput))
+
+  # write closing tag (for automatic crash checking)
+  sys.stderr.write('###done###\n')
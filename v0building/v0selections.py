@@ -1,49 +1,295 @@
 ############################
 # V0 selection definitions #
 ############################
+# The selections are defined in selections.json (or in additional json or yaml files,
+# see load_selections) as named, ordered lists of cuts, where each cut is a vectorized
+# expression of input branches and derived variables, e.g. "_V0DCA < 0.2".
+# A selection can also define a looser preselection (needed for loose build mode),
+# and can be based on another selection ("base"), in which case only the cuts to modify
+# need to be given (a cut set to null is removed).
+# Each expression is compiled once into a python function acting on numpy or awkward arrays.
+# Allowed in expressions: branch and variable names, numbers, arithmetic (+ - * / ** %),
+# comparisons (also chained, e.g. "0.4 < _mass < 0.6"), logical and/or/not,
+# and the functions abs, sqrt, log, exp, sin, cos, min and max.
 
-### interface function mapping selection name to function
+import os
+import ast
+import json
+import operator
+import numpy as np
 
-def selection(branches, selection_name, **kwargs):
-    if(selection_name=='legacy'): return selection_legacy(branches, **kwargs)
-    else:
-        msg     = 'ERROR: in pass_selection:'
-        msg     += ' selection function '+selection_name+' not recognized.'
-        raise Exception(msg)
+# default file with selection definitions
+selectionfile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'selections.json')
 
 ### help functions for calculating additional variables
 
+def cospointing_branches(reference='primaryVertex'):
+  ### return the names of the input branches needed by cospointing
+  return ['_V0X', '_V0Y', '_V0Px', '_V0Py', '_{}X'.format(reference), '_{}Y'.format(reference)]
+
 def cospointing(branches, reference='primaryVertex'):
   x             = branches['_V0X'] - branches['_{}X'.format(reference)]
   y             = branches['_V0Y'] - branches['_{}Y'.format(reference)]
   px            = branches['_V0Px']
   py            = branches['_V0Py']
-  
+
   cospointing   = (x*px + y*py) / ( (x**2+y**2)**(1./2) * (px**2+py**2)**(1./2) )
   return cospointing
 
-### selection functions
-
-def selection_legacy( branches, extra=None, cutflow=False ):
-  if 'cospointingPV' not in extra.keys():
-    extra['cospointingPV']  = cospointing(branches, reference='primaryVertex')
-  if 'cospointingBS' not in extra.keys():
-    extra['cospointingBS']  = cospointing(branches, reference='beamSpot')
-  allmasks      = {
-                    'nhitspos':         (branches['_V0NHitsPos']    >=  6),
-                    'nhitsneg':         (branches['_V0NHitsNeg']    >=  6),
-                    'ptpos':            (branches['_V0PtPos']       >   1.),
-                    'ptneg':            (branches['_V0PtNeg']       >   1.),
-                    'normchi2pos':      (branches['_V0NormChi2Pos'] <   5.),
-                    'normchi2neg':      (branches['_V0NormChi2Neg'] <   5.),
-                    'dca':              (branches['_V0DCA']         <   0.2),
-                    'normchi2vtx':      (branches['_V0VtxNormChi2'] <   7),
-                    'cospointingpv':    (extra['cospointingPV']     >   0.99),
-                    'cospointingbs':    (extra['cospointingBS']     >   0.99),
+# derived variables that are calculated here if they are not provided by the caller
+# (as a tuple of the form (function of the branches, needed input branches))
+fallbackvariables = {
+                    'cospointingPV':    (lambda branches: cospointing(branches, reference='primaryVertex'),
+                                         cospointing_branches(reference='primaryVertex')),
+                    'cospointingBS':    (lambda branches: cospointing(branches, reference='beamSpot'),
+                                         cospointing_branches(reference='beamSpot')),
+                }
+
+### compilation of cut expressions
+
+binaryoperators = {
+                    ast.Add:        operator.add,
+                    ast.Sub:        operator.sub,
+                    ast.Mult:       operator.mul,
+                    ast.Div:        operator.truediv,
+                    ast.Pow:        operator.pow,
+                    ast.Mod:        operator.mod,
+                    ast.BitAnd:     operator.and_,
+                    ast.BitOr:      operator.or_,
+                }
+
+compareoperators = {
+                    ast.Lt:         operator.lt,
+                    ast.LtE:        operator.le,
+                    ast.Gt:         operator.gt,
+                    ast.GtE:        operator.ge,
+                    ast.Eq:         operator.eq,
+                    ast.NotEq:      operator.ne,
                 }
-  selmask       = list(allmasks.values())[0]
-  for mask in allmasks.values():
-    selmask     = (selmask & mask)
-  
+
+functions       = {
+                    'abs':          np.abs,
+                    'sqrt':         np.sqrt,
+                    'log':          np.log,
+                    'exp':          np.exp,
+                    'sin':          np.sin,
+                    'cos':          np.cos,
+                    'min':          np.minimum,
+                    'max':          np.maximum,
+                }
+
+def compile_expression(expression):
+  ### compile a cut expression into a function
+  # returns a tuple of the form (function, list of variable names used in the expression),
+  # where the function takes a function mapping variable names to arrays as its argument.
+  try: tree     = ast.parse(expression.strip(), mode='eval')
+  except SyntaxError:
+    raise Exception('ERROR: cut expression "{}" could not be parsed.'.format(expression))
+  names         = []
+
+  def compile_node(node):
+    if isinstance(node, ast.Expression): return compile_node(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+      value     = node.value
+      return lambda get: value
+    if isinstance(node, ast.Name):
+      name      = node.id
+      if name not in names: names.append(name)
+      return lambda get: get(name)
+    if isinstance(node, ast.BinOp) and type(node.op) in binaryoperators:
+      op        = binaryoperators[type(node.op)]
+      (left, right) = (compile_node(node.left), compile_node(node.right))
+      return lambda get: op(left(get), right(get))
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+      operand   = compile_node(node.operand)
+      return lambda get: -operand(get)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.Not, ast.Invert)):
+      operand   = compile_node(node.operand)
+      return lambda get: ~operand(get)
+    if isinstance(node, ast.BoolOp):
+      op        = operator.and_ if isinstance(node.op, ast.And) else operator.or_
+      values    = [compile_node(value) for value in node.values]
+      def boolop(get):
+        res     = values[0](get)
+        for value in values[1:]: res = op(res, value(get))
+        return res
+      return boolop
+    if( isinstance(node, ast.Compare) and all(type(op) in compareoperators for op in node.ops) ):
+      # chained comparisons (e.g. a < b < c) are split in pairs combined with logical and
+      operands  = [compile_node(node.left)] + [compile_node(comp) for comp in node.comparators]
+      ops       = [compareoperators[type(op)] for op in node.ops]
+      def compare(get):
+        values  = [operand(get) for operand in operands]
+        res     = ops[0](values[0], values[1])
+        for i in range(1, len(ops)): res = (res & ops[i](values[i], values[i+1]))
+        return res
+      return compare
+    if( isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+        and node.func.id in functions and len(node.keywords)==0 ):
+      func      = functions[node.func.id]
+      args      = [compile_node(arg) for arg in node.args]
+      return lambda get: func(*[arg(get) for arg in args])
+    msg         = 'ERROR: unsupported element {}'.format(ast.dump(node))
+    msg         += ' in cut expression "{}".'.format(expression)
+    raise Exception(msg)
+
+  return (compile_node(tree), names)
+
+### selection objects and registry
+
+class Selection(object):
+  ### named selection consisting of an ordered list of compiled cuts
+
+  def __init__(self, name, cuts, preselection=None, description=None):
+    ### initializer
+    # input arguments:
+    # - name: name of the selection
+    # - cuts: dict matching cut names to expressions (in the order of the cutflow)
+    # - preselection: dict matching cut names to expressions for the loose preselection
+    # - description: short description
+    self.name           = name
+    self.description    = description
+    self.definition     = {'cuts': dict(cuts), 'preselection': preselection}
+    self.cuts           = [(cutname, expression) + compile_expression(expression)
+                            for cutname, expression in cuts.items()]
+    self.precuts        = None
+    if preselection is not None:
+      self.precuts      = [(cutname, expression) + compile_expression(expression)
+                            for cutname, expression in preselection.items()]
+    if len(self.cuts)==0:
+      raise Exception('ERROR: selection {} has no cuts.'.format(name))
+    if( self.precuts is not None and len(self.precuts)==0 ):
+      raise Exception('ERROR: selection {} has an empty preselection.'.format(name))
+    if len(self.cuts)>32:
+      raise Exception('ERROR: selection {} has more than 32 cuts.'.format(name))
+
+  def cutnames(self):
+    return [cut[0] for cut in self.cuts]
+
+  def variables(self):
+    ### get the names of all variables used in the cuts and preselection
+    names               = []
+    for cut in self.cuts + (self.precuts if self.precuts is not None else []):
+      names             += [name for name in cut[3] if name not in names]
+    return names
+
+  def evaluate(self, branches, extra=None, preselection=False):
+    ### evaluate the cuts on a set of arrays
+    # input arguments:
+    # - branches: dict-like of input branches
+    # - extra: dict of derived variables (looked up before the input branches)
+    # - preselection: evaluate the preselection instead of the selection
+    # returns a tuple of the form (mask of candidates passing all cuts, dict of per-cut masks)
+    if extra is None: extra = {}
+    cuts                = self.cuts
+    if preselection:
+      if self.precuts is None:
+        raise Exception('ERROR: no preselection defined for selection {}.'.format(self.name))
+      cuts              = self.precuts
+    def get(name):
+      if name in extra.keys(): return extra[name]
+      if( name not in fallbackvariables.keys() or has_branch(branches, name) ): return branches[name]
+      extra[name]       = fallbackvariables[name][0](branches)
+      return extra[name]
+    allmasks            = {}
+    for (cutname, _, func, _) in cuts: allmasks[cutname] = func(get)
+    selmask             = None
+    for mask in allmasks.values():
+      selmask           = mask if selmask is None else (selmask & mask)
+    return (selmask, allmasks)
+
+def has_branch(branches, name):
+  ### check if a branch is present in an awkward record array or a dict of arrays
+  if hasattr(branches, 'fields'): return name in branches.fields
+  return name in branches.keys()
+
+selections      = {}
+
+def load_selections(filename):
+  ### load selection definitions from a json or yaml file and add them to the registry
+  # note: selections with the same name as an already loaded selection replace it.
+  if not os.path.exists(filename):
+    raise Exception('ERROR: selection file {} does not exist.'.format(filename))
+  with open(filename, 'r') as f:
+    if os.path.splitext(filename)[1] in ['.yaml', '.yml']:
+      try: import yaml
+      except ImportError:
+        raise Exception('ERROR: reading selection file {} requires pyyaml.'.format(filename))
+      definitions       = yaml.safe_load(f)
+    else: definitions   = json.load(f)
+  def resolve(name, visited):
+    ### get the cuts and preselection of a definition, taking into account its base
+    if name in visited:
+      raise Exception('ERROR: circular base definition for selection {}.'.format(name))
+    if name in definitions.keys(): definition = definitions[name]
+    elif name in selections.keys(): return selections[name].definition
+    else: raise Exception('ERROR: base selection {} not found.'.format(name))
+    resolved            = {'cuts': {}, 'preselection': None}
+    if 'base' in definition.keys(): resolved = resolve(definition['base'], visited+[name])
+    resolved            = {'cuts': dict(resolved['cuts']),
+                           'preselection': (dict(resolved['preselection'])
+                                            if resolved['preselection'] is not None else None)}
+    for key in ['cuts', 'preselection']:
+      if key not in definition.keys(): continue
+      if resolved[key] is None: resolved[key] = {}
+      for cutname, expression in definition[key].items():
+        if expression is None: resolved[key].pop(cutname, None)
+        else: resolved[key][cutname] = expression
+    return resolved
+  for name, definition in definitions.items():
+    resolved            = resolve(name, [])
+    selections[name]    = Selection(name, resolved['cuts'], preselection=resolved['preselection'],
+                            description=definition.get('description', None))
+
+def get_selection(selection_name):
+  ### get a selection from the registry
+  if selection_name not in selections.keys():
+    msg         = 'ERROR: selection '+selection_name+' not recognized;'
+    msg         += ' available selections are {}.'.format(get_selectionnames())
+    raise Exception(msg)
+  return selections[selection_name]
+
+def get_selectionnames():
+  ### get the names of all available selections
+  return list(selections.keys())
+
+load_selections(selectionfile)
+
+### interface functions
+
+def selection(branches, selection_name, extra=None, cutflow=False):
+  ### evaluate a selection
+  # returns the mask of selected candidates,
+  # or a tuple of the form (mask, dict of per-cut masks) if cutflow is True
+  (selmask, allmasks)   = get_selection(selection_name).evaluate(branches, extra=extra)
   if not cutflow:   return selmask
   else:             return (selmask, allmasks)
+
+def selection_branches(selection_name, derivednames=None):
+  ### return the names of the input branches needed to evaluate a selection
+  # (derivednames: names of variables that are provided by the caller through extra)
+  if derivednames is None: derivednames = []
+  branchnames   = []
+  for name in get_selection(selection_name).variables():
+    if name in derivednames: continue
+    if name in fallbackvariables.keys(): branchnames += fallbackvariables[name][1]
+    else: branchnames.append(name)
+  return list(dict.fromkeys(branchnames))
+
+def preselection(branches, selection_name, extra=None):
+  ### loose preselection to use together with a given selection in loose build mode
+  return get_selection(selection_name).evaluate(branches, extra=extra, preselection=True)[0]
+
+def cutbits(allmasks):
+  ### pack the individual cut masks of a selection into one integer per candidate
+  # bit i is set if the candidate passes the i-th cut in allmasks
+  # (in the order of the dict, see also cutnames in the output files of loose builds)
+  if len(allmasks)==0:
+    raise Exception('ERROR: in cutbits: no cuts to pack.')
+  if len(allmasks)>32:
+    raise Exception('ERROR: in cutbits: cannot pack more than 32 cuts.')
+  bits          = None
+  for i, mask in enumerate(allmasks.values()):
+    thisbits    = mask*(1<<i)
+    bits        = thisbits if bits is None else (bits | thisbits)
+  return bits